@@ -37,6 +37,7 @@ from . import addons
 from .addons import (load, aug_etb, autoaux, autoabs,
                      DEFAULT_AUXBASIS, make_auxbasis, make_auxmol)
 from .df import DF, GDF, DF4C, GDF4C
+from .local_df import LocalDF
 
 from . import r_incore
 
@@ -18,6 +18,7 @@
 
 
 import sys
+import copy
 import numpy
 from pyscf.lib import logger
 from pyscf import gto
@@ -32,6 +33,16 @@ DFBASIS = getattr(__config__, 'df_addons_aug_etb_beta', 'weigend')
 ETB_BETA = getattr(__config__, 'df_addons_aug_dfbasis', 2.0)
 FIRST_ETB_ELEMENT = getattr(__config__, 'df_addons_aug_start_at', 36)  # 'Rb'
 
+# Auxiliary shells are pruned in make_auxmol if they are (nearly) linearly
+# dependent, in the Coulomb metric, on the other auxiliary shells of the same
+# atom. A shell is removed if the pivoted Cholesky residuals of all its
+# functions are smaller than this threshold. 0 disables the pruning.
+AUXBASIS_PRUNE_THRESHOLD = getattr(__config__, 'df_addons_auxbasis_prune_threshold', 0)
+
+# Generated (even-tempered) and pruned auxiliary basis for each element. The
+# cache is shared by all molecules in the process.
+_AUXBASIS_CACHE = {}
+
 # TODO: Switch to other default scheme for auxiliary basis generation.
 # The auxiliary basis set generated by version 2.6 (and earlier) lacks compact
 # functions. It may cause higher errors in ERI integrals.
@@ -80,7 +91,19 @@ class load(ao2mo.load):
     def __init__(self, eri, dataname='j3c'):
         ao2mo.load.__init__(self, eri, dataname)
 
+    def __enter__(self):
+        if isinstance(self.eri, str) and self.eri.endswith('.npy'):
+            # DF tensor in the .npy file is loaded as a read-only memory map
+            return numpy.load(self.eri, mmap_mode='r')
+        return ao2mo.load.__enter__(self)
+
 def _aug_etb_element(nuc_charge, basis, beta):
+    key = ('aug_etb', nuc_charge, repr(basis), beta, USE_VERSION_26_AUXBASIS)
+    if key not in _AUXBASIS_CACHE:
+        _AUXBASIS_CACHE[key] = _gen_aug_etb_element(nuc_charge, basis, beta)
+    return copy.deepcopy(_AUXBASIS_CACHE[key])
+
+def _gen_aug_etb_element(nuc_charge, basis, beta):
     l_max = max(b[0] for b in basis)
     emin_by_l = [1e99] * (l_max+1)
     emax_by_l = [0] * (l_max+1)
@@ -222,6 +245,63 @@ def make_auxbasis(mol, *, xc='HF', mp2fit=False):
                 logger.debug(mol, '  ETB auxbasis for %s  %s', k, auxbasis[k])
     return auxbasis
 
+def prune_auxbasis(mol, auxbasis, threshold=AUXBASIS_PRUNE_THRESHOLD):
+    '''Remove the auxiliary shells which are linearly dependent on the other
+    shells of the same element in the Coulomb metric.
+
+    The Coulomb metric of the (normalized) auxiliary functions of each element
+    is decomposed by pivoted Cholesky decomposition. A shell is removed if the
+    residuals of all its functions are smaller than threshold.
+
+    Args:
+        auxbasis : dict
+            Auxiliary basis in the internal format (the output of
+            Mole.format_basis)
+
+    Returns:
+        A dict of the pruned auxiliary basis
+    '''
+    newbasis = {}
+    for symb, basis in auxbasis.items():
+        key = ('prune', symb, repr(basis), threshold, mol.cart)
+        if key not in _AUXBASIS_CACHE:
+            _AUXBASIS_CACHE[key] = _prune_element_auxbasis(symb, basis,
+                                                           threshold, mol.cart)
+        # A copy, so that the caller cannot modify the cache
+        newbasis[symb] = copy.deepcopy(_AUXBASIS_CACHE[key])
+        if len(newbasis[symb]) < len(basis):
+            logger.debug(mol, 'Auxbasis for %s: %d of %d shells are removed',
+                         symb, len(basis) - len(newbasis[symb]), len(basis))
+    return newbasis
+
+def _prune_element_auxbasis(symb, basis, threshold, cart=False):
+    if not basis:
+        return basis
+    atm, bas, env = gto.mole.make_env([[symb, (0., 0., 0.)]], {symb: basis})
+    if cart:
+        intor = 'int2c2e_cart'
+    else:
+        intor = 'int2c2e_sph'
+    j2c = gto.moleintor.getints(intor, atm, bas, env, hermi=1)
+    ao_loc = gto.moleintor.make_loc(bas, intor)
+    norm = 1. / numpy.sqrt(j2c.diagonal())
+    j2c = j2c * norm[:,None] * norm
+
+    n = j2c.shape[0]
+    residual = j2c.diagonal().copy()
+    cd = numpy.zeros((n, n))
+    kept = numpy.zeros(n, dtype=bool)
+    for k in range(n):
+        p = numpy.argmax(residual)
+        if residual[p] < threshold:
+            break
+        kept[p] = True
+        cd[:,k] = (j2c[:,p] - cd[:,:k].dot(cd[p,:k])) / residual[p]**.5
+        residual -= cd[:,k]**2
+        residual[kept] = 0
+
+    return [b for i, b in enumerate(basis) if kept[ao_loc[i]:ao_loc[i+1]].any()]
+
 # TODO: add auxbasis keyword etb and auto
 def make_auxmol(mol, auxbasis=None):
     '''Generate a fake Mole object which uses the density fitting auxbasis as
@@ -274,11 +354,19 @@ Three routines are available for this system:
 ''')
         raise
 
+    if AUXBASIS_PRUNE_THRESHOLD > 0:
+        bas = pmol.make_env(mol._atom, pmol._basis)[1]
+        nao_unpruned = gto.moleintor.make_loc(bas, pmol.cart and 'cart' or 'sph')[-1]
+        pmol._basis = prune_auxbasis(mol, pmol._basis, AUXBASIS_PRUNE_THRESHOLD)
+
     # Note: To pass parameters like gauge origin, rsh-omega to auxmol,
     # mol._env[:PTR_ENV_START] must be copied to auxmol._env
     pmol._atm, pmol._bas, pmol._env = \
             pmol.make_env(mol._atom, pmol._basis, mol._env[:gto.PTR_ENV_START])
     pmol._built = True
+    if AUXBASIS_PRUNE_THRESHOLD > 0:
+        logger.info(mol, 'Pruned auxbasis: num cGTOs %d -> %d',
+                    nao_unpruned, pmol.nao_nr())
     logger.debug(mol, 'num shells = %d, num cGTOs = %d',
                  pmol.nbas, pmol.nao_nr())
     return pmol
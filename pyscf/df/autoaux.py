@@ -21,6 +21,7 @@ Ref:
     JCTC, 13 (2016), 554
 '''
 
+import copy
 from math import factorial
 import numpy as np
 from pyscf import gto
@@ -69,7 +70,18 @@ def _primitive_emin_emax(basis):
         e_eff_by_l[l] = max(e_eff.max(), e_eff_by_l[l])
     return np.array(emax_by_l), np.array(emin_by_l), np.array(e_eff_by_l)
 
+# Generated auxiliary basis for each element, keyed by the element and the
+# orbital basis of the element. The cache is shared by all molecules in the
+# process.
+_ETB_CACHE = {}
+
 def _auto_aux_element(Z, basis, ecp_core=0):
+    key = (Z, repr(basis), ecp_core)
+    if key not in _ETB_CACHE:
+        _ETB_CACHE[key] = _gen_auto_aux_element(Z, basis, ecp_core)
+    return copy.deepcopy(_ETB_CACHE[key])
+
+def _gen_auto_aux_element(Z, basis, ecp_core=0):
     a_max_by_l, a_min_by_l, a_eff_by_l = _primitive_emin_emax(basis)
     a_min_prim = a_min_by_l[:,None] + a_min_by_l
     a_max_prim = a_max_by_l[:,None] + a_max_by_l
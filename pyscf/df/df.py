@@ -21,6 +21,7 @@ J-metric density fitting
 '''
 
 
+import os
 import tempfile
 import contextlib
 import numpy
@@ -71,12 +72,22 @@ class DF(lib.StreamObject):
         blockdim : int
             When reading DF integrals from disk the chunk size to load.  It is
             used to improve IO performance.
+
+    If _cderi_to_save is a file name with the extension .npy, the DF integral
+    tensor is saved in the numpy .npy format and is accessed through a
+    read-only memory map. The file can be assigned to _cderi of the DF
+    objects in other processes. These processes share the same pages of the
+    file in the OS page cache. The tensor can be stored in single precision
+    if _cderi_dtype is set to numpy.float32. Data are converted to double
+    precision when they are loaded by DF.loop.
     '''
 
     blockdim = getattr(__config__, 'df_df_DF_blockdim', 240)
 
     # Store DF tensor in a format compatible to pyscf-1.1 - pyscf-1.6
     _compatible_format = getattr(__config__, 'df_df_DF_compatible_format', False)
+    # Data type of the DF tensor in the .npy storage
+    _cderi_dtype = getattr(__config__, 'df_df_DF_cderi_dtype', numpy.double)
     _dataname = 'j3c'
 
     _keys = {'mol', 'auxmol'}
@@ -144,7 +155,25 @@ class DF(lib.StreamObject):
         max_memory = self.max_memory - lib.current_memory()[0]
         int3c = mol._add_suffix('int3c2e')
         int2c = mol._add_suffix('int2c2e')
-        if (nao_pair*naux*8/1e6 < .9*max_memory and not is_custom_storage):
+        if is_custom_storage and self._cderi_to_save.endswith('.npy'):
+            if nao_pair*naux*8/1e6 < .9*max_memory:
+                self._cderi = incore.cholesky_eri(mol, int3c=int3c, int2c=int2c,
+                                                  auxmol=auxmol,
+                                                  max_memory=max_memory, verbose=log)
+            else:
+                self._cderi = tempfile.NamedTemporaryFile(dir=lib.param.TMPDIR)
+                outcore.cholesky_eri_b(mol, self._cderi, dataname=self._dataname,
+                                       int3c=int3c, int2c=int2c, auxmol=auxmol,
+                                       max_memory=max_memory, verbose=log)
+            cderi_name = self._cderi_to_save
+            if self._dataname != DF._dataname:
+                # Integrals of RSH-DF objects
+                cderi_name = '%s-%s.npy' % (cderi_name[:-4],
+                                            self._dataname.replace('/', '-'))
+            log.info('_cderi_to_save = %s', cderi_name)
+            self._cderi = _save_cderi_npy(self, cderi_name, self._cderi_dtype)
+            log.timer_debug1('Generate density fitting integrals', *t0)
+        elif (nao_pair*naux*8/1e6 < .9*max_memory and not is_custom_storage):
             self._cderi = incore.cholesky_eri(mol, int3c=int3c, int2c=int2c,
                                               auxmol=auxmol,
                                               max_memory=max_memory, verbose=log)
@@ -201,7 +230,9 @@ class DF(lib.StreamObject):
             if isinstance(feri, numpy.ndarray):
                 naoaux = feri.shape[0]
                 for b0, b1 in self.prange(0, naoaux, blksize):
-                    yield numpy.asarray(feri[b0:b1], order='C')
+                    # No copy for the double precision tensor in memory or
+                    # in the memory-mapped .npy file
+                    yield numpy.asarray(feri[b0:b1], dtype=numpy.double, order='C')
 
             else:
                 if isinstance(feri, h5py.Group):
@@ -316,6 +347,27 @@ class DF(lib.StreamObject):
 
 GDF = DF
 
+def _save_cderi_npy(dfobj, filename, dtype=numpy.double):
+    '''Save the DF tensor of dfobj in the .npy file. The tensor is first
+    written to a temporary file in the same directory, then the temporary
+    file is renamed. Other processes reading the same file would not see the
+    partially written tensor.
+    '''
+    naux = dfobj.get_naoaux()
+    nao = dfobj.mol.nao_nr()
+    shape = (naux, nao*(nao+1)//2)
+    tmpname = '%s.%d.tmp' % (filename, os.getpid())
+    out = numpy.lib.format.open_memmap(tmpname, mode='w+', dtype=dtype,
+                                       shape=shape)
+    p1 = 0
+    for eri1 in dfobj.loop():
+        p0, p1 = p1, p1 + eri1.shape[0]
+        out[p0:p1] = eri1
+    out.flush()
+    out = None
+    os.replace(tmpname, filename)
+    return filename
+
 
 class DF4C(DF):
     '''Relativistic 4-component'''
@@ -345,10 +397,20 @@ class DF4C(DF):
         with addons.load(self._cderi[0], self._dataname) as ferill:
             naoaux = ferill.shape[0]
             with addons.load(self._cderi[1], self._dataname) as feriss: # python2.6 not support multiple with
-                for b0, b1 in self.prange(0, naoaux, blksize):
+                def load(aux_slice):
+                    b0, b1 = aux_slice
                     erill = numpy.asarray(ferill[b0:b1], order='C')
                     eriss = numpy.asarray(feriss[b0:b1], order='C')
-                    yield erill, eriss
+                    return erill, eriss
+
+                if isinstance(ferill, numpy.ndarray):
+                    for aux_slice in self.prange(0, naoaux, blksize):
+                        yield load(aux_slice)
+                else:
+                    # Read the next block from the HDF5 file in background
+                    for dat in lib.map_with_prefetch(load, self.prange(0, naoaux, blksize)):
+                        yield dat
+                        dat = None
 
     def get_jk(self, dm, hermi=1, with_j=True, with_k=True,
                direct_scf_tol=getattr(__config__, 'scf_hf_SCF_direct_scf_tol', 1e-13),
@@ -23,9 +23,16 @@ from pyscf import lib
 from pyscf import scf
 from pyscf.lib import logger
 from pyscf.ao2mo import _ao2mo
+from pyscf import __config__
 
 DEBUG = False
 
+# For hermitian density matrices without the mo_coeff tag, K matrix is built
+# from the eigenvectors of the density matrix if the number of eigenvalues
+# larger than K_DM_EIG_CUTOFF is less than K_RANK_RATIO * nao.
+K_RANK_RATIO = getattr(__config__, 'df_df_jk_k_rank_ratio', .5)
+K_DM_EIG_CUTOFF = getattr(__config__, 'df_df_jk_k_dm_eig_cutoff', 1e-13)
+
 libri = lib.load_library('libri')
 
 def density_fit(mf, auxbasis=None, with_df=None, only_dfj=False):
@@ -298,31 +305,16 @@ def get_jk(dfobj, dm, hermi=0, with_j=True, with_k=True, direct_scf_tol=1e-13):
         dmtril = lib.pack_tril(dms + dms.conj().transpose(0,2,1))
         dmtril[:,idx*(idx+1)//2+idx] *= .5
 
+    orbo = None
+    if with_k:
+        orbo = _occ_orbitals(dm, dms, hermi)
+
     if not with_k:
         for eri1 in dfobj.loop():
             # uses numpy.matmul
             vj += dmtril.dot(eri1.T).dot(eri1)
 
-    elif getattr(dm, 'mo_coeff', None) is not None:
-        #TODO: test whether dm.mo_coeff matching dm
-        mo_coeff = numpy.asarray(dm.mo_coeff, order='F')
-        mo_occ   = numpy.asarray(dm.mo_occ)
-        nmo = mo_occ.shape[-1]
-        mo_coeff = mo_coeff.reshape(-1,nao,nmo)
-        mo_occ   = mo_occ.reshape(-1,nmo)
-        if mo_occ.shape[0] * 2 == nset: # handle ROHF DM
-            mo_coeff = numpy.vstack((mo_coeff, mo_coeff))
-            mo_occa = numpy.array(mo_occ> 0, dtype=numpy.double)
-            mo_occb = numpy.array(mo_occ==2, dtype=numpy.double)
-            assert (mo_occa.sum() + mo_occb.sum() == mo_occ.sum())
-            mo_occ = numpy.vstack((mo_occa, mo_occb))
-
-        orbo = []
-        for k in range(nset):
-            c = numpy.einsum('pi,i->pi', mo_coeff[k][:,mo_occ[k]>0],
-                             numpy.sqrt(mo_occ[k][mo_occ[k]>0]))
-            orbo.append(numpy.asarray(c, order='F'))
-
+    elif orbo is not None:
         max_memory = dfobj.max_memory - lib.current_memory()[0]
         blksize = max(4, int(min(dfobj.blockdim, max_memory*.3e6/8/nao**2)))
         buf = numpy.empty((blksize*nao,nao))
@@ -334,17 +326,20 @@ def get_jk(dfobj, dm, hermi=0, with_j=True, with_k=True, direct_scf_tol=1e-13):
                 vj += dmtril.dot(eri1.T).dot(eri1)
 
             for k in range(nset):
-                nocc = orbo[k].shape[1]
-                if nocc > 0:
+                for c, sign in orbo[k]:
+                    nocc = c.shape[1]
                     buf1 = buf[:naux*nocc]
                     fdrv(ftrans, fmmm,
                          buf1.ctypes.data_as(ctypes.c_void_p),
                          eri1.ctypes.data_as(ctypes.c_void_p),
-                         orbo[k].ctypes.data_as(ctypes.c_void_p),
+                         c.ctypes.data_as(ctypes.c_void_p),
                          ctypes.c_int(naux), ctypes.c_int(nao),
                          (ctypes.c_int*4)(0, nocc, 0, nao),
                          null, ctypes.c_int(0))
-                    vk[k] += lib.dot(buf1.T, buf1)
+                    if sign > 0:
+                        vk[k] += lib.dot(buf1.T, buf1)
+                    else:
+                        vk[k] -= lib.dot(buf1.T, buf1)
             t1 = log.timer_debug1('jk', *t1)
     else:
         #:vk = numpy.einsum('pij,jk->pki', cderi, dm)
@@ -379,6 +374,60 @@ def get_jk(dfobj, dm, hermi=0, with_j=True, with_k=True, direct_scf_tol=1e-13):
     logger.timer(dfobj, 'df vj and vk', *t0)
     return vj, vk
 
+def _occ_orbitals(dm, dms, hermi=0):
+    '''Factorize the density matrices dms[k] = sum_s s * c_s c_s^T for the
+    orbital-driven K builder. Returns a list (one entry per density matrix) of
+    [(c, sign), ...] or None if the factorization is not profitable.
+
+    Orbitals are taken from the mo_coeff and mo_occ tags of dm if available.
+    Otherwise, hermitian density matrices are diagonalized, and the positive
+    and the negative eigenvalues are assigned to separated sets of orbitals.
+    '''
+    nset, nao = dms.shape[:2]
+    if getattr(dm, 'mo_coeff', None) is not None:
+        #TODO: test whether dm.mo_coeff matching dm
+        mo_coeff = numpy.asarray(dm.mo_coeff, order='F')
+        mo_occ   = numpy.asarray(dm.mo_occ)
+        nmo = mo_occ.shape[-1]
+        mo_coeff = mo_coeff.reshape(-1,nao,nmo)
+        mo_occ   = mo_occ.reshape(-1,nmo)
+        if mo_occ.shape[0] * 2 == nset: # handle ROHF DM
+            mo_coeff = numpy.vstack((mo_coeff, mo_coeff))
+            mo_occa = numpy.array(mo_occ> 0, dtype=numpy.double)
+            mo_occb = numpy.array(mo_occ==2, dtype=numpy.double)
+            assert (mo_occa.sum() + mo_occb.sum() == mo_occ.sum())
+            mo_occ = numpy.vstack((mo_occa, mo_occb))
+
+        orbo = []
+        for k in range(nset):
+            c = numpy.einsum('pi,i->pi', mo_coeff[k][:,mo_occ[k]>0],
+                             numpy.sqrt(mo_occ[k][mo_occ[k]>0]))
+            if c.shape[1] > 0:
+                orbo.append([(numpy.asarray(c, order='F'), 1)])
+            else:
+                orbo.append([])
+        return orbo
+
+    if hermi != 1:
+        return None
+
+    orbo = []
+    for k in range(nset):
+        e, v = scipy.linalg.eigh(dms[k])
+        pos = e > K_DM_EIG_CUTOFF
+        neg = e < -K_DM_EIG_CUTOFF
+        if numpy.count_nonzero(pos) + numpy.count_nonzero(neg) >= K_RANK_RATIO * nao:
+            return None
+        orbo_k = []
+        if numpy.any(pos):
+            c = v[:,pos] * numpy.sqrt(e[pos])
+            orbo_k.append((numpy.asarray(c, order='F'), 1))
+        if numpy.any(neg):
+            c = v[:,neg] * numpy.sqrt(-e[neg])
+            orbo_k.append((numpy.asarray(c, order='F'), -1))
+        orbo.append(orbo_k)
+    return orbo
+
 def get_j(dfobj, dm, hermi=0, direct_scf_tol=1e-13):
     from pyscf.scf import _vhf
     from pyscf.scf import jk
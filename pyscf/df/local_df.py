@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# Copyright 2014-2024 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Local density fitting with atom-pair restricted auxiliary domains
+(pair-atomic RI, see Merlot et al. J. Chem. Phys. 139, 234109 (2013);
+Manzer et al. J. Chem. Phys. 143, 024113 (2015))
+
+The Coulomb matrix is computed with the integral-direct RI-J of the entire
+auxiliary basis (see df_jk.get_j). It is identical to that of the global
+density fitting and no 3-index tensor is stored.
+
+For the exchange matrix, the orbital pair densities mu(A) nu(B) are fitted
+with the auxiliary functions on the atoms of the domain of the atom pair
+(A, B). The domain includes the atoms A, B and the atoms within
+LocalDF.aux_domain_radius to A or B. The fitting coefficients
+
+    C^{AB}_{P,mu nu} = sum_Q [(P|Q)^{AB}]^{-1} (Q|mu nu),    P, Q in domain
+
+are stored for each significant atom pair. The exchange integrals are
+approximated by
+
+    (mu nu|la si) = sum_{PQ} C_{P,mu nu} (P|Q) C_{Q,la si}
+
+where (P|Q) is the metric of the entire auxiliary basis. The density matrix
+is factorized D = a b^T (occupied orbitals if the mo_coeff tags are
+available, SVD otherwise) and
+
+    Y^a_{P,i mu} = sum_nu C_{P,mu nu} a_{nu i}
+    K_{mu la} = sum_{PQ,i} Y^a_{P,i mu} (P|Q) Y^b_{Q,i la}
+
+Y^a of atom A only has the auxiliary functions of the domains of the pairs of
+A. The cost is O(N_aux N_ext N_ao N_occ) where N_ext is the number of these
+auxiliary functions, against O(N_aux N_ao^2 N_occ) for global DF.
+'''
+
+import numpy
+import scipy.linalg
+from pyscf import lib
+from pyscf import gto
+from pyscf.lib import logger
+from pyscf.df import addons
+from pyscf.df import df_jk
+from pyscf.df.df import DF
+from pyscf import __config__
+
+# Atom pairs are neglected if the max overlap between the AOs of the two
+# atoms is smaller than PAIR_CUTOFF. The error of the exchange energy of
+# n-alkanes (cc-pVDZ) is dominated by the auxiliary domains up to 1e-4.
+PAIR_CUTOFF = getattr(__config__, 'df_local_df_pair_cutoff', 1e-4)
+
+
+class LocalDF(DF):
+    '''Local density fitting object. The exchange matrix is computed with the
+    fitting coefficients of atom pairs. The Coulomb matrix is computed with
+    the integral-direct RI-J of the entire auxiliary basis.
+
+    Attributes:
+        aux_domain_radius : float
+            The auxiliary functions on atoms within this distance (in Bohr)
+            to either atom of an atom pair are used to fit the pair densities.
+            With the default 5 Bohr, the exchange energy of n-alkanes and
+            water clusters (cc-pVDZ, weigend) differs from that of global DF
+            by about 2e-6 Eh per atom.
+        pair_cutoff : float
+            Atom pairs are neglected if the max overlap between the AOs of the
+            two atoms is smaller than pair_cutoff.
+
+    Examples:
+
+    >>> mol = gto.M(atom='N 0 0 0; N 0 0 1.2', basis='ccpvdz')
+    >>> mf = scf.RHF(mol).density_fit()
+    >>> mf.with_df = df.LocalDF(mol, auxbasis='weigend')
+    >>> mf.kernel()
+    '''
+
+    aux_domain_radius = getattr(__config__, 'df_local_df_LocalDF_aux_domain_radius', 5.)
+    pair_cutoff = PAIR_CUTOFF
+
+    _keys = {'aux_domain_radius', 'pair_cutoff'}
+
+    def __init__(self, mol, auxbasis=None):
+        DF.__init__(self, mol, auxbasis)
+        self._metric = None
+        # {(A, B): (aux_idx, coeff)} for the significant atom pairs A >= B.
+        # aux_idx are the auxiliary functions of the domain of the pair and
+        # coeff are the fitting coefficients C^{AB}_{P,mu nu}
+        self._pair_coeff = None
+
+    __getstate__, __setstate__ = lib.generate_pickle_methods(
+            excludes=('_cderi_to_save', '_cderi', '_vjopt', '_rsh_df',
+                      '_metric', '_pair_coeff'),
+            reset_state=True)
+
+    def dump_flags(self, verbose=None):
+        DF.dump_flags(self, verbose)
+        log = logger.new_logger(self, verbose)
+        log.info('aux_domain_radius = %s', self.aux_domain_radius)
+        log.info('pair_cutoff = %g', self.pair_cutoff)
+        return self
+
+    def build(self):
+        t0 = (logger.process_clock(), logger.perf_counter())
+        log = logger.new_logger(self)
+        self.check_sanity()
+        self.dump_flags()
+
+        mol = self.mol
+        auxmol = self.auxmol = addons.make_auxmol(mol, self.auxbasis)
+        natm = mol.natm
+        nao = mol.nao_nr()
+        naux = auxmol.nao_nr()
+        aoslices = mol.aoslice_by_atom()
+        auxslices = auxmol.aoslice_by_atom()
+
+        self._metric = metric = auxmol.intor('int2c2e', hermi=1)
+
+        ovlp = mol.intor_symmetric('int1e_ovlp')
+        atm_loc = numpy.append(aoslices[:,2], aoslices[-1,3])
+        ovlp_cond = lib.condense('NP_absmax', ovlp, atm_loc)
+        has_ao = aoslices[:,2] < aoslices[:,3]
+        pair_mask = (ovlp_cond >= self.pair_cutoff) & has_ao[:,None] & has_ao
+        domain_mask = gto.inter_distance(mol) <= self.aux_domain_radius
+        domain_mask[numpy.diag_indices(natm)] = True
+        domain_mask[:,auxslices[:,2] == auxslices[:,3]] = False
+
+        # 3-center integrals are evaluated for the shells of the consecutive
+        # atoms in the domain
+        intor = mol._add_suffix('int3c2e')
+        atm, bas, env = gto.mole.conc_env(mol._atm, mol._bas, mol._env,
+                                          auxmol._atm, auxmol._bas, auxmol._env)
+        cintopt = gto.moleintor.make_cintopt(atm, bas, env, intor)
+        nbas = mol.nbas
+        atom_aux = [numpy.arange(*auxslices[ka,2:]) for ka in range(natm)]
+        pair_coeff = {}
+        for ia in range(natm):
+            ish0, ish1, i0, i1 = aoslices[ia]
+            for ja in numpy.where(pair_mask[ia,:ia+1])[0]:
+                jsh0, jsh1, j0, j1 = aoslices[ja]
+                domain = numpy.where(domain_mask[ia] | domain_mask[ja])[0]
+                if domain.size == 0:
+                    continue
+                runs = numpy.split(domain, numpy.where(numpy.diff(domain) > 1)[0] + 1)
+                int3c = [gto.moleintor.getints(
+                            intor, atm, bas, env, (ish0, ish1, jsh0, jsh1,
+                                                   nbas+auxslices[run[0],0],
+                                                   nbas+auxslices[run[-1],1]),
+                            cintopt=cintopt)
+                         .reshape(-1, auxslices[run[-1],3]-auxslices[run[0],2])
+                         for run in runs]
+                p_idx = numpy.hstack([atom_aux[ka] for ka in domain])
+                coeff = scipy.linalg.solve(metric[p_idx[:,None],p_idx],
+                                           numpy.hstack(int3c).T, assume_a='pos')
+                pair_coeff[ia,ja] = (p_idx, coeff.reshape(-1,i1-i0,j1-j0))
+        self._pair_coeff = pair_coeff
+
+        if log.verbose >= logger.INFO:
+            nstored = sum(c.size for p, c in pair_coeff.values())
+            log.info('LocalDF: %d significant atom pairs. Storage %.2f MB '
+                     '(%.2f MB for global DF)', len(pair_coeff),
+                     nstored*8/1e6, naux*nao*(nao+1)//2*8/1e6)
+        log.timer('Local density fitting coefficients', *t0)
+
+        if log.verbose >= logger.DEBUG:
+            from pyscf.scf import hf
+            self.fitting_error(hf.init_guess_by_minao(mol))
+        return self
+
+    def reset(self, mol=None):
+        DF.reset(self, mol)
+        self._metric = None
+        self._pair_coeff = None
+        return self
+
+    def get_naoaux(self):
+        if self._pair_coeff is None:
+            self.build()
+        return self._metric.shape[0]
+
+    def loop(self, blksize=None):
+        raise NotImplementedError(
+            'LocalDF does not store the Cholesky decomposed integrals. '
+            'Use DF for get_eri and ao2mo')
+
+    def get_jk(self, dm, hermi=1, with_j=True, with_k=True,
+               direct_scf_tol=getattr(__config__, 'scf_hf_SCF_direct_scf_tol', 1e-13),
+               omega=None):
+        if omega is not None:
+            raise NotImplementedError('LocalDF for range-separated Coulomb')
+        return get_jk(self, dm, hermi, with_j, with_k, direct_scf_tol)
+
+    def fitting_error(self, dm, hermi=1):
+        '''Compare the J and K matrices of the given density matrix with
+        those of the global density fitting (using the same auxiliary basis).
+
+        Returns:
+            The max absolute errors of the J and K matrices.
+        '''
+        gdf = DF(self.mol, self.auxbasis)
+        gdf.stdout = self.stdout
+        gdf.verbose = self.verbose
+        gdf.max_memory = self.max_memory
+        vj0, vk0 = gdf.get_jk(dm, hermi)
+        vj1, vk1 = self.get_jk(dm, hermi)
+        err_j = abs(vj1 - vj0).max()
+        err_k = abs(vk1 - vk0).max()
+        err_ek = numpy.einsum('...ij,...ji->', numpy.asarray(dm), vk1 - vk0).real * .25
+        logger.info(self, 'Errors of LocalDF against global DF: '
+                    'max|dJ| = %.4g  max|dK| = %.4g  dE_K = %.4g',
+                    err_j, err_k, err_ek)
+        return err_j, err_k
+
+
+def get_jk(dfobj, dm, hermi=1, with_j=True, with_k=True, direct_scf_tol=1e-13):
+    '''J matrices with the integral-direct RI-J and K matrices using the
+    sparse fitting coefficients of LocalDF'''
+    t0 = (logger.process_clock(), logger.perf_counter())
+    if dfobj._pair_coeff is None:
+        dfobj.build()
+
+    dms = numpy.asarray(dm)
+    dm_shape = dms.shape
+    nao = dm_shape[-1]
+    dms = dms.reshape(-1,nao,nao)
+
+    vj = vk = None
+    if with_j:
+        if numpy.iscomplexobj(dms):
+            vj = df_jk.get_j(dfobj, dms.real, hermi, direct_scf_tol)
+            vj = vj + df_jk.get_j(dfobj, dms.imag, hermi, direct_scf_tol) * 1j
+        else:
+            vj = df_jk.get_j(dfobj, dms, hermi, direct_scf_tol)
+        vj = vj.reshape(dm_shape)
+        t0 = logger.timer_debug1(dfobj, 'LocalDF vj', *t0)
+
+    if with_k:
+        vk = numpy.zeros_like(dms)
+        for k, factors in enumerate(_dm_factors(dm, dms, hermi)):
+            for a, b, sign in factors:
+                vk[k] += _get_k(dfobj, a, b, sign)
+        vk = vk.reshape(dm_shape)
+    logger.timer(dfobj, 'LocalDF vj and vk', *t0)
+    return vj, vk
+
+def _dm_factors(dm, dms, hermi):
+    '''Factorize the density matrices D = sign * a b^T. Returns for each
+    density matrix a list of (a, b, sign). b is None if b = a.
+    '''
+    if not numpy.iscomplexobj(dms):
+        orbo = df_jk._occ_orbitals(dm, dms, hermi)
+        if orbo is not None and not any(numpy.iscomplexobj(c)
+                                        for orbo_k in orbo for c, sign in orbo_k):
+            return [[(c, None, sign) for c, sign in orbo_k] for orbo_k in orbo]
+
+    factors = []
+    for k in range(dms.shape[0]):
+        u, s, vh = scipy.linalg.svd(dms[k])
+        keep = s > df_jk.K_DM_EIG_CUTOFF
+        s = numpy.sqrt(s[keep])
+        if numpy.any(keep):
+            factors.append([(u[:,keep] * s, vh[keep].T * s, 1)])
+        else:
+            factors.append([])
+    return factors
+
+def _index_of(idx, sub_idx):
+    '''Positions of sub_idx in the sorted array idx. A slice is returned if
+    the positions are consecutive.'''
+    pos = numpy.searchsorted(idx, sub_idx)
+    if pos.size > 0 and pos[-1] - pos[0] + 1 == pos.size:
+        return slice(pos[0], pos[-1] + 1)
+    return pos
+
+def _half_transform(dfobj, atom_aux, orb):
+    '''Y_A[P,i,mu] = sum_nu C^{AB}_{P,mu nu} orb[nu,i] for the AOs mu of
+    atom A and the auxiliary functions P of all pair domains of atom A'''
+    aoslices = dfobj.mol.aoslice_by_atom()
+    norb = orb.shape[1]
+    y = [numpy.zeros((aux.size, norb, aoslices[ia,3]-aoslices[ia,2]), dtype=orb.dtype)
+         for ia, aux in enumerate(atom_aux)]
+    for (ia, ja), (p_idx, coeff) in dfobj._pair_coeff.items():
+        i0, i1 = aoslices[ia,2:]
+        j0, j1 = aoslices[ja,2:]
+        naux, ni, nj = coeff.shape
+        #:y[ia][rows] += einsum('pmn,ni->pim', coeff, orb[j0:j1])
+        rows = _index_of(atom_aux[ia], p_idx)
+        y[ia][rows] += lib.dot(coeff.reshape(-1,nj), orb[j0:j1]
+                               ).reshape(naux,ni,norb).transpose(0,2,1)
+        if ia != ja:
+            #:y[ja][rows] += einsum('pmn,mi->pin', coeff, orb[i0:i1])
+            rows = _index_of(atom_aux[ja], p_idx)
+            y[ja][rows] += lib.dot(coeff.transpose(0,2,1).reshape(-1,ni), orb[i0:i1]
+                                   ).reshape(naux,nj,norb).transpose(0,2,1)
+    return y
+
+def _get_k(dfobj, a, b=None, sign=1):
+    '''K_{mu la} = sign * sum_{PQ,i} Ya_{P,i,mu} (P|Q) Yb_{Q,i,la} for the
+    density matrix sign * a b^T. The Y intermediates of a block of orbitals i
+    are held in memory. If b is None, b = a and K is symmetric. Only half of
+    the atom blocks of K are computed.
+    '''
+    mol = dfobj.mol
+    natm = mol.natm
+    nao = a.shape[0]
+    metric = dfobj._metric
+    naux = metric.shape[0]
+    aoslices = mol.aoslice_by_atom()
+    ao_loc = aoslices[:,2:]
+
+    # The auxiliary functions of the pair domains of each atom
+    aux_mask = numpy.zeros((natm, naux), dtype=bool)
+    for (ia, ja), (p_idx, coeff) in dfobj._pair_coeff.items():
+        aux_mask[ia,p_idx] = aux_mask[ja,p_idx] = True
+    atom_aux = [numpy.where(m)[0] for m in aux_mask]
+    symm = b is None
+    if symm:
+        # Only the atom blocks K[A,C] with A after C are computed. Atoms are
+        # ordered along the principal axis of the molecule so that (P|Q) Yb
+        # of atom C is needed for the domains of fewer atoms.
+        coords = mol.atom_coords()
+        coords = coords - coords.mean(axis=0)
+        axis = numpy.linalg.eigh(coords.T.dot(coords))[1][:,-1]
+        order = numpy.argsort(coords.dot(axis), kind='stable')
+        rows_mask = numpy.empty_like(aux_mask)
+        rows_mask[order] = numpy.logical_or.accumulate(aux_mask[order[::-1]],
+                                                       axis=0)[::-1]
+    else:
+        order = numpy.arange(natm)
+        rows_mask = numpy.ones((natm, naux), dtype=bool)
+
+    nocc = a.shape[1]
+    ysize = sum(aux.size * (i1 - i0) for aux, (i0, i1) in zip(atom_aux, ao_loc))
+    max_memory = dfobj.max_memory - lib.current_memory()[0]
+    unit = ysize * (1 + (not symm)) + naux * (ao_loc[:,1] - ao_loc[:,0]).max()
+    blksize = max(1, min(nocc, int(max_memory*1e6/16/unit)))
+
+    vk = numpy.zeros((nao,nao), dtype=a.dtype if symm else numpy.result_type(a, b))
+    for p0, p1 in lib.prange(0, nocc, blksize):
+        ya = _half_transform(dfobj, atom_aux, a[:,p0:p1])
+        if symm:
+            yb = ya
+        else:
+            yb = _half_transform(dfobj, atom_aux, b[:,p0:p1])
+        for k, ic in enumerate(order):
+            c0, c1 = ao_loc[ic]
+            if c0 == c1 or atom_aux[ic].size == 0:
+                continue
+            rows = numpy.where(rows_mask[ic])[0]
+            #:v = einsum('PQ,Qil->Pil', metric[rows,aux_c], yb[ic])
+            v = lib.dot(metric[rows[:,None],atom_aux[ic]],
+                        yb[ic].reshape(atom_aux[ic].size,-1))
+            v = v.reshape(rows.size, -1, c1-c0)
+            for ia in order[k if symm else 0:]:
+                a0, a1 = ao_loc[ia]
+                if a0 == a1 or atom_aux[ia].size == 0:
+                    continue
+                r = _index_of(rows, atom_aux[ia])
+                #:vk[a0:a1,c0:c1] += einsum('Pim,Pil->ml', ya[ia], v[r])
+                vk[a0:a1,c0:c1] += lib.dot(ya[ia].reshape(-1,a1-a0).T,
+                                           v[r].reshape(-1,c1-c0))
+        ya = yb = v = None
+
+    if symm:
+        vk = vk + vk.T
+        for a0, a1 in ao_loc:
+            vk[a0:a1,a0:a1] *= .5
+    if sign != 1:
+        vk *= sign
+    return vk
@@ -16,6 +16,7 @@
 #
 
 import unittest
+import copy
 import itertools
 import tempfile
 import numpy as np
@@ -132,6 +133,24 @@ class KnownValues(unittest.TestCase):
         self.assertTrue(auxbasis['O'] == 'cc-pvdz-jkfit')
         self.assertTrue(isinstance(auxbasis['He'], list))
 
+    def test_prune_auxbasis(self):
+        mol = gto.M(atom='He 0 0 0; O 0 0 1', basis='ccpvdz')
+        auxbasis = mol.format_basis({'O': 'cc-pvdz-jkfit'})
+        # Duplicated shells are removed
+        basis = {'O': auxbasis['O'] + auxbasis['O'][:2]}
+        pruned = df.addons.prune_auxbasis(mol, basis, 1e-8)
+        self.assertEqual(len(pruned['O']), len(auxbasis['O']))
+        # The cached basis is not affected by the changes of the output
+        ref = copy.deepcopy(pruned['O'])
+        pruned['O'][0][1][0] = 1.
+        pruned = df.addons.prune_auxbasis(mol, basis, 1e-8)
+        self.assertEqual(pruned['O'], ref)
+
+        auxmol0 = df.addons.make_auxmol(mol)
+        with lib.temporary_env(df.addons, AUXBASIS_PRUNE_THRESHOLD=1e-4):
+            auxmol1 = df.addons.make_auxmol(mol)
+        self.assertTrue(auxmol1.nao_nr() <= auxmol0.nao_nr())
+
     @unittest.skipIf(bse.basis_set_exchange is None, "BSE library not installed.")
     def test_auto_aux(self):
         from pyscf.df.autoaux import autoaux, _auto_aux_element
@@ -87,6 +87,30 @@ class KnownValues(unittest.TestCase):
         eri1 = dfobj.get_eri()
         self.assertAlmostEqual(abs(eri0-eri1).max(), 0, 9)
 
+    def test_cderi_npy_storage(self):
+        dfobj = df.DF(mol, auxbasis='weigend').build()
+        eri0 = dfobj.get_eri()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cderi_name = os.path.join(tmpdir, 'cderi.npy')
+            dfobj1 = df.DF(mol, auxbasis='weigend')
+            dfobj1._cderi_to_save = cderi_name
+            dfobj1.build()
+            self.assertEqual(dfobj1._cderi, cderi_name)
+            self.assertAlmostEqual(abs(dfobj1.get_eri() - eri0).max(), 0, 12)
+
+            # Reuse the file in another DF object
+            dfobj2 = df.DF(mol)
+            dfobj2._cderi = cderi_name
+            self.assertAlmostEqual(abs(dfobj2.get_eri() - eri0).max(), 0, 12)
+
+            cderi_name = os.path.join(tmpdir, 'cderi_f4.npy')
+            dfobj1 = df.DF(mol, auxbasis='weigend')
+            dfobj1._cderi_to_save = cderi_name
+            dfobj1._cderi_dtype = numpy.float32
+            dfobj1.build()
+            eri1 = dfobj1.get_eri()
+            self.assertAlmostEqual(abs(eri1 - eri0).max(), 0, 5)
+
     def test_init_density_fit(self):
         from pyscf.df import df_jk
         from pyscf import cc
@@ -164,6 +164,73 @@ class KnownValues(unittest.TestCase):
         vk = mf.get_k(mol, dms, hermi=0)
         self.assertAlmostEqual(lib.fp(vk), -46.530782983591152, 9)
 
+    def test_get_jk_low_rank_dm(self):
+        numpy.random.seed(2)
+        nao = mol.nao_nr()
+        c = numpy.random.random((2,nao,4)) - .5
+        # A ground state like DM and an indefinite difference DM
+        dms = numpy.array([c[0].dot(c[0].T),
+                           c[0].dot(c[0].T) - c[1].dot(c[1].T)])
+        dfobj = df.DF(mol, auxbasis='weigend')
+        vj0, vk0 = df_jk.get_jk(dfobj, dms, hermi=1)
+        with lib.temporary_env(df_jk, K_RANK_RATIO=0):
+            vj1, vk1 = df_jk.get_jk(dfobj, dms, hermi=1)
+        self.assertAlmostEqual(abs(vj0-vj1).max(), 0, 12)
+        self.assertAlmostEqual(abs(vk0-vk1).max(), 0, 11)
+
+    def test_local_df_get_jk(self):
+        numpy.random.seed(3)
+        nao = mol.nao_nr()
+        dms = numpy.random.random((2,nao,nao)) - .5
+        vj0, vk0 = df.DF(mol, auxbasis='weigend').get_jk(dms, hermi=0)
+
+        # Domains of all atom pairs include the entire auxiliary basis
+        dfobj = df.LocalDF(mol, auxbasis='weigend')
+        dfobj.aux_domain_radius = 1e3
+        vj1, vk1 = dfobj.get_jk(dms, hermi=0)
+        self.assertAlmostEqual(abs(vj1-vj0).max(), 0, 9)
+        self.assertAlmostEqual(abs(vk1-vk0).max(), 0, 9)
+
+        dm = dms[0] + dms[0].T + (dms[1] - dms[1].T) * .5j
+        vj0, vk0 = df.DF(mol, auxbasis='weigend').get_jk(dm)
+        vj1, vk1 = dfobj.get_jk(dm)
+        self.assertAlmostEqual(abs(vj1-vj0).max(), 0, 9)
+        self.assertAlmostEqual(abs(vk1-vk0).max(), 0, 9)
+
+        mf = scf.RHF(mol)
+        mo_energy, mo_coeff = mf.eig(mf.get_hcore(), mf.get_ovlp())
+        mo_occ = mf.get_occ(mo_energy, mo_coeff)
+        dm = lib.tag_array(mf.make_rdm1(mo_coeff, mo_occ), mo_coeff=mo_coeff, mo_occ=mo_occ)
+        vj0, vk0 = df.DF(mol, auxbasis='weigend').get_jk(dm)
+        dfobj.max_memory = 0
+        vj1, vk1 = dfobj.get_jk(dm)
+        self.assertAlmostEqual(abs(vj1-vj0).max(), 0, 9)
+        self.assertAlmostEqual(abs(vk1-vk0).max(), 0, 9)
+        self.assertRaises(NotImplementedError, dfobj.get_eri)
+
+    def test_local_df_scf(self):
+        dimer = gto.M(
+            verbose = 5,
+            output = '/dev/null',
+            atom = '''
+                O     0    0        0
+                H     0    -0.757   0.587
+                H     0    0.757    0.587
+                O     3.   0        0
+                H     3.   -0.757   0.587
+                H     3.   0.757    0.587''',
+            basis = 'cc-pvdz',
+        )
+        mf = scf.RHF(dimer).density_fit(auxbasis='weigend').run()
+        mf1 = scf.RHF(dimer).density_fit()
+        mf1.with_df = df.LocalDF(dimer, auxbasis='weigend')
+        mf1.kernel()
+        # J is exact. The error of K is about 2e-6 Eh per atom
+        self.assertTrue(abs(mf1.e_tot - mf.e_tot) < 1.2e-5)
+        err_j, err_k = mf1.with_df.fitting_error(mf1.make_rdm1())
+        self.assertAlmostEqual(err_j, 0, 9)
+        self.assertTrue(0 < err_k < 1e-3)
+
     def test_r_get_jk(self):
         numpy.random.seed(1)
         dfobj = df.df.DF4C(mol)
@@ -22,6 +22,8 @@ Numerical integration functions for RKS and UKS with real AO basis
 
 import warnings
 import ctypes
+import tempfile
+import weakref
 import numpy
 from pyscf import lib
 try:
@@ -48,6 +50,32 @@ SWITCH_SIZE = getattr(__config__, 'dft_numint_switch_size', 800)
 # Whether to compute density laplacian for meta-GGA functionals
 MGGA_DENSITY_LAPL = False
 
+# When NumInt.ao_cache is enabled, the fraction of max_memory that
+# NumInt.block_loop can use to keep AO values in memory across calls. The AO
+# values which do not fit are stored in a memory-mapped file of at most
+# AO_CACHE_MAX_DISK MB.
+AO_CACHE_MEMORY_RATIO = getattr(__config__, 'dft_numint_ao_cache_memory_ratio', .5)
+AO_CACHE_MAX_DISK = getattr(__config__, 'dft_numint_ao_cache_max_disk', 16000)
+
+# In nr_rks and nr_uks, the AO values of a grid block are stored for the local
+# shells only (see BlockSparseAO) if the fraction of the AOs which are not
+# negligible on the block is smaller than BLOCK_SPARSE_RATIO.
+BLOCK_SPARSE_RATIO = getattr(__config__, 'dft_numint_block_sparse_ratio', .5)
+
+# Fraction of the available memory that cache_xc_kernel can use to hold the
+# XC kernel (fxc). Larger kernels are written block by block to a
+# memory-mapped file and streamed by nr_rks_fxc and nr_uks_fxc.
+XC_KERNEL_INCORE_RATIO = getattr(__config__, 'dft_numint_xc_kernel_incore_ratio', .5)
+
+# If the number of VV10 grids is larger than VV10_LOCAL_NGRIDS, the VV10
+# kernel is evaluated with spatial neighbor lists. The pairs of grids which are
+# further than the distance that changes the VV10 energy density by at most
+# VV10_CUTOFF (see _vv10_rcut, evaluated for each box of VV10_BOX_SIZE) are
+# skipped.
+VV10_LOCAL_NGRIDS = getattr(__config__, 'dft_numint_vv10_local_ngrids', 50000)
+VV10_CUTOFF = getattr(__config__, 'dft_numint_vv10_cutoff', 1e-10)
+VV10_BOX_SIZE = getattr(__config__, 'dft_numint_vv10_box_size', 4.)
+
 def eval_ao(mol, coords, deriv=0, shls_slice=None,
             non0tab=None, cutoff=None, out=None, verbose=None):
     '''Evaluate AO function value on the given grids.
@@ -113,6 +141,50 @@ def eval_ao(mol, coords, deriv=0, shls_slice=None,
     return mol.eval_gto(feval, coords, comp, shls_slice, non0tab,
                         cutoff=cutoff, out=out)
 
+def eval_ao_sparse(mol, coords, deriv=0, non0tab=None, cutoff=None, out=None):
+    '''Evaluate the AO values of the shells which are not negligible on the
+    given grids.
+
+    Kwargs:
+        deriv : int
+            AO derivative order.
+        non0tab : 2D bool array
+            mask array to indicate whether the AO values are zero.  The mask
+            array can be obtained by calling :func:`make_mask`.  If not
+            given, it is generated for the grids.
+        cutoff : float
+            AO values smaller than cutoff will be set to zero.
+        out : ndarray
+            If provided, the AO values of the local shells are written into
+            this array.
+
+    Returns:
+        An instance of :class:`BlockSparseAO`.  It can be passed to
+        eval_rho, eval_mat and _dot_ao_dm in place of the dense AO array.
+
+    Examples:
+
+    >>> mol = gto.M(atom='O 0 0 0; H 0 0 1; H 0 1 0', basis='ccpvdz')
+    >>> coords = numpy.random.random((100,3))  # 100 random points
+    >>> ao = eval_ao_sparse(mol, coords, deriv=1)
+    >>> dm = numpy.random.random((mol.nao_nr(),mol.nao_nr()))
+    >>> rho = eval_rho(mol, ao, dm, xctype='GGA')
+    '''
+    if non0tab is None:
+        if cutoff is None:
+            non0tab = make_mask(mol, coords)
+        else:
+            non0tab = make_mask(mol, coords, cutoff=cutoff)
+    shl_idx = numpy.where(non0tab.any(axis=0))[0]
+    submol = mol.copy(deep=False)
+    submol._bas = mol._bas[shl_idx]
+    mask = numpy.asarray(non0tab[:,shl_idx], dtype=numpy.uint8, order='C')
+    ao_loc = mol.ao_loc_nr()
+    ao_idx = numpy.hstack([numpy.arange(ao_loc[i], ao_loc[i+1]) for i in shl_idx]
+                          + [numpy.zeros(0, dtype=int)])
+    ao = eval_ao(submol, coords, deriv, non0tab=mask, cutoff=cutoff, out=out)
+    return BlockSparseAO(ao, submol, ao_idx, mask, mol.nao_nr(), shl_idx)
+
 def eval_rho(mol, ao, dm, non0tab=None, xctype='LDA', hermi=0,
              with_lapl=True, verbose=None):
     r'''Calculate the electron density for LDA functional, and the density
@@ -156,6 +228,10 @@ def eval_rho(mol, ao, dm, non0tab=None, xctype='LDA', hermi=0,
     >>> dm = dm + dm.T
     >>> rho, dx_rho, dy_rho, dz_rho = eval_rho(mol, ao, dm, xctype='LDA')
     '''
+    if isinstance(ao, BlockSparseAO):
+        return eval_rho(ao.mol, ao.ao, ao.take_dm(dm), ao.non0tab, xctype,
+                        hermi, with_lapl, verbose)
+
     xctype = xctype.upper()
     ngrids, nao = ao.shape[-2:]
 
@@ -517,11 +593,33 @@ def _vv10nlc(rho, coords, vvrho, vvweight, vvcoords, nlc_pars):
     K=Kvv*(R**(1./6.))
     dKdR=(1./6.)*K
 
+    if vvcoords.shape[0] > VV10_LOCAL_NGRIDS:
+        F = numpy.empty_like(R)
+        U = numpy.empty_like(R)
+        W = numpy.empty_like(R)
+        for idx, vvidx in _vv10_neighbor_lists(coords, R, W0, vvcoords, RpW, W0p):
+            F[idx], U[idx], W[idx] = _vv10nlc_kernel(
+                coords[idx], vvcoords[vvidx], W0[idx], K[idx],
+                W0p[vvidx], Kp[vvidx], RpW[vvidx])
+    else:
+        F, U, W = _vv10nlc_kernel(coords, vvcoords, W0, K, W0p, Kp, RpW)
+    #exc is multiplied by Rho later
+    exc[threshind] = Beta+0.5*F
+    vxc[0,threshind] = Beta+F+1.5*(U*dKdR+W*dW0dR)
+    vxc[1,threshind] = 1.5*W*dW0dG
+    return exc,vxc
+
+def _vv10nlc_kernel(coords, vvcoords, W0, K, W0p, Kp, RpW):
     vvcoords = numpy.asarray(vvcoords, order='C')
     coords = numpy.asarray(coords, order='C')
-    F = numpy.empty_like(R)
-    U = numpy.empty_like(R)
-    W = numpy.empty_like(R)
+    W0 = numpy.asarray(W0, order='C')
+    K = numpy.asarray(K, order='C')
+    W0p = numpy.asarray(W0p, order='C')
+    Kp = numpy.asarray(Kp, order='C')
+    RpW = numpy.asarray(RpW, order='C')
+    F = numpy.empty(coords.shape[0])
+    U = numpy.empty(coords.shape[0])
+    W = numpy.empty(coords.shape[0])
     #for i in range(R.size):
     #    DX=vvcoords[:,0]-coords[i,0]
     #    DY=vvcoords[:,1]-coords[i,1]
@@ -548,11 +646,78 @@ def _vv10nlc(rho, coords, vvrho, vvweight, vvcoords, nlc_pars):
                        RpW.ctypes.data_as(ctypes.c_void_p),
                        ctypes.c_int(vvcoords.shape[0]),
                        ctypes.c_int(coords.shape[0]))
-    #exc is multiplied by Rho later
-    exc[threshind] = Beta+0.5*F
-    vxc[0,threshind] = Beta+F+1.5*(U*dKdR+W*dW0dR)
-    vxc[1,threshind] = 1.5*W*dW0dG
-    return exc,vxc
+    return F, U, W
+
+def _vv10_rcut(centers, rho_w0, vvcoords, RpW, W0p, cutoff=None, box_size=None):
+    '''For each box of grids (given by the box centers), the distance rcut
+    beyond which the VV10 kernel changes the energy density rho*F by less
+    than cutoff on any grid of the box.
+
+    For r_ij > rcut, g_i > W0_i r_ij^2 and g_j > W0p_j r_ij^2. The
+    contributions of these pairs to rho_i*F_i are bounded by
+    1.5 * rho_w0 * rcut^-6 * sum_j RpW_j/W0p_j, where rho_w0 is the max of
+    rho_i/W0_i^2 (<= 3/(4pi)) in the box, and the sum runs over the grids j
+    which may be further than rcut from the box. vvcoords are grouped in
+    boxes of the same size to estimate this far-field sum. The contributions
+    to the nuclear gradients decay one order faster.
+    '''
+    if cutoff is None:
+        cutoff = VV10_CUTOFF
+    if box_size is None:
+        box_size = VV10_BOX_SIZE
+    q = RpW / W0p
+    vvbox, inverse = numpy.unique(numpy.floor(vvcoords * (1./box_size)).astype(int),
+                                  axis=0, return_inverse=True)
+    qbox = numpy.bincount(inverse.ravel(), weights=q, minlength=len(vvbox))
+    vvcenters = (vvbox + .5) * box_size
+
+    rcut = numpy.empty(len(centers))
+    for ib, center in enumerate(centers):
+        # The grids j in the box of vvcenters[k] are within |center -
+        # vvcenters[k]| + half_diagonal to center. They are included in the
+        # neighbor list of rcut + half_diagonal unless |center - vvcenters[k]|
+        # > rcut.
+        dist = numpy.linalg.norm(vvcenters - center, axis=1)
+        order = dist.argsort()
+        dist = dist[order]
+        # The far-field sum for rcut in [dist[k-1], dist[k])
+        tail = numpy.cumsum(qbox[order][::-1])[::-1]
+        r = (1.5 * rho_w0[ib] / cutoff * tail) ** (1./6)
+        k = numpy.where(r < dist)[0]
+        if k.size == 0:
+            rcut[ib] = dist[-1]
+        elif k[0] == 0:
+            rcut[ib] = r[0]
+        else:
+            rcut[ib] = max(dist[k[0]-1], r[k[0]])
+    return rcut
+
+def _vv10_neighbor_lists(coords, R, W0, vvcoords, RpW, W0p, cutoff=None,
+                         box_size=None):
+    '''Group coords in boxes. For each box, generate the indices of coords in
+    the box and the indices of vvcoords within the cutoff distance of the box
+    (see _vv10_rcut).
+    '''
+    from scipy.spatial import cKDTree
+    if box_size is None:
+        box_size = VV10_BOX_SIZE
+    if coords.shape[0] == 0:
+        return
+    box_ids = numpy.floor(coords * (1./box_size)).astype(int)
+    box_ids, inverse = numpy.unique(box_ids, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    order = inverse.argsort(kind='stable')
+    offsets = numpy.append(0, numpy.cumsum(numpy.bincount(inverse)))
+    centers = (box_ids + .5) * box_size
+    half_diagonal = box_size * .5 * 3**.5
+    rho_w0 = numpy.zeros(box_ids.shape[0])
+    numpy.maximum.at(rho_w0, inverse, R / W0**2)
+    rcut = _vv10_rcut(centers, rho_w0, vvcoords, RpW, W0p, cutoff, box_size)
+    tree = cKDTree(vvcoords)
+    for ib in range(box_ids.shape[0]):
+        vvidx = tree.query_ball_point(centers[ib], rcut[ib] + half_diagonal)
+        yield (order[offsets[ib]:offsets[ib+1]],
+               numpy.asarray(sorted(vvidx), dtype=int))
 
 def eval_mat(mol, ao, weight, rho, vxc,
              non0tab=None, xctype='LDA', spin=0, verbose=None):
@@ -596,8 +761,14 @@ def eval_mat(mol, ao, weight, rho, vxc,
 
     Returns:
         XC potential matrix in 2D array of shape (nao,nao) where nao is the
-        number of AO functions.
+        number of AO functions. If ao is a :class:`BlockSparseAO`, the matrix
+        is computed for the local AOs of the block only. It can be added to
+        the (nao,nao) matrix with :meth:`BlockSparseAO.unpack_mat`.
     '''
+    if isinstance(ao, BlockSparseAO):
+        return eval_mat(ao.mol, ao.ao, weight, rho, vxc, ao.non0tab, xctype,
+                        spin, verbose)
+
     xctype = xctype.upper()
     ngrids, nao = ao.shape[-2:]
 
@@ -677,6 +848,8 @@ def eval_mat(mol, ao, weight, rho, vxc,
 def _dot_ao_ao(mol, ao1, ao2, non0tab, shls_slice, ao_loc, hermi=0):
     '''return numpy.dot(ao1.T, ao2)'''
     ngrids, nao = ao1.shape
+    if ao1.dtype == numpy.float32:
+        return ao1.T.dot(numpy.asarray(ao2, dtype=numpy.float32))
     if (nao < SWITCH_SIZE or
         non0tab is None or shls_slice is None or ao_loc is None):
         return lib.dot(ao1.conj().T, ao2)
@@ -705,7 +878,15 @@ def _dot_ao_ao(mol, ao1, ao2, non0tab, shls_slice, ao_loc, hermi=0):
 
 def _dot_ao_dm(mol, ao, dm, non0tab, shls_slice, ao_loc, out=None):
     '''return numpy.dot(ao, dm)'''
+    if isinstance(ao, BlockSparseAO):
+        submol = ao.mol
+        return _dot_ao_dm(submol, ao.ao, dm[ao.ao_idx], ao.non0tab,
+                          (0, submol.nbas), submol.ao_loc_nr(), out)
+
     ngrids, nao = ao.shape
+    if ao.dtype == numpy.float32:
+        # Single precision AO values, see NumInt.ao_dtype
+        return ao.dot(numpy.asarray(dm, dtype=numpy.float32))
     if (nao < SWITCH_SIZE or
         non0tab is None or shls_slice is None or ao_loc is None):
         return lib.dot(dm.T, ao.T).T
@@ -740,6 +921,8 @@ def _scale_ao(ao, wv, out=None):
         ao = ao.T.reshape(1,nao,ngrids)
         wv = wv.reshape(1,ngrids)
 
+    if ao.dtype == numpy.float32:
+        return numpy.einsum('nip,np->pi', ao, numpy.asarray(wv, dtype=numpy.float32))
     if not ao.flags.c_contiguous:
         return numpy.einsum('nip,np->pi', ao, wv)
 
@@ -782,7 +965,9 @@ def _contract_rho(bra, ket):
     nao, ngrids = bra.shape
     rho = numpy.empty(ngrids)
 
-    if not (bra.flags.c_contiguous and ket.flags.c_contiguous):
+    if bra.dtype == ket.dtype == numpy.float32:
+        rho[:] = numpy.einsum('ip,ip->p', bra, ket)
+    elif not (bra.flags.c_contiguous and ket.flags.c_contiguous):
         rho  = numpy.einsum('ip,ip->p', bra.real, ket.real)
         rho += numpy.einsum('ip,ip->p', bra.imag, ket.imag)
     elif bra.dtype == numpy.double and ket.dtype == numpy.double:
@@ -819,6 +1004,15 @@ def _sparse_enough(screen_index, threshold=0.5):
 def _dot_ao_ao_dense(ao1, ao2, wv, out=None):
     '''Returns (bra*wv).T.dot(ket)
     '''
+    if ao1.dtype == numpy.float32:
+        ngrids, nao = ao1.shape
+        if out is None:
+            out = numpy.zeros((nao, nao))
+        if wv is not None:
+            ao1 = _scale_ao(ao1, wv.ravel())
+        out += ao1.T.dot(numpy.asarray(ao2, dtype=numpy.float32))
+        return out
+
     assert ao1.flags.f_contiguous
     assert ao2.flags.f_contiguous
     assert ao1.dtype == ao2.dtype == numpy.double
@@ -1116,7 +1310,6 @@ def nr_rks(ni, mol, grids, xc_code, dms, relativity=0, hermi=1,
     '''
     xctype = ni._xc_type(xc_code)
     make_rho, nset, nao = ni._gen_rho_evaluator(mol, dms, hermi, False, grids)
-    ao_loc = mol.ao_loc_nr()
     cutoff = grids.cutoff * 1e2
     nbins = NBINS * 2 - int(NBINS * numpy.log(cutoff) / numpy.log(grids.cutoff))
 
@@ -1124,9 +1317,13 @@ def nr_rks(ni, mol, grids, xc_code, dms, relativity=0, hermi=1,
     excsum = numpy.zeros(nset)
     vmat = numpy.zeros((nset,nao,nao))
 
-    def block_loop(ao_deriv):
+    def block_loop(ao_deriv, vmats):
+        ao_loc = mol.ao_loc_nr()
+        pair_mask = mol.get_overlap_cond() < -numpy.log(ni.cutoff)
+        buf = None  # Scratch for the weighted AO values of the dense blocks
         for ao, mask, weight, coords \
-                in ni.block_loop(mol, grids, nao, ao_deriv, max_memory=max_memory):
+                in ni.block_loop(mol, grids, nao, ao_deriv, max_memory=max_memory,
+                                 block_sparse=True):
             for i in range(nset):
                 rho = make_rho(i, ao, mask, xctype)
                 exc, vxc = ni.eval_xc_eff(xc_code, rho, deriv=1, xctype=xctype)[:2]
@@ -1137,23 +1334,36 @@ def nr_rks(ni, mol, grids, xc_code, dms, relativity=0, hermi=1,
                 nelec[i] += den.sum()
                 excsum[i] += numpy.dot(den, exc)
                 wv = weight * vxc
-                yield i, ao, mask, wv
+                if isinstance(ao, BlockSparseAO):
+                    # Integrate on the local AOs of the block, then add the
+                    # local matrices to vmats
+                    nao_local = ao.ao_idx.size
+                    vloc = numpy.zeros((len(vmats), nao_local, nao_local))
+                    yield (i, ao.ao, mask, wv, ao.mol.ao_loc_nr(),
+                           ao.take_pair_mask(pair_mask), vloc, None)
+                    for v, v_local in zip(vmats, vloc):
+                        ao.unpack_mat(v_local, v[i])
+                else:
+                    if buf is None or buf.size < weight.size * nao:
+                        buf = _empty_aligned(weight.size * nao)
+                    yield (i, ao, mask, wv, ao_loc, pair_mask,
+                           [v[i] for v in vmats], buf)
 
-    aow = None
-    pair_mask = mol.get_overlap_cond() < -numpy.log(ni.cutoff)
     if xctype == 'LDA':
         ao_deriv = 0
-        for i, ao, mask, wv in block_loop(ao_deriv):
+        for i, ao, mask, wv, ao_loc, pair_mask, (v,), aow \
+                in block_loop(ao_deriv, (vmat,)):
             _dot_ao_ao_sparse(ao, ao, wv, nbins, mask, pair_mask, ao_loc,
-                              hermi, vmat[i])
+                              hermi, v)
 
     elif xctype == 'GGA':
         ao_deriv = 1
-        for i, ao, mask, wv in block_loop(ao_deriv):
+        for i, ao, mask, wv, ao_loc, pair_mask, (v,), aow \
+                in block_loop(ao_deriv, (vmat,)):
             wv[0] *= .5  # *.5 because vmat + vmat.T at the end
             aow = _scale_ao_sparse(ao[:4], wv[:4], mask, ao_loc, out=aow)
             _dot_ao_ao_sparse(ao[0], aow, None, nbins, mask, pair_mask, ao_loc,
-                              hermi=0, out=vmat[i])
+                              hermi=0, out=v)
         vmat = lib.hermi_sum(vmat, axes=(0,2,1))
 
     elif xctype == 'MGGA':
@@ -1161,13 +1371,14 @@ def nr_rks(ni, mol, grids, xc_code, dms, relativity=0, hermi=1,
             raise NotImplementedError('laplacian in meta-GGA method')
         ao_deriv = 1
         v1 = numpy.zeros_like(vmat)
-        for i, ao, mask, wv in block_loop(ao_deriv):
+        for i, ao, mask, wv, ao_loc, pair_mask, (v, v_tau), aow \
+                in block_loop(ao_deriv, (vmat, v1)):
             wv[0] *= .5  # *.5 for v+v.conj().T
             wv[4] *= .5  # *.5 for 1/2 in tau
             aow = _scale_ao_sparse(ao[:4], wv[:4], mask, ao_loc, out=aow)
             _dot_ao_ao_sparse(ao[0], aow, None, nbins, mask, pair_mask, ao_loc,
-                              hermi=0, out=vmat[i])
-            _tau_dot_sparse(ao, ao, wv[4], nbins, mask, pair_mask, ao_loc, out=v1[i])
+                              hermi=0, out=v)
+            _tau_dot_sparse(ao, ao, wv[4], nbins, mask, pair_mask, ao_loc, out=v_tau)
         vmat = lib.hermi_sum(vmat, axes=(0,2,1))
         vmat += v1
 
@@ -1231,7 +1442,6 @@ def nr_uks(ni, mol, grids, xc_code, dms, relativity=0, hermi=1,
     >>> nelec, exc, vxc = ni.nr_uks(mol, grids, 'lda,vwn', dm)
     '''
     xctype = ni._xc_type(xc_code)
-    ao_loc = mol.ao_loc_nr()
     cutoff = grids.cutoff * 1e2
     nbins = NBINS * 2 - int(NBINS * numpy.log(cutoff) / numpy.log(grids.cutoff))
 
@@ -1244,9 +1454,13 @@ def nr_uks(ni, mol, grids, xc_code, dms, relativity=0, hermi=1,
     excsum = numpy.zeros(nset)
     vmat = numpy.zeros((2,nset,nao,nao))
 
-    def block_loop(ao_deriv):
+    def block_loop(ao_deriv, vmats):
+        ao_loc = mol.ao_loc_nr()
+        pair_mask = mol.get_overlap_cond() < -numpy.log(ni.cutoff)
+        buf = None  # Scratch for the weighted AO values of the dense blocks
         for ao, mask, weight, coords \
-                in ni.block_loop(mol, grids, nao, ao_deriv, max_memory=max_memory):
+                in ni.block_loop(mol, grids, nao, ao_deriv, max_memory=max_memory,
+                                 block_sparse=True):
             for i in range(nset):
                 rho_a = make_rhoa(i, ao, mask, xctype)
                 rho_b = make_rhob(i, ao, mask, xctype)
@@ -1263,29 +1477,42 @@ def nr_uks(ni, mol, grids, xc_code, dms, relativity=0, hermi=1,
                 excsum[i] += numpy.dot(den_a, exc)
                 excsum[i] += numpy.dot(den_b, exc)
                 wv = weight * vxc
-                yield i, ao, mask, wv
+                if isinstance(ao, BlockSparseAO):
+                    # Integrate on the local AOs of the block, then add the
+                    # local matrices to vmats
+                    nao_local = ao.ao_idx.size
+                    vloc = numpy.zeros((len(vmats), 2, nao_local, nao_local))
+                    yield (i, ao.ao, mask, wv, ao.mol.ao_loc_nr(),
+                           ao.take_pair_mask(pair_mask), vloc, None)
+                    for v, v_local in zip(vmats, vloc):
+                        ao.unpack_mat(v_local, v[:,i])
+                else:
+                    if buf is None or buf.size < weight.size * nao:
+                        buf = _empty_aligned(weight.size * nao)
+                    yield (i, ao, mask, wv, ao_loc, pair_mask,
+                           [v[:,i] for v in vmats], buf)
 
-    pair_mask = mol.get_overlap_cond() < -numpy.log(ni.cutoff)
-    aow = None
     if xctype == 'LDA':
         ao_deriv = 0
-        for i, ao, mask, wv in block_loop(ao_deriv):
+        for i, ao, mask, wv, ao_loc, pair_mask, (v,), aow \
+                in block_loop(ao_deriv, (vmat,)):
             _dot_ao_ao_sparse(ao, ao, wv[0,0], nbins, mask, pair_mask, ao_loc,
-                              hermi, vmat[0,i])
+                              hermi, v[0])
             _dot_ao_ao_sparse(ao, ao, wv[1,0], nbins, mask, pair_mask, ao_loc,
-                              hermi, vmat[1,i])
+                              hermi, v[1])
 
     elif xctype == 'GGA':
         ao_deriv = 1
-        for i, ao, mask, wv in block_loop(ao_deriv):
+        for i, ao, mask, wv, ao_loc, pair_mask, (v,), aow \
+                in block_loop(ao_deriv, (vmat,)):
             wv[:,0] *= .5
             wva, wvb = wv
             aow = _scale_ao_sparse(ao, wva, mask, ao_loc, out=aow)
             _dot_ao_ao_sparse(ao[0], aow, None, nbins, mask, pair_mask, ao_loc,
-                              hermi=0, out=vmat[0,i])
+                              hermi=0, out=v[0])
             aow = _scale_ao_sparse(ao, wvb, mask, ao_loc, out=aow)
             _dot_ao_ao_sparse(ao[0], aow, None, nbins, mask, pair_mask, ao_loc,
-                              hermi=0, out=vmat[1,i])
+                              hermi=0, out=v[1])
         vmat = lib.hermi_sum(vmat.reshape(-1,nao,nao), axes=(0,2,1)).reshape(2,nset,nao,nao)
 
     elif xctype == 'MGGA':
@@ -1294,18 +1521,19 @@ def nr_uks(ni, mol, grids, xc_code, dms, relativity=0, hermi=1,
         assert not MGGA_DENSITY_LAPL
         ao_deriv = 1
         v1 = numpy.zeros_like(vmat)
-        for i, ao, mask, wv in block_loop(ao_deriv):
+        for i, ao, mask, wv, ao_loc, pair_mask, (v, v_tau), aow \
+                in block_loop(ao_deriv, (vmat, v1)):
             wv[:,0] *= .5
             wv[:,4] *= .5
             wva, wvb = wv
             aow = _scale_ao_sparse(ao[:4], wva[:4], mask, ao_loc, out=aow)
             _dot_ao_ao_sparse(ao[0], aow, None, nbins, mask, pair_mask, ao_loc,
-                              hermi=0, out=vmat[0,i])
-            _tau_dot_sparse(ao, ao, wva[4], nbins, mask, pair_mask, ao_loc, out=v1[0,i])
+                              hermi=0, out=v[0])
+            _tau_dot_sparse(ao, ao, wva[4], nbins, mask, pair_mask, ao_loc, out=v_tau[0])
             aow = _scale_ao_sparse(ao[:4], wvb[:4], mask, ao_loc, out=aow)
             _dot_ao_ao_sparse(ao[0], aow, None, nbins, mask, pair_mask, ao_loc,
-                              hermi=0, out=vmat[1,i])
-            _tau_dot_sparse(ao, ao, wvb[4], nbins, mask, pair_mask, ao_loc, out=v1[1,i])
+                              hermi=0, out=v[1])
+            _tau_dot_sparse(ao, ao, wvb[4], nbins, mask, pair_mask, ao_loc, out=v_tau[1])
         vmat = lib.hermi_sum(vmat.reshape(-1,nao,nao), axes=(0,2,1)).reshape(2,nset,nao,nao)
         vmat += v1
     elif xctype == 'HF':
@@ -1323,6 +1551,143 @@ def nr_uks(ni, mol, grids, xc_code, dms, relativity=0, hermi=1,
         vmat = numpy.asarray(vmat, dtype=dtype)
     return nelec, excsum, vmat
 
+def nr_vxc_multi(ni, mol, grids, xc_codes, dms, spin=0, relativity=0, hermi=1,
+                 with_vxc=False, max_memory=2000, verbose=None):
+    '''Evaluate a list of XC functionals for one (spin) density matrix. The
+    electron density and its derivatives are computed once on each block of
+    grids and shared by all functionals.
+
+    Args:
+        mol : an instance of :class:`Mole`
+
+        grids : an instance of :class:`Grids`
+            grids.coords and grids.weights are needed for coordinates and weights of meshgrids.
+        xc_codes : a list of str
+            XC functional descriptions.
+            See :func:`parse_xc` of pyscf/dft/libxc.py for more details.
+        dms : 2D array or (dm_a, dm_b)
+            Density matrix. Alpha and beta density matrices if spin=1
+
+    Kwargs:
+        spin : int
+            Whether to evaluate the functionals in spin-polarized form
+        hermi : int
+            Input density matrices symmetric or not
+        with_vxc : bool
+            Whether to compute the XC potential matrices
+        max_memory : int or float
+            The maximum size of cache to use (in MB).
+
+    Returns:
+        nelec, excs, vmats.
+        nelec is the number of electrons integrated on grids. Unlike nr_rks
+        and nr_uks, it is computed even if all functionals are HF.
+        excs is a 1D array of the XC energies of the functionals. vmats has
+        the shape (nxc,nao,nao) for spin=0 or (nxc,2,nao,nao) for spin=1 if
+        with_vxc is set, otherwise None. The non-local correlation (VV10) part
+        of the functionals is not included.
+
+    Examples:
+
+    >>> mol = gto.M(atom='O 0 0 0; H 0 0 1; H 0 1 0', basis='ccpvdz')
+    >>> mf = dft.RKS(mol).run()
+    >>> nelec, excs = mf._numint.nr_vxc_multi(mol, mf.grids, ['lda,vwn', 'pbe', 'tpss'],
+    ...                                       mf.make_rdm1())[:2]
+    '''
+    xctypes = [ni._xc_type(xc_code) for xc_code in xc_codes]
+    rank = {'HF': 0, 'LDA': 0, 'GGA': 1, 'MGGA': 2}
+    for xc_code, t in zip(xc_codes, xctypes):
+        if t not in rank:
+            raise NotImplementedError(f'numint.nr_vxc_multi for functional {xc_code}')
+        if t == 'MGGA' and with_vxc:
+            if (any(x in xc_code.upper() for x in ('CC06', 'CS', 'BR89', 'MK00'))):
+                raise NotImplementedError('laplacian in meta-GGA method')
+    # The density type which covers all functionals
+    xctype = ('LDA', 'GGA', 'MGGA')[max([rank[t] for t in xctypes] + [0])]
+    ao_deriv = 0 if xctype == 'LDA' else 1
+
+    if spin == 0:
+        make_rho, nset, nao = ni._gen_rho_evaluator(mol, dms, hermi, False, grids)
+        make_rhos = [make_rho]
+    else:
+        dma, dmb = _format_uks_dm(dms)
+        make_rhoa, nset, nao = ni._gen_rho_evaluator(mol, dma, hermi, False, grids)
+        make_rhob = ni._gen_rho_evaluator(mol, dmb, hermi, False, grids)[0]
+        make_rhos = [make_rhoa, make_rhob]
+    assert nset == 1
+    nspin = len(make_rhos)
+    ao_loc = mol.ao_loc_nr()
+    cutoff = grids.cutoff * 1e2
+    nbins = NBINS * 2 - int(NBINS * numpy.log(cutoff) / numpy.log(grids.cutoff))
+    pair_mask = mol.get_overlap_cond() < -numpy.log(ni.cutoff)
+
+    nxc = len(xc_codes)
+    nelec = numpy.zeros(nspin)
+    excs = numpy.zeros(nxc)
+    if with_vxc:
+        vmat = numpy.zeros((nxc,nspin,nao,nao))
+        v1 = numpy.zeros_like(vmat)
+    aow = None
+    for ao, mask, weight, coords \
+            in ni.block_loop(mol, grids, nao, ao_deriv, max_memory=max_memory):
+        rho = numpy.asarray([f(0, ao, mask, xctype) for f in make_rhos])
+        if xctype == 'LDA':
+            den = rho * weight
+        else:
+            den = rho[:,0] * weight
+        nelec += den.sum(axis=1)
+        den = den.sum(axis=0)
+        if ao_deriv == 0:
+            ao0 = ao
+        else:
+            ao0 = ao[0]
+
+        for k, xc_code in enumerate(xc_codes):
+            t = xctypes[k]
+            if t == 'HF':
+                continue
+            if xctype == 'LDA':
+                rho_k = rho
+            elif t == 'LDA':
+                rho_k = rho[:,0]
+            elif t == 'GGA':
+                rho_k = rho[:,:4]
+            else:
+                rho_k = rho
+            if spin == 0:
+                rho_k = rho_k[0]
+            exc, vxc = ni.eval_xc_eff(xc_code, rho_k, deriv=int(with_vxc),
+                                      xctype=t)[:2]
+            excs[k] += numpy.dot(den, exc)
+            if not with_vxc:
+                continue
+
+            wv = (weight * vxc).reshape(nspin, -1, weight.size)
+            wv[:,0] *= .5  # *.5 because vmat + vmat.T at the end
+            for s in range(nspin):
+                if t == 'LDA':
+                    _dot_ao_ao_sparse(ao0, ao0, wv[s,0], nbins, mask, pair_mask,
+                                      ao_loc, hermi=0, out=vmat[k,s])
+                else:
+                    aow = _scale_ao_sparse(ao[:4], wv[s,:4], mask, ao_loc, out=aow)
+                    _dot_ao_ao_sparse(ao[0], aow, None, nbins, mask, pair_mask,
+                                      ao_loc, hermi=0, out=vmat[k,s])
+                if t == 'MGGA':
+                    wv[s,4] *= .5  # *.5 for 1/2 in tau
+                    _tau_dot_sparse(ao, ao, wv[s,4], nbins, mask, pair_mask,
+                                    ao_loc, out=v1[k,s])
+
+    if spin == 0:
+        nelec = nelec[0]
+    if not with_vxc:
+        return nelec, excs, None
+
+    vmat = lib.hermi_sum(vmat.reshape(-1,nao,nao), axes=(0,2,1))
+    vmat = vmat.reshape(nxc,nspin,nao,nao) + v1
+    if spin == 0:
+        vmat = vmat[:,0]
+    return nelec, excs, vmat
+
 def _format_uks_dm(dms):
     if isinstance(dms, numpy.ndarray) and dms.ndim == 2:  # RHF DM
         dma = dmb = dms * .5
@@ -1415,6 +1780,49 @@ def nr_nlc_vxc(ni, mol, grids, xc_code, dm, relativity=0, hermi=1,
     vmat = vmat + vmat.T
     return nelec, excsum, vmat
 
+def _fxc_block_loop(ni, mol, grids, nao, ao_deriv, fxc, max_memory=2000):
+    '''Iterate over ni.block_loop and yield the AO values of each block
+    together with the slice of fxc on the grids of the block. If fxc is stored
+    in a memory-mapped file (see :func:`cache_xc_kernel`), the slice for the
+    next block is read in a background thread.
+    '''
+    if not isinstance(fxc, numpy.memmap):
+        p1 = 0
+        for ao, mask, weight, coords \
+                in ni.block_loop(mol, grids, nao, ao_deriv, max_memory=max_memory):
+            p0, p1 = p1, p1 + weight.size
+            _fxc = None if fxc is None else fxc[...,p0:p1]
+            yield ao, mask, weight, coords, _fxc
+        return
+
+    ngrids = fxc.shape[-1]
+    def load(p0, p1, out):
+        out[...,:p1-p0] = fxc[...,p0:p1]
+
+    buf = buf_prefetch = None
+    with lib.call_in_background(load) as prefetch:
+        p1 = 0
+        for ao, mask, weight, coords \
+                in ni.block_loop(mol, grids, nao, ao_deriv, max_memory=max_memory):
+            p0, p1 = p1, p1 + weight.size
+            if buf is None:
+                # block_loop produces blocks of the same size except the last one
+                blksize = weight.size
+                buf = numpy.empty(fxc.shape[:-1] + (blksize,))
+                buf_prefetch = numpy.empty_like(buf)
+                load(p0, p1, buf_prefetch)
+                loaded = (p0, p1)
+            buf, buf_prefetch = buf_prefetch, buf
+            # prefetch() waits for the previous load (to buf) to finish
+            q1 = min(p1 + blksize, ngrids)
+            prefetch(p1, q1, buf_prefetch)
+            if loaded == (p0, p1):
+                _fxc = buf[...,:p1-p0]
+            else:
+                _fxc = numpy.asarray(fxc[...,p0:p1])
+            loaded = (p1, q1)
+            yield ao, mask, weight, coords, _fxc
+
 def nr_rks_fxc(ni, mol, grids, xc_code, dm0, dms, relativity=0, hermi=0,
                rho0=None, vxc=None, fxc=None, max_memory=2000, verbose=None):
     '''Contract RKS XC (singlet hessian) kernel matrix with given density matrices
@@ -1472,11 +1880,8 @@ def nr_rks_fxc(ni, mol, grids, xc_code, dm0, dms, relativity=0, hermi=0,
     make_rho1, nset, nao = ni._gen_rho_evaluator(mol, dms, hermi, False, grids)
 
     def block_loop(ao_deriv):
-        p1 = 0
-        for ao, mask, weight, coords \
-                in ni.block_loop(mol, grids, nao, ao_deriv, max_memory=max_memory):
-            p0, p1 = p1, p1 + weight.size
-            _fxc = fxc[:,:,p0:p1]
+        for ao, mask, weight, coords, _fxc \
+                in _fxc_block_loop(ni, mol, grids, nao, ao_deriv, fxc, max_memory):
             for i in range(nset):
                 rho1 = make_rho1(i, ao, mask, xctype)
                 if xctype == 'LDA':
@@ -1745,11 +2150,8 @@ def nr_uks_fxc(ni, mol, grids, xc_code, dm0, dms, relativity=0, hermi=0,
     make_rhob       = ni._gen_rho_evaluator(mol, dmb, hermi, False, grids)[0]
 
     def block_loop(ao_deriv):
-        p1 = 0
-        for ao, mask, weight, coords \
-                in ni.block_loop(mol, grids, nao, ao_deriv, max_memory=max_memory):
-            p0, p1 = p1, p1 + weight.size
-            _fxc = fxc[:,:,:,:,p0:p1]
+        for ao, mask, weight, coords, _fxc \
+                in _fxc_block_loop(ni, mol, grids, nao, ao_deriv, fxc, max_memory):
             for i in range(nset):
                 rho1a = make_rhoa(i, ao, mask, xctype)
                 rho1b = make_rhob(i, ao, mask, xctype)
@@ -2535,6 +2937,48 @@ def nr_fxc(mol, grids, xc_code, dm0, dms, spin=0, relativity=0, hermi=0,
                      hermi, rho0, vxc, fxc, max_memory, verbose)
 
 
+def _eval_xc_kernel(ni, mol, xc_code, rho, xctype, max_memory=2000):
+    '''Evaluate vxc and fxc on the grids. They are evaluated in one call of
+    ni.eval_xc_eff if fxc fits in XC_KERNEL_INCORE_RATIO of max_memory.
+    Otherwise they are evaluated block by block and fxc is written to a
+    memory-mapped file in lib.param.TMPDIR. Both arrays have the same layout
+    as the outputs of ni.eval_xc_eff.
+    '''
+    if isinstance(rho, tuple):  # UKS
+        ngrids = rho[0].shape[-1]
+        nvar = (rho[0].size + rho[1].size) // ngrids
+    else:
+        ngrids = rho.shape[-1]
+        nvar = rho.size // ngrids
+    fxc_size = nvar**2 * ngrids * 8e-6
+    if fxc_size < max_memory * XC_KERNEL_INCORE_RATIO:
+        return ni.eval_xc_eff(xc_code, rho, deriv=2, xctype=xctype)[1:3]
+
+    lib.logger.debug(mol, 'Store XC kernel (%.0f MB) in TMPDIR', fxc_size)
+    mem_avail = max(max_memory - lib.current_memory()[0], 0)
+    # eval_xc_eff needs roughly nvar**2 * 3 doubles per grid for fxc and
+    # the intermediates
+    blksize = int(mem_avail*.2e6/8/(nvar**2*3+1)) // BLKSIZE * BLKSIZE
+    # Small blocks are inefficient in libxc
+    blksize = max(BLKSIZE*64, min(blksize, ngrids))
+
+    vxc = fxc = None
+    for p0, p1 in lib.prange(0, ngrids, blksize):
+        if isinstance(rho, tuple):  # UKS
+            rho_blk = (rho[0][...,p0:p1], rho[1][...,p0:p1])
+        else:
+            rho_blk = rho[...,p0:p1]
+        _vxc, _fxc = ni.eval_xc_eff(xc_code, rho_blk, deriv=2, xctype=xctype)[1:3]
+        if fxc is None:
+            vxc = numpy.empty(_vxc.shape[:-1] + (ngrids,))
+            # The unnamed temporary file is removed when fxc is released
+            with tempfile.TemporaryFile(dir=lib.param.TMPDIR) as f:
+                fxc = numpy.memmap(f, dtype=numpy.double, mode='w+',
+                                   shape=_fxc.shape[:-1] + (ngrids,))
+        vxc[...,p0:p1] = _vxc
+        fxc[...,p0:p1] = _fxc
+    return vxc, fxc
+
 def cache_xc_kernel(ni, mol, grids, xc_code, mo_coeff, mo_occ, spin=0,
                     max_memory=2000):
     '''Compute the 0th order density, Vxc and fxc.  They can be used in TDDFT,
@@ -2570,7 +3014,7 @@ def cache_xc_kernel(ni, mol, grids, xc_code, mo_coeff, mo_occ, spin=0,
             rhoa.append(ni.eval_rho2(mol, ao, mo_coeff[0], mo_occ[0], mask, xctype, with_lapl))
             rhob.append(ni.eval_rho2(mol, ao, mo_coeff[1], mo_occ[1], mask, xctype, with_lapl))
         rho = (numpy.hstack(rhoa), numpy.hstack(rhob))
-    vxc, fxc = ni.eval_xc_eff(xc_code, rho, deriv=2, xctype=xctype)[1:3]
+    vxc, fxc = _eval_xc_kernel(ni, mol, xc_code, rho, xctype, max_memory)
     return rho, vxc, fxc
 
 def cache_xc_kernel1(ni, mol, grids, xc_code, dm, spin=0, max_memory=2000):
@@ -2607,7 +3051,7 @@ def cache_xc_kernel1(ni, mol, grids, xc_code, dm, spin=0, max_memory=2000):
             rhoa.append(make_rho(0, ao, mask, xctype))
             rhob.append(make_rho(1, ao, mask, xctype))
         rho = (numpy.hstack(rhoa), numpy.hstack(rhob))
-    vxc, fxc = ni.eval_xc_eff(xc_code, rho, deriv=2, xctype=xctype)[1:3]
+    vxc, fxc = _eval_xc_kernel(ni, mol, xc_code, rho, xctype, max_memory)
     return rho, vxc, fxc
 
 def get_rho(ni, mol, dm, grids, max_memory=2000):
@@ -2728,6 +3172,179 @@ class LibXCMixin:
             hyb = self.hybrid_coeff(xc_code, spin)
         return omega, alpha, hyb
 
+class AOCache:
+    '''AO values (and derivatives) of the grid blocks generated by
+    NumInt.block_loop. They can be reused as long as the molecule and the
+    grids are not changed. The block size is fixed when the cache is created,
+    and block_loop follows it in the subsequent calls.
+
+    The blocks are kept in memory up to max_memory MB. The rest are stored in
+    a memory-mapped temporary file.
+    '''
+    def __init__(self, mol, grids, deriv, blksize, max_memory):
+        self._bas = mol._bas
+        self.atom_coords = mol.atom_coords()
+        self.cart = mol.cart
+        self.coords = grids.coords
+        self.non0tab = grids.non0tab
+        self.deriv = deriv
+        self.blksize = blksize
+        self.max_memory = max_memory
+        self.blocks = []
+        self.complete = False
+        self._incore_size = 0
+        self._mmap = None
+        self._mmap_offset = 0
+        self._tmpfile = None
+
+    def match_system(self, mol, grids):
+        '''Whether the cached blocks were generated for mol and grids,
+        regardless of the derivative order and the block size'''
+        return (self.complete and
+                self.coords is grids.coords and
+                self.non0tab is grids.non0tab and
+                self._bas is mol._bas and
+                self.cart == mol.cart and
+                numpy.array_equal(self.atom_coords, mol.atom_coords()))
+
+    def get(self, i, deriv):
+        ao, mask = self.blocks[i]
+        if deriv == self.deriv:
+            return ao, mask
+        elif deriv == 0:
+            return ao[0], mask
+        else:
+            comp = (deriv+1)*(deriv+2)*(deriv+3)//6
+            return ao[:comp], mask
+
+    def get_higher_deriv(self, i, mol, coords, deriv, cutoff, buf):
+        '''AO values of block i for deriv > self.deriv.
+
+        Only the LDA case (the AO values cached, the AO gradients requested)
+        reuses the cache: the cached values are copied and the AO gradients
+        are evaluated by GTOval_ip. For GGA and meta-GGA (the AO gradients
+        cached, the second derivatives requested) the cache gives no saving.
+        There are no integrals for the second derivatives only, so all AO
+        derivatives up to the requested order are evaluated again.
+        '''
+        ao0, mask = self.blocks[i]
+        ngrids = coords.shape[0]
+        nao = mol.nao
+        if self.deriv == 0 and deriv == 1 and not isinstance(ao0, BlockSparseAO):
+            ao = numpy.ndarray((4,nao,ngrids), buffer=buf).transpose(0,2,1)
+            ao[0] = ao0
+            if mol.cart:
+                feval = 'GTOval_ip_cart'
+            else:
+                feval = 'GTOval_ip_sph'
+            mol.eval_gto(feval, coords, 3, None, mask, cutoff=cutoff,
+                         out=buf[nao*ngrids:])
+        else:
+            ao = eval_ao(mol, coords, deriv, non0tab=mask, cutoff=cutoff, out=buf)
+        return ao, mask
+
+    def append(self, ao, mask, nbytes_left):
+        '''Save a copy of the AO block. nbytes_left is the size of this block
+        and all blocks to be appended after it. Returns the cached block or
+        None if the cache is too big.'''
+        if isinstance(ao, BlockSparseAO):
+            cached = self._copy(ao.ao, nbytes_left)
+            if cached is not None:
+                cached = BlockSparseAO(cached, ao.mol, ao.ao_idx, ao.non0tab,
+                                       ao.nao, ao.shl_idx)
+        else:
+            cached = self._copy(ao, nbytes_left)
+        if cached is not None:
+            self.blocks.append((cached, mask))
+        return cached
+
+    def _copy(self, ao, nbytes_left):
+        if self._incore_size + ao.nbytes <= self.max_memory * 1e6:
+            self._incore_size += ao.nbytes
+            cached = ao.copy(order='K')
+        else:
+            if self._mmap is None:
+                if nbytes_left > AO_CACHE_MAX_DISK * 1e6:
+                    return None
+                self._tmpfile = tempfile.NamedTemporaryFile(dir=lib.param.TMPDIR,
+                                                            suffix='.ao')
+                self._mmap = numpy.memmap(self._tmpfile, dtype=ao.dtype, mode='w+',
+                                          shape=(nbytes_left // ao.itemsize,))
+            # Keep the memory layout of the AO values (F-order for each component)
+            cached = numpy.ndarray(ao.shape, dtype=ao.dtype, buffer=self._mmap,
+                                   offset=self._mmap_offset, strides=ao.strides)
+            cached[:] = ao
+            self._mmap_offset += ao.nbytes
+        cached.flags.writeable = False
+        return cached
+
+class BlockSparseAO:
+    '''AO values on a block of grids, stored for the shells which are not
+    negligible on the block only (see :func:`eval_ao_sparse`). The memory
+    and the cost of eval_rho, eval_mat and _dot_ao_dm scale with the number
+    of these local AOs instead of the total number of AOs.
+
+    Attributes:
+        ao : ndarray
+            AO values of the local shells, in the same layout as the output
+            of :func:`eval_ao`
+        mol : Mole
+            The molecule restricted to the local shells
+        ao_idx : 1D int array
+            Indices of the local AOs in the AOs of the full molecule
+        non0tab : 2D uint8 array
+            Screening mask for the local shells
+        nao : int
+            Number of AOs of the full molecule
+        shl_idx : 1D int array
+            Indices of the local shells in the shells of the full molecule
+    '''
+    def __init__(self, ao, mol, ao_idx, non0tab, nao, shl_idx=None):
+        self.ao = ao
+        self.mol = mol
+        self.ao_idx = ao_idx
+        self.non0tab = non0tab
+        self.nao = nao
+        self.shl_idx = shl_idx
+
+    @property
+    def shape(self):
+        return self.ao.shape
+
+    @property
+    def dtype(self):
+        return self.ao.dtype
+
+    def __getitem__(self, key):
+        '''AO components, e.g. ao[0] for the AO values and ao[1:4] for the
+        AO gradients.'''
+        return self.__class__(self.ao[key], self.mol, self.ao_idx,
+                              self.non0tab, self.nao, self.shl_idx)
+
+    def take_dm(self, dm):
+        '''The block of dm within the local AOs'''
+        idx = self.ao_idx
+        return dm[...,idx[:,None],idx]
+
+    def take_pair_mask(self, pair_mask):
+        '''The block of the shell-pair mask within the local shells'''
+        idx = self.shl_idx
+        return numpy.asarray(pair_mask[idx[:,None],idx], order='C')
+
+    def unpack_mat(self, mat, out=None):
+        '''Add a matrix on the local AOs to the (nao,nao) matrix out'''
+        idx = self.ao_idx
+        if out is None:
+            out = numpy.zeros(mat.shape[:-2] + (self.nao, self.nao), dtype=mat.dtype)
+        out[...,idx[:,None],idx] += mat
+        return out
+
+    def todense(self):
+        '''AO values on all AOs, as returned by eval_ao'''
+        out = numpy.zeros(self.ao.shape[:-1] + (self.nao,), dtype=self.ao.dtype)
+        out[...,self.ao_idx] = self.ao
+        return out
+
 # Export the symbol _NumIntMixin for backward compatibility.
 # _NumIntMixin should be dropped in the future.
 _NumIntMixin = LibXCMixin
@@ -2737,6 +3354,13 @@ class NumInt(lib.StreamObject, LibXCMixin):
     '''Numerical integration methods for non-relativistic RKS and UKS'''
 
     cutoff = CUTOFF * 1e2  # cutoff for small AO product
+    # Data type of the AO values generated by block_loop. When it is set to
+    # numpy.float32, the densities and the XC potential matrices are
+    # contracted in single precision (on dense AO tensors).
+    ao_dtype = numpy.double
+    # Whether to keep the AO values of block_loop for the next call, see AOCache.
+    # One cache is kept for each Grids object (e.g. grids and nlcgrids of RKS).
+    ao_cache = getattr(__config__, 'dft_numint_NumInt_ao_cache', False)
 
     @lib.with_doc(nr_vxc.__doc__)
     def nr_vxc(self, mol, grids, xc_code, dms, spin=0, relativity=0, hermi=0,
@@ -2762,6 +3386,7 @@ class NumInt(lib.StreamObject, LibXCMixin):
 
     nr_rks = nr_rks
     nr_uks = nr_uks
+    nr_vxc_multi = nr_vxc_multi
     nr_nlc_vxc = nr_nlc_vxc
     nr_sap = nr_sap_vxc = nr_sap_vxc
     nr_rks_fxc = nr_rks_fxc
@@ -2778,8 +3403,15 @@ class NumInt(lib.StreamObject, LibXCMixin):
     get_rho = get_rho
 
     def block_loop(self, mol, grids, nao=None, deriv=0, max_memory=2000,
-                   non0tab=None, blksize=None, buf=None):
+                   non0tab=None, blksize=None, buf=None, block_sparse=False):
         '''Define this macro to loop over grids by blocks.
+
+        Kwargs:
+            block_sparse : bool
+                If True, the AO values of the blocks on which only a small
+                fraction of the AOs are not negligible (see BLOCK_SPARSE_RATIO)
+                are generated as :class:`BlockSparseAO`. The mask yielded
+                with them is the screening mask of the local shells.
         '''
         if grids.coords is None:
             grids.build(with_non0tab=True)
@@ -2787,6 +3419,22 @@ class NumInt(lib.StreamObject, LibXCMixin):
             nao = mol.nao
         ngrids = grids.coords.shape[0]
         comp = (deriv+1)*(deriv+2)*(deriv+3)//6
+        if non0tab is None and mol is grids.mol:
+            non0tab = grids.non0tab
+
+        cache = None
+        extend_cache = False
+        if getattr(self, 'ao_cache', False) and non0tab is grids.non0tab:
+            cache = self._ao_cache_for(mol, grids, deriv, blksize)
+            if cache is not None:
+                # Follow the blocks of the cache. Its block size was fixed
+                # when the cache was created.
+                blksize = cache.blksize
+                # Higher AO derivatives (e.g. for nuclear gradients) after
+                # SCF. The cache is kept for the next SCF. Only LDA saves
+                # the evaluation of the AO values (see get_higher_deriv).
+                extend_cache = deriv > cache.deriv
+
         # NOTE to index grids.non0tab, the blksize needs to be an integer
         # multiplier of BLKSIZE
         if blksize is None:
@@ -2794,8 +3442,6 @@ class NumInt(lib.StreamObject, LibXCMixin):
             blksize = max(4, min(blksize, ngrids//BLKSIZE+1, 1200)) * BLKSIZE
         assert blksize % BLKSIZE == 0
 
-        if non0tab is None and mol is grids.mol:
-            non0tab = grids.non0tab
         if non0tab is None:
             non0tab = numpy.empty(((ngrids+BLKSIZE-1)//BLKSIZE,mol.nbas),
                                   dtype=numpy.uint8)
@@ -2804,22 +3450,89 @@ class NumInt(lib.StreamObject, LibXCMixin):
 
         # the xxx_sparse() functions require ngrids 8-byte aligned
         allow_sparse = ngrids % ALIGNMENT_UNIT == 0 and nao > SWITCH_SIZE
-
-        if buf is None:
+        block_sparse = (block_sparse and allow_sparse and
+                        getattr(self, 'ao_dtype', None) != numpy.float32)
+        ao_loc = mol.ao_loc_nr()
+        ao_nao = ao_loc[1:] - ao_loc[:-1]
+
+        if getattr(self, 'ao_cache', False) and non0tab is grids.non0tab and cache is None:
+            # The memory budget of the cache is clamped at zero when the
+            # process already exceeds max_memory
+            self._ao_caches[grids] = cache = AOCache(
+                mol, grids, deriv, blksize,
+                max(max_memory, 0) * AO_CACHE_MEMORY_RATIO)
+
+        if buf is None and (cache is None or not cache.complete or extend_cache):
             buf = _empty_aligned(comp * blksize * nao)
-        for ip0, ip1 in lib.prange(0, ngrids, blksize):
+        for k, (ip0, ip1) in enumerate(lib.prange(0, ngrids, blksize)):
             coords = grids.coords[ip0:ip1]
             weight = grids.weights[ip0:ip1]
-            mask = screen_index[ip0//BLKSIZE:]
-            # TODO: pass grids.cutoff to eval_ao
-            ao = self.eval_ao(mol, coords, deriv=deriv, non0tab=mask,
-                              cutoff=grids.cutoff, out=buf)
+            if extend_cache:
+                ao, mask = cache.get_higher_deriv(k, mol, coords, deriv,
+                                                  grids.cutoff, buf)
+            elif cache is not None and cache.complete:
+                ao, mask = cache.get(k, deriv)
+            else:
+                mask = screen_index[ip0//BLKSIZE:]
+                local_mask = None
+                if block_sparse:
+                    local_mask = mask[:(ip1-ip0+BLKSIZE-1)//BLKSIZE]
+                    nao_local = ao_nao[local_mask.any(axis=0)].sum()
+                    if nao_local >= nao * BLOCK_SPARSE_RATIO:
+                        local_mask = None
+                if local_mask is not None:
+                    ao = eval_ao_sparse(mol, coords, deriv, local_mask,
+                                        grids.cutoff, out=buf)
+                else:
+                    # TODO: pass grids.cutoff to eval_ao
+                    ao = self.eval_ao(mol, coords, deriv=deriv, non0tab=mask,
+                                      cutoff=grids.cutoff, out=buf)
+                if cache is not None:
+                    nbytes_left = (ngrids - ip0) * nao * comp * 8
+                    cached = cache.append(ao, mask, nbytes_left)
+                    if cached is None:
+                        del self._ao_caches[grids]
+                        cache = None
+                    else:
+                        ao = cached
+            if isinstance(ao, BlockSparseAO):
+                if block_sparse:
+                    yield ao, ao.non0tab, weight, coords
+                    continue
+                # Cached by a block sparse loop
+                ao = ao.todense()
+            if getattr(self, 'ao_dtype', None) == numpy.float32:
+                # The sparse kernels support double precision only
+                yield ao.astype(numpy.float32), None, weight, coords
+                continue
             if not allow_sparse and not _sparse_enough(mask):
                 # Unset mask for dense AO tensor. It determines which eval_rho
                 # to be called in make_rho
                 mask = None
             yield ao, mask, weight, coords
 
+        if cache is not None and not cache.complete:
+            cache.complete = True
+
+    @property
+    def _ao_caches(self):
+        '''AOCache of each Grids object. A cache is dropped with its grids.'''
+        caches = self.__dict__.get('_ao_caches_')
+        if caches is None:
+            caches = self._ao_caches_ = weakref.WeakKeyDictionary()
+        return caches
+
+    def _ao_cache_for(self, mol, grids, deriv, blksize=None):
+        '''The complete AOCache generated for the molecule and grids, or None
+        if it does not exist. The cache is reused for any derivative order
+        unless a different blksize is requested.'''
+        cache = self._ao_caches.get(grids)
+        if cache is None or not cache.match_system(mol, grids):
+            return None
+        if deriv <= cache.deriv and blksize not in (None, cache.blksize):
+            return None
+        return cache
+
     def _gen_rho_evaluator(self, mol, dms, hermi=0, with_lapl=True, grids=None):
         if getattr(dms, 'mo_coeff', None) is not None:
             #TODO: test whether dm.mo_coeff matching dm
@@ -2874,6 +3587,16 @@ class NumInt(lib.StreamObject, LibXCMixin):
                 is_sparse = rho1_rho2_ratio < 4
             else:
                 is_sparse = rho1_rho2_ratio < 1
+            if isinstance(ao, BlockSparseAO) and has_screening:
+                # Contract the local AOs with the blocks of the density
+                # matrices (or the orbitals) within the local AOs
+                if has_mo and not is_sparse:
+                    return self.eval_rho2(ao.mol, ao.ao, mo_coeff[idm][ao.ao_idx],
+                                          mo_occ[idm], sindex, xctype, with_lapl)
+                return self.eval_rho1(ao.mol, ao.ao, ao.take_dm(dms[idm]), sindex,
+                                      xctype, hermi, with_lapl, cutoff=self.cutoff,
+                                      ao_cutoff=grids.cutoff,
+                                      pair_mask=ao.take_pair_mask(pair_mask))
             if has_screening and (not has_mo or is_sparse):
                 return self.eval_rho1(mol, ao, dms[idm], sindex, xctype, hermi,
                                       with_lapl, cutoff=self.cutoff,
@@ -34,6 +34,10 @@ from pyscf.dft import gen_grid
 from pyscf.dft import numint
 from pyscf import __config__
 
+# The grids pruned by density are rebuilt if the number of electrons on them
+# changes more than this value between two pruning steps
+REPRUNE_NELEC_TOL = getattr(__config__, 'dft_rks_reprune_nelec_tol', 1e-5)
+
 def get_veff(ks, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
     '''Coulomb + XC functional
 
@@ -257,8 +261,28 @@ def energy_elec(ks, dm=None, h1e=None, vhf=None):
 
 def prune_small_rho_grids_(ks, mol, dm, grids):
     rho = ks._numint.get_rho(mol, dm, grids, ks.max_memory)
+    if ks.small_rho_reprune_cycle > 0:
+        return grids.prune_by_density_(rho, ks.small_rho_cutoff, dm)
     return grids.prune_by_density_(rho, ks.small_rho_cutoff)
 
+def reprune_small_rho_grids_(ks, mol, dm, grids):
+    '''Prune the grids again with the current density. The grids are rebuilt
+    if the number of electrons on the pruned grids drifts more than
+    REPRUNE_NELEC_TOL, i.e. the pruned region starts to matter.
+    '''
+    ni = ks._numint
+    with lib.temporary_env(grids, non0tab=grids.screen_index):
+        rho = ni.get_rho(mol, dm, grids, ks.max_memory)
+    nelec_last = grids._nelec_pruned
+    if nelec_last is not None:
+        nelec = numpy.dot(rho, grids.weights)
+        if abs(nelec - nelec_last) > REPRUNE_NELEC_TOL:
+            logger.info(ks, 'nelec on pruned grids changed %g -> %g. Rebuild grids',
+                        nelec_last, nelec)
+            grids.build(with_non0tab=True)
+            rho = ni.get_rho(mol, dm, grids, ks.max_memory)
+    return grids.prune_by_density_(rho, ks.small_rho_cutoff, dm)
+
 def define_xc_(ks, description, xctype='LDA', hyb=0, rsh=(0,0,0)):
     libxc = ks._numint.libxc
     ks._numint = libxc.define_xc_(ks._numint, description, xctype, hyb, rsh)
@@ -315,6 +339,14 @@ class KohnShamDFT:
             Drop grids if their contribution to total electrons smaller than
             this cutoff value.  Default is 1e-7.
 
+        small_rho_reprune_cycle : int
+            If > 0, prune grids by the current density every N SCF cycles
+            (following the counter :attr:`cycles` of the SCF iterations).
+            The get_veff calls after SCF do not prune the grids. The shells
+            which have negligible contributions to the density are removed
+            from the screen index of each block too. Default is 0 (grids are
+            pruned once with the initial guess).
+
     Examples:
 
     >>> mol = gto.M(atom='O 0 0 0; H 0 0 1; H 0 1 0', basis='ccpvdz', verbose=0)
@@ -324,10 +356,12 @@ class KohnShamDFT:
     -76.415443079840458
     '''
 
-    _keys = {'xc', 'nlc', 'grids', 'disp', 'nlcgrids', 'small_rho_cutoff'}
+    _keys = {'xc', 'nlc', 'grids', 'disp', 'nlcgrids', 'small_rho_cutoff',
+             'small_rho_reprune_cycle'}
 
     # Use rho to filter grids
     small_rho_cutoff = getattr(__config__, 'dft_rks_RKS_small_rho_cutoff', 1e-7)
+    small_rho_reprune_cycle = getattr(__config__, 'dft_rks_RKS_small_rho_reprune_cycle', 0)
 
     def __init__(self, xc='LDA,VWN'):
         # By default, self.nlc = '' and self.disp = None
@@ -343,6 +377,7 @@ class KohnShamDFT:
 ##################################################
 # don't modify the following attributes, they are not input options
         self._numint = numint.NumInt()
+        self._reprune_cycle = 0
 
     @property
     def omega(self):
@@ -374,6 +409,8 @@ class KohnShamDFT:
             self.nlcgrids.dump_flags(verbose)
 
         log.info('small_rho_cutoff = %g', self.small_rho_cutoff)
+        if self.small_rho_reprune_cycle > 0:
+            log.info('small_rho_reprune_cycle = %d', self.small_rho_reprune_cycle)
         return self
 
     define_xc_ = define_xc_
@@ -482,8 +519,17 @@ class KohnShamDFT:
         hf.SCF.reset(self, mol)
         self.grids.reset(mol)
         self.nlcgrids.reset(mol)
+        self._reprune_cycle = 0
         return self
 
+    def _finalize(self):
+        # The density screen of grids.non0tab is specific to the ground state
+        # density. Restore the AO screen for the post-SCF (response) methods.
+        screen_index = getattr(self.grids, 'screen_index', None)
+        if screen_index is not None and self.grids.non0tab is not screen_index:
+            self.grids.non0tab = screen_index
+        return super()._finalize()
+
     def check_sanity(self):
         out = super().check_sanity()
         if self.do_nlc() and self.do_disp() and self._numint.libxc.is_nlc(self.xc):
@@ -505,7 +551,20 @@ class KohnShamDFT:
                 # Filter grids the first time setup grids
                 self.grids = prune_small_rho_grids_(self, self.mol, dm,
                                                     self.grids)
+            self._reprune_cycle = 0
             t0 = logger.timer(self, 'setting up grids', *t0)
+        elif (self.small_rho_reprune_cycle > 0 and self.small_rho_cutoff > 1e-20
+              and ground_state):
+            # Once in every small_rho_reprune_cycle SCF cycles. The SCF cycle
+            # counter does not change in the get_veff calls after SCF.
+            cycle = self.cycles
+            if (cycle != self._reprune_cycle and
+                    cycle % self.small_rho_reprune_cycle == 0):
+                self._reprune_cycle = cycle
+                t0 = (logger.process_clock(), logger.perf_counter())
+                self.grids = reprune_small_rho_grids_(self, self.mol, dm,
+                                                      self.grids)
+                t0 = logger.timer(self, 'pruning grids', *t0)
         is_nlc = self.do_nlc()
         if is_nlc and self.nlcgrids.coords is None:
             t0 = (logger.process_clock(), logger.perf_counter())
@@ -13,6 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import tempfile
+import time
 import unittest
 import numpy
 from pyscf import lib
@@ -178,6 +181,110 @@ class KnownValues(unittest.TestCase):
         idx = gen_grid.arg_group_grids(mol, coords)
         self.assertTrue(abs(ref - idx).max() == 0)
 
+    def test_local_partition(self):
+        mol = gto.M(atom=[('H', (0, .3*(i%2), 1.4*i)) for i in range(12)] + [
+            ('O', (1.2, 0, 3.)), ('C', (-1.3, 0, 9.))], unit='B', basis='sto3g')
+        g = gen_grid.Grids(mol)
+        g.atom_grid = (30, 86)
+        atom_grids_tab = g.gen_atomic_grids(mol)
+        for radii_adjust in (None, radi.treutler_atomic_radii_adjust):
+            ref = gen_grid.get_partition(mol, atom_grids_tab, radii_adjust,
+                                         radi.BRAGG_RADII, gen_grid.stratmann)
+            with lib.temporary_env(gen_grid, PARTITION_LOCAL_NATM=0):
+                dat = gen_grid.get_partition(mol, atom_grids_tab, radii_adjust,
+                                             radi.BRAGG_RADII, gen_grid.stratmann)
+            self.assertAlmostEqual(abs(dat[0] - ref[0]).max(), 0, 12)
+            self.assertAlmostEqual(abs(dat[1] - ref[1]).max(), 0, 12)
+
+        # original_becke has no finite cutoff and is always partitioned globally
+        with lib.temporary_env(gen_grid, _get_local_partition=None,
+                               PARTITION_LOCAL_NATM=0):
+            gen_grid.get_partition(mol, atom_grids_tab)
+
+        with lib.temporary_env(gen_grid, PARTITION_LOCAL_NATM=0):
+            coords, weights = gen_grid.get_partition(
+                mol, atom_grids_tab, becke_scheme=gen_grid.stratmann, concat=False)
+        self.assertEqual(len(weights), mol.natm)
+
+    def test_local_partition_timing(self):
+        mol = gto.M(atom=[(s, (2.9*i+x, 2.9*j+y, 2.9*k+z))
+                          for i in range(3) for j in range(3) for k in range(3)
+                          for s, (x, y, z) in (('O', (0, 0, 0)),
+                                               ('H', (0, -.757, .587)),
+                                               ('H', (0, .757, .587)))],
+                    basis='sto3g')
+        g = gen_grid.Grids(mol)
+        g.atom_grid = (20, 26)
+        atom_grids_tab = g.gen_atomic_grids(mol)
+        t0 = time.perf_counter()
+        with lib.temporary_env(gen_grid, PARTITION_LOCAL_NATM=mol.natm):
+            ref = gen_grid.get_partition(mol, atom_grids_tab,
+                                         becke_scheme=gen_grid.stratmann)
+        t1 = time.perf_counter()
+        with lib.temporary_env(gen_grid, PARTITION_LOCAL_NATM=0):
+            dat = gen_grid.get_partition(mol, atom_grids_tab,
+                                         becke_scheme=gen_grid.stratmann)
+        t2 = time.perf_counter()
+        self.assertAlmostEqual(abs(dat[1] - ref[1]).max(), 0, 12)
+        self.assertLess(t2 - t1, t1 - t0)
+
+    def test_grids_cache(self):
+        ref = gen_grid.Grids(h2o).build(with_non0tab=True)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            g = gen_grid.Grids(h2o)
+            g.cache_dir = cache_dir
+            g.build(with_non0tab=True)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            g1 = gen_grid.Grids(h2o).set(cache_dir=cache_dir)
+            with lib.temporary_env(gen_grid, get_partition=None):
+                g1.build(with_non0tab=True)
+            self.assertAlmostEqual(abs(g1.coords - ref.coords).max(), 0, 14)
+            self.assertAlmostEqual(abs(g1.weights - ref.weights).max(), 0, 14)
+            self.assertTrue(numpy.array_equal(g1.non0tab, ref.non0tab))
+            self.assertTrue(g1.screen_index is g1.non0tab)
+
+            g1 = gen_grid.Grids(h2o).set(cache_dir=cache_dir, level=2)
+            g1.build(with_non0tab=True)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            mol1 = h2o.set_geom_('O 0 0 0; H 0 -.75 .6; H 0 .75 .6', inplace=False)
+            gen_grid.Grids(mol1).set(cache_dir=cache_dir).build()
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+    def test_prune_by_density(self):
+        mf = dft.RKS(h2o)
+        dm = mf.get_init_guess()
+        g = gen_grid.Grids(h2o).build(with_non0tab=True)
+        ngrids = g.weights.size
+        rho = mf._numint.get_rho(h2o, dm, g)
+        g.prune_by_density_(rho, 1e-7, dm)
+        self.assertTrue(g.weights.size < ngrids)
+        self.assertEqual(g._ngrids_unpruned, ngrids)
+        self.assertTrue(g.non0tab is not g.screen_index)
+        self.assertTrue(numpy.all(g.non0tab <= g.screen_index))
+        nelec = mf._numint.get_rho(h2o, dm, g).dot(g.weights)
+        self.assertAlmostEqual(nelec, g._nelec_pruned, 6)
+
+        # A second pruning step uses the threshold of the unpruned grids
+        with lib.temporary_env(g, non0tab=g.screen_index):
+            rho = mf._numint.get_rho(h2o, dm, g)
+        ngrids1 = g.weights.size
+        g.prune_by_density_(rho, 1e-7)
+        self.assertEqual(g.weights.size, ngrids1)
+        self.assertTrue(g.non0tab is g.screen_index)
+
+    def test_screen_index_by_density(self):
+        g = gen_grid.Grids(h2o).build(with_non0tab=True)
+        nao = h2o.nao
+        dm = numpy.zeros((nao,nao))
+        screen_index = gen_grid.screen_index_by_density(
+            h2o, g.screen_index, dm, g.weights, 1e-7)
+        self.assertEqual(abs(screen_index).max(), 0)
+        dm = numpy.eye(nao)
+        screen_index = gen_grid.screen_index_by_density(
+            h2o, g.screen_index, dm, g.weights, 0)
+        self.assertTrue(numpy.array_equal(screen_index, g.screen_index))
+
 class TreutlerAhlrichsGrids(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -127,6 +127,39 @@ class KnownValues(unittest.TestCase):
         method.direct_scf = False
         self.assertAlmostEqual(method.scf(), -76.384928823070567, 8)
 
+    def test_nr_b3lypg_mixed_precision(self):
+        method = dft.RKS(h2o)
+        method.grids.prune = dft.gen_grid.treutler_prune
+        method.grids.radi_method = dft.radi.gauss_chebyshev
+        method.grids.atom_grid = {"H": (50, 194), "O": (50, 194),}
+        method.xc = 'b3lypg'
+        method.max_memory = 0
+        method.mixed_precision = True
+        self.assertAlmostEqual(method.scf(), -76.384928823070567, 8)
+
+        method = dft.UKS(h2o_cation).set(xc='b88,p86', mixed_precision=True)
+        e_ref = dft.UKS(h2o_cation).set(xc='b88,p86').kernel()
+        self.assertAlmostEqual(method.kernel(), e_ref, 8)
+
+    def test_nr_b3lypg_reprune(self):
+        method = dft.RKS(h2o)
+        method.grids.prune = dft.gen_grid.treutler_prune
+        method.grids.atom_grid = {"H": (50, 194), "O": (50, 194),}
+        method.xc = 'b3lypg'
+        method.small_rho_reprune_cycle = 2
+        self.assertAlmostEqual(method.scf(), -76.384928891413438, 6)
+        self.assertTrue(method.grids.non0tab is method.grids.screen_index)
+        # Grids are not pruned after SCF
+        coords = method.grids.coords
+        dm = method.make_rdm1()
+        for i in range(3):
+            method.get_veff(h2o, dm)
+        self.assertTrue(method.grids.coords is coords)
+
+        method = dft.UKS(h2o_cation).set(xc='b88,p86', small_rho_reprune_cycle=2)
+        e_ref = dft.UKS(h2o_cation).set(xc='b88,p86').kernel()
+        self.assertAlmostEqual(method.kernel(), e_ref, 6)
+
     def test_nr_uks_lsda(self):
         method = dft.UKS(h2osym_cation)
         method.grids.prune = dft.gen_grid.treutler_prune
@@ -273,6 +273,57 @@ class KnownValues(unittest.TestCase):
         mat2 = dft.numint.eval_mat(mol, ao, weight, [rho]*2, vxc_1, xctype='MGGA', spin=1)
         self.assertAlmostEqual(abs(mat0 - mat2).max(), 0, 9)
 
+    def test_block_sparse_ao(self):
+        numpy.random.seed(10)
+        ngrids = 300
+        coords = numpy.random.random((ngrids,3))*4 - 2
+        nao = mol.nao_nr()
+        dm = numpy.random.random((nao,nao))
+        dm = dm + dm.T
+        weight = numpy.random.random(ngrids)
+        vxc = numpy.random.random((4,ngrids))
+        mask = dft.gen_grid.make_mask(mol, coords)
+        ao = dft.numint.eval_ao(mol, coords, deriv=1, non0tab=mask)
+        ao_sparse = dft.numint.eval_ao_sparse(mol, coords, deriv=1, non0tab=mask)
+        self.assertTrue(ao_sparse.ao.shape[-1] < nao)
+        self.assertAlmostEqual(abs(ao_sparse.todense() - ao).max(), 0, 12)
+
+        c0 = numint._dot_ao_dm(mol, ao[0], dm, None, None, None)
+        c1 = numint._dot_ao_dm(mol, ao_sparse[0], dm, None, None, None)
+        self.assertAlmostEqual(abs(c0 - c1).max(), 0, 9)
+
+        rho0 = dft.numint.eval_rho(mol, ao, dm, mask, xctype='GGA', hermi=1)
+        rho1 = dft.numint.eval_rho(mol, ao_sparse, dm, xctype='GGA', hermi=1)
+        self.assertAlmostEqual(abs(rho0 - rho1).max(), 0, 9)
+
+        mat0 = dft.numint.eval_mat(mol, ao, weight, rho0, vxc[:2], mask, xctype='GGA')
+        mat1 = dft.numint.eval_mat(mol, ao_sparse, weight, rho0, vxc[:2], xctype='GGA')
+        self.assertEqual(mat1.shape, (ao_sparse.ao.shape[-1],) * 2)
+        mat1 = ao_sparse.unpack_mat(mat1, numpy.zeros((nao,nao)))
+        self.assertAlmostEqual(abs(mat0 - mat1).max(), 0, 9)
+
+    def test_block_sparse_vxc(self):
+        numpy.random.seed(10)
+        nao = mol.nao_nr()
+        dms = numpy.random.random((2,nao,nao))
+        dms = numpy.einsum('xij,xkj->xik', dms, dms) * .01
+        ni = dft.numint.NumInt()
+        ni.ao_cache = False
+        blocks = list(ni.block_loop(mol, mf.grids, nao, 1, blksize=numint.BLKSIZE*8,
+                                    block_sparse=True))
+        self.assertTrue(any(isinstance(ao, numint.BlockSparseAO)
+                            for ao, mask, weight, coords in blocks))
+        blocks = None
+        for xc in ('lda,', 'b88,', 'm06l,'):
+            with lib.temporary_env(numint, BLOCK_SPARSE_RATIO=0):
+                ref_rks = ni.nr_rks(mol, mf.grids, xc, dms)
+                ref_uks = ni.nr_uks(mol, mf.grids, xc, dms)
+            with lib.temporary_env(numint, BLOCK_SPARSE_RATIO=1.1):
+                rks = ni.nr_rks(mol, mf.grids, xc, dms)
+                uks = ni.nr_uks(mol, mf.grids, xc, dms)
+            for ref, v in zip(ref_rks + ref_uks, rks + uks):
+                self.assertAlmostEqual(abs(v - ref).max(), 0, 9)
+
     def test_rks_vxc(self):
         numpy.random.seed(10)
         nao = mol.nao_nr()
@@ -285,6 +336,105 @@ class KnownValues(unittest.TestCase):
         v = mf._numint.nr_vxc(mol, mf.grids, '', dms, spin=0, hermi=0)[2]
         self.assertAlmostEqual(abs(v).max(), 0, 9)
 
+    def test_rks_vxc_single_precision(self):
+        numpy.random.seed(10)
+        nao = h2o.nao_nr()
+        dm = numpy.random.random((nao,nao))
+        dm = dm.dot(dm.T) * .1
+        grids = dft.gen_grid.Grids(h2o)
+        ni = dft.numint.NumInt()
+        for xc in ('LDA,', 'B88,', 'TPSS'):
+            ref = ni.nr_vxc(h2o, grids, xc, dm)
+            ni.ao_dtype = numpy.float32
+            n, e, v = ni.nr_vxc(h2o, grids, xc, dm)
+            ni.ao_dtype = numpy.double
+            self.assertEqual(v.dtype, numpy.double)
+            self.assertAlmostEqual(abs(n - ref[0]) / n, 0, 5)
+            self.assertAlmostEqual(abs(e - ref[1]) / e, 0, 5)
+            self.assertAlmostEqual(abs(v - ref[2]).max(), 0, 4)
+
+    def test_ao_cache(self):
+        numpy.random.seed(10)
+        nao = h2o.nao_nr()
+        dm = numpy.random.random((nao,nao))
+        dm = dm.dot(dm.T) * .1
+        grids = dft.gen_grid.Grids(h2o)
+        ni = dft.numint.NumInt()
+        ref = ni.nr_vxc(h2o, grids, 'B88,', dm)
+        self.assertEqual(len(ni._ao_caches), 0)
+
+        ni.ao_cache = True
+        v0 = ni.nr_vxc(h2o, grids, 'B88,', dm)
+        self.assertTrue(ni._ao_caches[grids].complete)
+        v1 = ni.nr_vxc(h2o, grids, 'B88,', dm)
+        self.assertAlmostEqual(abs(v0[2] - ref[2]).max(), 0, 12)
+        self.assertAlmostEqual(abs(v1[2] - ref[2]).max(), 0, 12)
+        self.assertAlmostEqual(abs(v1[1] - ref[1]), 0, 12)
+
+        # The block size of the cache does not follow the available memory
+        cache = ni._ao_caches[grids]
+        v1 = ni.nr_vxc(h2o, grids, 'B88,', dm, max_memory=-100)
+        self.assertTrue(ni._ao_caches[grids] is cache)
+        self.assertAlmostEqual(abs(v1[2] - ref[2]).max(), 0, 12)
+
+        # AO values spilled to the memory-mapped file
+        ni = dft.numint.NumInt()
+        ni.ao_cache = True
+        with lib.temporary_env(numint, AO_CACHE_MEMORY_RATIO=1e-6):
+            ni.nr_vxc(h2o, grids, 'B88,', dm)
+            self.assertTrue(ni._ao_caches[grids]._mmap is not None)
+            v1 = ni.nr_vxc(h2o, grids, 'B88,', dm)
+        self.assertAlmostEqual(abs(v1[2] - ref[2]).max(), 0, 12)
+
+        # Cache is invalidated when geometry changes
+        cache = ni._ao_caches[grids]
+        mol1 = h2o.set_geom_('O 0 0 0; H 0 -.75 .6; H 0 .75 .6', inplace=False)
+        grids.reset(mol1)
+        ni.nr_vxc(mol1, grids, 'B88,', dm)
+        self.assertTrue(ni._ao_caches[grids] is not cache)
+
+    def test_ao_cache_for_each_grids(self):
+        # VV10 functionals use grids and nlcgrids with the same NumInt
+        mf = dft.RKS(h2o, xc='wb97m_v')
+        mf._numint.ao_cache = True
+        mf.kernel()
+        caches = dict(mf._numint._ao_caches)
+        self.assertEqual(len(caches), 2)
+        self.assertTrue(caches[mf.grids].match_system(h2o, mf.grids))
+        self.assertTrue(caches[mf.nlcgrids].match_system(h2o, mf.nlcgrids))
+        mf.get_veff(dm=mf.make_rdm1())
+        for grids, cache in caches.items():
+            self.assertTrue(mf._numint._ao_caches[grids] is cache)
+
+    def test_nr_vxc_multi(self):
+        numpy.random.seed(10)
+        nao = h2o.nao_nr()
+        dm = numpy.random.random((2,nao,nao))
+        dm = numpy.einsum('spi,sqi->spq', dm, dm) * .1
+        grids = dft.gen_grid.Grids(h2o)
+        ni = dft.numint.NumInt()
+        xcs = ['LDA,VWN', 'B88,P86', 'HF', 'TPSS', 'B3LYP']
+        n, excs, vmats = ni.nr_vxc_multi(h2o, grids, xcs, dm[0], with_vxc=True)
+        for xc, e, v in zip(xcs, excs, vmats):
+            ref = ni.nr_rks(h2o, grids, xc, dm[0])
+            # nr_rks does not integrate the density for HF
+            if xc != 'HF':
+                self.assertAlmostEqual(n, ref[0], 9)
+            self.assertAlmostEqual(e, ref[1], 9)
+            self.assertAlmostEqual(abs(v - ref[2]).max(), 0, 9)
+
+        n, excs, vmats = ni.nr_vxc_multi(h2o, grids, xcs, dm, spin=1, with_vxc=True)
+        for xc, e, v in zip(xcs, excs, vmats):
+            ref = ni.nr_uks(h2o, grids, xc, dm)
+            if xc != 'HF':
+                self.assertAlmostEqual(abs(n - ref[0]).max(), 0, 9)
+            self.assertAlmostEqual(e, ref[1], 9)
+            self.assertAlmostEqual(abs(v - ref[2]).max(), 0, 9)
+
+        n, excs, vmats = ni.nr_vxc_multi(h2o, grids, xcs[:2], dm[0])
+        self.assertTrue(vmats is None)
+        self.assertAlmostEqual(excs[1], ni.nr_rks(h2o, grids, xcs[1], dm[0])[1], 9)
+
     def test_uks_vxc(self):
         numpy.random.seed(10)
         nao = h2o.nao_nr()
@@ -486,6 +636,48 @@ class KnownValues(unittest.TestCase):
                                rho0=rvf[0], vxc=rvf[1], fxc=rvf[2])
         self.assertAlmostEqual(abs(v-v1).max(), 0, 8)
 
+    def test_xc_kernel_outcore(self):
+        numpy.random.seed(10)
+        nao = mol1.nao_nr()
+        dm0 = numpy.random.random((2,nao,nao))
+        e, mo_coeff = numpy.linalg.eigh(dm0)
+        mo_occ = numpy.ones((2,nao))
+        mo_occ[:,-2:] = -1
+        dm0 = numpy.einsum('xpi,xi,xqi->xpq', mo_coeff, mo_occ, mo_coeff)
+        dms = numpy.random.random((2,nao,nao))
+        ni = dft.numint.NumInt()
+        grids = dft.Grids(mol1).build()
+
+        rvf = ni.cache_xc_kernel(mol1, grids, 'B88,', mo_coeff[0], mo_occ[0], spin=0)
+        v = ni.nr_rks_fxc(mol1, grids, 'B88,', dm0[0], dms[0], fxc=rvf[2])
+        max_memory = lib.current_memory()[0] + 1
+        with lib.temporary_env(numint, XC_KERNEL_INCORE_RATIO=0):
+            rvf1 = ni.cache_xc_kernel(mol1, grids, 'B88,', mo_coeff[0], mo_occ[0],
+                                      spin=0, max_memory=max_memory)
+        self.assertTrue(isinstance(rvf1[2], numpy.memmap))
+        self.assertAlmostEqual(abs(rvf1[1] - rvf[1]).max(), 0, 12)
+        self.assertAlmostEqual(abs(rvf1[2] - rvf[2]).max(), 0, 12)
+        v1 = ni.nr_rks_fxc(mol1, grids, 'B88,', dm0[0], dms[0], fxc=rvf1[2],
+                           max_memory=max_memory)
+        self.assertAlmostEqual(abs(v-v1).max(), 0, 9)
+
+        # fxc is kept in memory if it is small, even when the process uses
+        # more than max_memory
+        rvf1 = ni.cache_xc_kernel(mol1, grids, 'B88,', mo_coeff[0], mo_occ[0],
+                                  spin=0, max_memory=lib.current_memory()[0]*.5)
+        self.assertFalse(isinstance(rvf1[2], numpy.memmap))
+        self.assertAlmostEqual(abs(rvf1[2] - rvf[2]).max(), 0, 12)
+
+        rvf = ni.cache_xc_kernel(mol1, grids, 'm06l', mo_coeff, mo_occ, spin=1)
+        v = ni.nr_uks_fxc(mol1, grids, 'm06l', dm0, dms, fxc=rvf[2])
+        with lib.temporary_env(numint, XC_KERNEL_INCORE_RATIO=0):
+            rvf1 = ni.cache_xc_kernel(mol1, grids, 'm06l', mo_coeff, mo_occ,
+                                      spin=1, max_memory=max_memory)
+        self.assertTrue(isinstance(rvf1[2], numpy.memmap))
+        v1 = ni.nr_uks_fxc(mol1, grids, 'm06l', dm0, dms, fxc=rvf1[2],
+                           max_memory=max_memory)
+        self.assertAlmostEqual(abs(v-v1).max(), 0, 9)
+
     def test_vv10nlc(self):
         numpy.random.seed(10)
         rho = numpy.random.random((4,20))
@@ -498,6 +690,49 @@ class KnownValues(unittest.TestCase):
         self.assertAlmostEqual(lib.fp(v[0]), 0.15894647203764295, 9)
         self.assertAlmostEqual(lib.fp(v[1]), 0.20500922537924576, 9)
 
+    def test_vv10nlc_local(self):
+        numpy.random.seed(10)
+        rho = numpy.random.random((4,200))
+        coords = (numpy.random.random((200,3))-.5)*40
+        vvrho = numpy.random.random((4,300))
+        vvweight = numpy.random.random(300)
+        vvcoords = (numpy.random.random((300,3))-.5)*40
+        nlc_pars = .8, .3
+        exc, vxc = numint._vv10nlc(rho, coords, vvrho, vvweight, vvcoords, nlc_pars)
+        with lib.temporary_env(numint, VV10_LOCAL_NGRIDS=0, VV10_CUTOFF=1e-20):
+            exc1, vxc1 = numint._vv10nlc(rho, coords, vvrho, vvweight, vvcoords, nlc_pars)
+        self.assertAlmostEqual(abs(exc1 - exc).max(), 0, 9)
+        self.assertAlmostEqual(abs(vxc1 - vxc).max(), 0, 9)
+
+        with lib.temporary_env(numint, VV10_LOCAL_NGRIDS=0, VV10_CUTOFF=1e-6):
+            exc1 = numint._vv10nlc(rho, coords, vvrho, vvweight, vvcoords, nlc_pars)[0]
+        self.assertTrue(abs(rho[0] * (exc1 - exc)).max() < 1e-6)
+
+    def test_vv10nlc_local_truncation(self):
+        mol = gto.M(atom='''O 0 0 0; H 0 -.757 .587; H 0 .757 .587
+                    O 8 0 0; H 8 -.757 .587; H 8 .757 .587''', basis='631g',
+                    verbose=0)
+        grids = dft.gen_grid.Grids(mol).set(atom_grid=(30, 110)).build()
+        dm = dft.RKS(mol).get_init_guess()
+        ni = dft.numint.NumInt()
+        ref = ni.nr_nlc_vxc(mol, grids, 'wb97m_v', dm)
+
+        truncated = []
+        neighbor_lists = numint._vv10_neighbor_lists
+        def check_neighbor_lists(coords, R, W0, vvcoords, *args):
+            for idx, vvidx in neighbor_lists(coords, R, W0, vvcoords, *args):
+                truncated.append(vvidx.size < vvcoords.shape[0])
+                yield idx, vvidx
+        cutoff = 1e-8
+        with lib.temporary_env(numint, VV10_LOCAL_NGRIDS=0, VV10_CUTOFF=cutoff,
+                               _vv10_neighbor_lists=check_neighbor_lists):
+            n, e, v = ni.nr_nlc_vxc(mol, grids, 'wb97m_v', dm)
+        self.assertTrue(any(truncated))
+        # rho*F is changed by less than cutoff on each grid
+        self.assertTrue(abs(e - ref[1]) < .5 * cutoff * grids.weights.sum())
+        self.assertAlmostEqual(e, ref[1], 7)
+        self.assertAlmostEqual(abs(v - ref[2]).max(), 0, 7)
+
     def test_nr_uks_vxc_vv10(self):
         method = dft.UKS(h2o)
         dm = method.get_init_guess()
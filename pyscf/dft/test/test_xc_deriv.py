@@ -600,6 +600,23 @@ class KnownValues(unittest.TestCase):
         for (idx, equiv_idx) in zip(indices, equiv_indices):
             self.assertTrue((idx == equiv_idx).all())
 
+    def test_transform_xc_threads(self):
+        np.random.seed(2)
+        ng = 1000
+        for xctype, spin, nvar, xlen in [('GGA', 0, 4, 2), ('GGA', 1, 4, 5),
+                                         ('MGGA', 1, 5, 7)]:
+            rho = np.random.rand(spin+1, nvar, ng)
+            if spin == 0:
+                rho = rho[0]
+            xc_val = np.random.rand(lib.comb(xlen+3, 3), ng)
+            for order in (1, 2, 3):
+                ref = xc_deriv._transform_xc(rho, xc_val, xctype, spin, order)
+                with lib.temporary_env(xc_deriv, TRANSFORM_XC_BLKSIZE=96):
+                    with lib.with_omp_threads(3):
+                        dat = xc_deriv.transform_xc(rho, xc_val, xctype, spin, order)
+                self.assertEqual(abs(dat - ref).max(), 0)
+
+
 if __name__ == "__main__":
     print("Test xc_deriv")
     unittest.main()
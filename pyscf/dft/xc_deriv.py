@@ -23,11 +23,18 @@ import math
 import itertools
 from functools import lru_cache
 import ctypes
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from pyscf import lib
+from pyscf import __config__
 
 libdft = lib.load_library('libdft')
 
+# For GGA and MGGA functionals, transform_xc splits the grids into blocks of
+# TRANSFORM_XC_BLKSIZE and transforms the blocks in lib.num_threads() threads.
+# The results do not depend on the number of threads.
+TRANSFORM_XC_BLKSIZE = getattr(__config__, 'dft_xc_deriv_transform_xc_blksize', 8192)
+
 
 def transform_vxc(rho, vxc, xctype, spin=0):
     r'''
@@ -539,6 +546,34 @@ _XC_NVAR = {
 
 def transform_xc(rho, xc_val, xctype, spin, order):
     '''General transformation to construct XC derivative tensor'''
+    xc_val = np.asarray(xc_val, order='C')
+    ngrids = xc_val.shape[-1]
+    nthreads = lib.num_threads()
+    if (order == 0 or xctype not in ('GGA', 'MGGA') or nthreads == 1 or
+            ngrids < TRANSFORM_XC_BLKSIZE * 2):
+        return _transform_xc(rho, xc_val, xctype, spin, order)
+
+    rho = np.asarray(rho, order='C')
+    blocks = list(lib.prange(0, ngrids, TRANSFORM_XC_BLKSIZE))
+    p0, p1 = blocks[0]
+    xc_blk = _transform_xc(rho[...,p0:p1], xc_val[:,p0:p1], xctype, spin, order)
+    xc_out = np.empty(xc_blk.shape[:-1] + (ngrids,))
+    xc_out[...,p0:p1] = xc_blk
+    xc_blk = None
+
+    # Each task writes to its own slice of xc_out. The C functions in
+    # _unfold_gga release the GIL.
+    def transform_block(p0, p1):
+        xc_out[...,p0:p1] = _transform_xc(rho[...,p0:p1], xc_val[:,p0:p1],
+                                          xctype, spin, order)
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        futures = [executor.submit(transform_block, p0, p1)
+                   for p0, p1 in blocks[1:]]
+        for f in futures:
+            f.result()
+    return xc_out
+
+def _transform_xc(rho, xc_val, xctype, spin, order):
     xc_val = np.asarray(xc_val, order='C')
     if order == 0:
         return xc_val[0]
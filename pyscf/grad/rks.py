@@ -291,9 +291,28 @@ def _vv10nlc_grad(rho, coords, vvrho, vvweight, vvcoords, nlc_pars):
     W0=(W0tmp+Pi43*R)**0.5
     K=Kvv*(R**(1./6.))
 
+    if vvcoords.shape[0] > numint.VV10_LOCAL_NGRIDS:
+        F = numpy.empty(R.shape +(3,), order='C')
+        for idx, vvidx in numint._vv10_neighbor_lists(coords, R, W0, vvcoords,
+                                                      RpW, W0p):
+            F[idx] = _vv10nlc_grad_kernel(coords[idx], vvcoords[vvidx],
+                                          W0[idx], K[idx], W0p[vvidx],
+                                          Kp[vvidx], RpW[vvidx])
+    else:
+        F = _vv10nlc_grad_kernel(coords, vvcoords, W0, K, W0p, Kp, RpW)
+    #exc is multiplied by Rho later
+    exc[threshind] = F
+    return exc, Beta
+
+def _vv10nlc_grad_kernel(coords, vvcoords, W0, K, W0p, Kp, RpW):
     vvcoords = numpy.asarray(vvcoords, order='C')
     coords = numpy.asarray(coords, order='C')
-    F = numpy.empty(R.shape +(3,), order='C')
+    W0 = numpy.asarray(W0, order='C')
+    K = numpy.asarray(K, order='C')
+    W0p = numpy.asarray(W0p, order='C')
+    Kp = numpy.asarray(Kp, order='C')
+    RpW = numpy.asarray(RpW, order='C')
+    F = numpy.empty((coords.shape[0],3), order='C')
     libdft.VXC_vv10nlc_grad(F.ctypes.data_as(ctypes.c_void_p),
                             vvcoords.ctypes.data_as(ctypes.c_void_p),
                             coords.ctypes.data_as(ctypes.c_void_p),
@@ -304,9 +323,7 @@ def _vv10nlc_grad(rho, coords, vvrho, vvweight, vvcoords, nlc_pars):
                             RpW.ctypes.data_as(ctypes.c_void_p),
                             ctypes.c_int(vvcoords.shape[0]),
                             ctypes.c_int(coords.shape[0]))
-    #exc is multiplied by Rho later
-    exc[threshind] = F
-    return exc, Beta
+    return F
 
 def get_vxc_full_response(ni, mol, grids, xc_code, dms, relativity=0, hermi=1,
                           max_memory=2000, verbose=None):
@@ -464,91 +481,77 @@ def grids_response_cc(grids):
         elif grids.radii_adjust == radi.becke_atomic_radii_adjust:
             rad = atomic_radii[charges] + 1e-200
         else:
-            fadjust = lambda i, j, g: g
-            gadjust = lambda *args: 1
-            return fadjust, gadjust
+            return numpy.zeros((mol.natm,mol.natm))
 
         rr = rad.reshape(-1,1) * (1./rad)
         a = .25 * (rr.T - rr)
         a[a<-.5] = -.5
         a[a>0.5] = 0.5
+        return a
 
-        def fadjust(i, j, g):
-            return g + a[i,j]*(1-g**2)
-
-        #: d[g + a[i,j]*(1-g**2)] /dg = 1 - 2*a[i,j]*g
-        def gadjust(i, j, g):
-            return 1 - 2*a[i,j]*g
-        return fadjust, gadjust
-
-    fadjust, gadjust = _radii_adjust(mol, grids.atomic_radii)
+    # g -> g + a[i,j]*(1-g**2);  d[g + a[i,j]*(1-g**2)] /dg = 1 - 2*a[i,j]*g
+    a = _radii_adjust(mol, grids.atomic_radii)
+    natm = mol.natm
 
     def gen_grid_partition(coords, atom_id):
         ngrids = coords.shape[0]
-        grid_dist = []
-        grid_norm_vec = []
-        for ia in range(mol.natm):
-            v = (atm_coords[ia] - coords).T
-            normv = numpy.linalg.norm(v,axis=0) + 1e-200
-            v /= normv
-            grid_dist.append(normv)
-            grid_norm_vec.append(v)
-
-        def get_du(ia, ib):  # JCP 98, 5612 (1993); (B10)
-            uab = atm_coords[ia] - atm_coords[ib]
-            duab = 1./atm_dist[ia,ib] * grid_norm_vec[ia]
-            duab-= uab[:,None]/atm_dist[ia,ib]**3 * (grid_dist[ia]-grid_dist[ib])
-            return duab
-
-        pbecke = numpy.ones((mol.natm,ngrids))
-        dpbecke = numpy.zeros((mol.natm,mol.natm,3,ngrids))
-        for ia in range(mol.natm):
-            for ib in range(ia):
-                g = 1/atm_dist[ia,ib] * (grid_dist[ia]-grid_dist[ib])
-                p0 = fadjust(ia, ib, g)
-                p1 = (3 - p0**2) * p0 * .5
-                p2 = (3 - p1**2) * p1 * .5
-                p3 = (3 - p2**2) * p2 * .5
-                t_uab = 27./16 * (1-p2**2) * (1-p1**2) * (1-p0**2) * gadjust(ia, ib, g)
-
-                s_uab = .5 * (1 - p3 + 1e-200)
-                s_uba = .5 * (1 + p3 + 1e-200)
-                pbecke[ia] *= s_uab
-                pbecke[ib] *= s_uba
-                pt_uab =-t_uab / s_uab
-                pt_uba = t_uab / s_uba
-
-# * When grid is on atom ia/ib, ua/ub == 0, d_uba/d_uab may have huge error
-#   How to remove this error?
-                duab = get_du(ia, ib)
-                duba = get_du(ib, ia)
-                if ia == atom_id:
-                    dpbecke[ia,ia] += pt_uab * duba
-                    dpbecke[ia,ib] += pt_uba * duba
-                else:
-                    dpbecke[ia,ia] += pt_uab * duab
-                    dpbecke[ia,ib] += pt_uba * duab
-
-                if ib == atom_id:
-                    dpbecke[ib,ib] -= pt_uba * duab
-                    dpbecke[ib,ia] -= pt_uab * duab
-                else:
-                    dpbecke[ib,ib] -= pt_uba * duba
-                    dpbecke[ib,ia] -= pt_uab * duba
-
-# * JCP 98, 5612 (1993); (B8) (B10) miss many terms
-                if ia != atom_id and ib != atom_id:
-                    ua_ub = grid_norm_vec[ia] - grid_norm_vec[ib]
-                    ua_ub /= atm_dist[ia,ib]
-                    dpbecke[atom_id,ia] -= pt_uab * ua_ub
-                    dpbecke[atom_id,ib] -= pt_uba * ua_ub
-
-        for ia in range(mol.natm):
-            dpbecke[:,ia] *= pbecke[ia]
-
+        grid_norm_vec = atm_coords[:,:,None] - coords.T
+        grid_dist = numpy.linalg.norm(grid_norm_vec, axis=1) + 1e-200
+        grid_norm_vec /= grid_dist[:,None]
+
+        pbecke = numpy.ones((natm,ngrids))
+        dpbecke = numpy.zeros((natm,natm,3,ngrids))
+        for ia in range(1, natm):
+            # All pairs (ia, ib) with ib < ia
+            ib = numpy.arange(ia)
+            rab = atm_dist[ia,:ia,None]
+            uab = atm_coords[ia] - atm_coords[:ia]
+            dg = grid_dist[ia] - grid_dist[:ia]
+            g = dg / rab
+            a_ab = a[ia,:ia,None]
+            p0 = g + a_ab * (1-g**2)
+            p1 = (3 - p0**2) * p0 * .5
+            p2 = (3 - p1**2) * p1 * .5
+            p3 = (3 - p2**2) * p2 * .5
+            t_uab = 27./16 * (1-p2**2) * (1-p1**2) * (1-p0**2) * (1 - 2*a_ab*g)
+
+            s_uab = .5 * (1 - p3 + 1e-200)
+            s_uba = .5 * (1 + p3 + 1e-200)
+            pbecke[ia] *= s_uab.prod(axis=0)
+            pbecke[:ia] *= s_uba
+            pt_uab =-t_uab / s_uab
+            pt_uba = t_uab / s_uba
+
+            # JCP 98, 5612 (1993); (B10)
+            du = uab[:,:,None] / rab[:,:,None]**3 * dg[:,None]
+            duab = grid_norm_vec[ia] / rab[:,:,None] - du
+            duba = grid_norm_vec[:ia] / rab[:,:,None] - du
+
+            if ia == atom_id:
+                dpbecke[ia,ia] += numpy.einsum('bg,bxg->xg', pt_uab, duba)
+                dpbecke[ia,:ia] += pt_uba[:,None] * duba
+            else:
+                dpbecke[ia,ia] += numpy.einsum('bg,bxg->xg', pt_uab, duab)
+                dpbecke[ia,:ia] += pt_uba[:,None] * duab
+
+            du_b = duba
+            if atom_id < ia:
+                du_b = duba.copy()
+                du_b[atom_id] = duab[atom_id]
+            dpbecke[ib,ib] -= pt_uba[:,None] * du_b
+            dpbecke[:ia,ia] -= pt_uab[:,None] * du_b
+
+            # JCP 98, 5612 (1993); (B8) (B10) miss many terms
+            if ia != atom_id:
+                ua_ub = (grid_norm_vec[ia] - grid_norm_vec[:ia]) / rab[:,:,None]
+                if atom_id < ia:
+                    ua_ub[atom_id] = 0
+                dpbecke[atom_id,ia] -= numpy.einsum('bg,bxg->xg', pt_uab, ua_ub)
+                dpbecke[atom_id,:ia] -= pt_uba[:,None] * ua_ub
+
+        dpbecke *= pbecke[:,None]
         return pbecke, dpbecke
 
-    natm = mol.natm
     for ia in range(natm):
         coords, vol = atom_grids_tab[mol.atom_symbol(ia)]
         coords = coords + atm_coords[ia]
@@ -323,6 +323,34 @@ class KnownValues(unittest.TestCase):
         e2 = mf_scanner(mol1.set_geom_('O  0. 0. -.001; 1  0. -0.757 0.587; 1  0. 0.757 0.587'))
         self.assertAlmostEqual(g[0,2], (e1-e2)/2e-3*lib.param.BOHR, 5)
 
+    def test_grad_with_scf_ao_cache(self):
+        mf1 = dft.RKS(mol, xc='lda,vwn')
+        mf1.conv_tol = 1e-12
+        mf1._numint.ao_cache = True
+        mf1.kernel()
+        cache = mf1._numint._ao_caches[mf1.grids]
+        self.assertTrue(cache is not None and cache.deriv == 0)
+        g1 = mf1.nuc_grad_method().kernel()
+        # The SCF cache is reused, not replaced by the gradients
+        self.assertTrue(mf1._numint._ao_caches[mf1.grids] is cache)
+
+        mf1._numint.ao_cache = False
+        g0 = mf1.nuc_grad_method().kernel()
+        self.assertAlmostEqual(abs(g1 - g0).max(), 0, 9)
+
+    def test_vv10nlc_grad_local(self):
+        numpy.random.seed(10)
+        rho = numpy.random.random((4,200))
+        coords = (numpy.random.random((200,3))-.5)*20
+        vvrho = numpy.random.random((4,300))
+        vvweight = numpy.random.random(300)
+        vvcoords = (numpy.random.random((300,3))-.5)*20
+        nlc_pars = .8, .3
+        ref = rks._vv10nlc_grad(rho, coords, vvrho, vvweight, vvcoords, nlc_pars)[0]
+        with lib.temporary_env(dft.numint, VV10_LOCAL_NGRIDS=0):
+            exc = rks._vv10nlc_grad(rho, coords, vvrho, vvweight, vvcoords, nlc_pars)[0]
+        self.assertAlmostEqual(abs(exc - ref).max(), 0, 9)
+
     def test_finite_diff_rks_grad_nlc(self):
 #[[ 2.91036539e-16  1.22693574e-15  2.45978284e-02]
 # [ 2.83888198e-17  2.66388957e-02 -1.23039325e-02]
@@ -21,11 +21,12 @@ DIIS
 """
 
 import sys
+import tempfile
 import numpy
 import scipy.linalg
 from pyscf.lib import logger
 from pyscf.lib import misc
-from pyscf.lib import numpy_helper
+from pyscf.lib import parameters as param
 from pyscf import __config__
 
 INCORE_SIZE = getattr(__config__, 'lib_diis_incore_size', 10000000)  # 80 MB
@@ -44,6 +45,9 @@ class DIIS:
             DIIS subspace size. The maximum number of the vectors to be stored.
         min_space
             The minimal size of subspace before DIIS extrapolation.
+        incore : bool
+            Whether to keep all vectors in memory. If not, vectors larger
+            than INCORE_SIZE are held in memory-mapped temporary files.
 
     Functions:
         update(x, xerr=None) :
@@ -119,15 +123,55 @@ class DIIS:
         self._H = None
         self._xprev = None
         self._err_vec_touched = False
+        # Ring buffers of vectors and error vectors. Each is a 2D array of
+        # shape (space, vector_size), backed by numpy.memmap if the vectors
+        # are too large to be held in memory.
+        self._xs = None
+        self._es = None
+        self._mmap_files = []
+
+    def _alloc(self, shape, dtype):
+        '''Allocate a 2D array for the ring buffer in memory or in a
+        memory-mapped temporary file'''
+        if numpy.prod(shape[1:]) < INCORE_SIZE or self.incore:
+            return numpy.zeros(shape, dtype=dtype)
+        ftmp = tempfile.NamedTemporaryFile(dir=param.TMPDIR, suffix='.diis')
+        self._mmap_files.append(ftmp)
+        return numpy.memmap(ftmp, dtype=dtype, mode='w+', shape=shape)
+
+    def _ring(self, key, size, dtype):
+        '''The ring buffer for key ('x' or 'e'), reallocated if it cannot hold
+        the vectors of the given size and dtype'''
+        buf = getattr(self, '_'+key+'s')
+        space = max(self.space, self._head+1)
+        if buf is None:
+            buf = self._alloc((space, size), dtype)
+        elif (buf.shape[1] != size or buf.shape[0] < space or
+              numpy.result_type(buf.dtype, dtype) != buf.dtype):
+            new_buf = self._alloc((space, size), numpy.result_type(buf.dtype, dtype))
+            if buf.shape[1] == size:
+                n = buf.shape[0]
+                for p0, p1 in misc.prange(0, size, BLOCK_SIZE):
+                    new_buf[:n,p0:p1] = buf[:,p0:p1]
+            buf = new_buf
+        setattr(self, '_'+key+'s', buf)
+        return buf
 
     def _store(self, key, value):
-        incore = value.size < INCORE_SIZE or self.incore
-        if incore:
-            self._buffer[key] = value
+        value = value.ravel()
+        if key == 'xprev':
+            if value.size < INCORE_SIZE or self.incore:
+                self._xprev = numpy.array(value, copy=True)
+            else:
+                if self._xprev is None or self._xprev.size != value.size:
+                    self._xprev = self._alloc((1, value.size), value.dtype)[0]
+                self._xprev[:] = value
+        else:
+            self._ring(key[0], value.size, value.dtype)[int(key[1:])] = value
 
-        # save the error vector if filename is given, this file can be used to
+        # save the vector if filename is given, this file can be used to
         # restore the DIIS state
-        if (not incore) or isinstance(self.filename, str):
+        if isinstance(self.filename, str):
             if self._diisfile is None:
                 self._diisfile = misc.H5TmpFile(self.filename, 'w')
             if key in self._diisfile:
@@ -161,40 +205,28 @@ class DIIS:
             # If push_err_vec is not called in advance, the error vector is generated
             # as the diff of the current vec and previous returned vec (._xprev)
             # So store the first trial vec as the previous returned vec
-            self._xprev = x
             self._store('xprev', x)
-            if 'xprev' not in self._buffer:  # not incore
-                self._xprev = self._diisfile['xprev']
 
         else:
             if self._head >= self.space:
                 self._head = 0
             self._bookkeep.append(self._head)
-            ekey = 'e%d'%self._head
-            xkey = 'x%d'%self._head
-            self._store(xkey, x)
-            if x.size < INCORE_SIZE or self.incore:
-                self._store(ekey, x - numpy.asarray(self._xprev))
-            else:  # not call _store to reduce memory footprint
-                if ekey not in self._diisfile:
-                    self._diisfile.create_dataset(ekey, (x.size,), x.dtype)
-                edat = self._diisfile[ekey]
-                for p0, p1 in misc.prange(0, x.size, BLOCK_SIZE):
-                    edat[p0:p1] = x[p0:p1] - self._xprev[p0:p1]
-                self._diisfile.flush()
+            self._store('x%d'%self._head, x)
+            # Generate the error vector in the ring buffer directly to reduce
+            # memory footprint
+            es = self._ring('e', x.size, x.dtype)
+            edat = es[self._head]
+            for p0, p1 in misc.prange(0, x.size, BLOCK_SIZE):
+                edat[p0:p1] = x[p0:p1] - self._xprev[p0:p1]
+            if isinstance(self.filename, str):
+                self._store('e%d'%self._head, edat)
             self._head += 1
 
     def get_err_vec(self, idx):
-        if self._buffer:
-            return self._buffer['e%d'%idx]
-        else:
-            return self._diisfile['e%d'%idx]
+        return self._es[idx]
 
     def get_vec(self, idx):
-        if self._buffer:
-            return self._buffer['x%d'%idx]
-        else:
-            return self._diisfile['x%d'%idx]
+        return self._xs[idx]
 
     def get_num_vec(self):
         return len(self._bookkeep)
@@ -217,28 +249,27 @@ class DIIS:
         if nd < self.min_space:
             return x
 
-        dt = numpy.asarray(self.get_err_vec(self._head-1))
+        # Only the overlaps between the newest error vector and the others are
+        # computed. The rest of the B-matrix is kept from previous iterations.
+        es = self._es
+        dt = es[self._head-1]
         if self._H is None:
-            self._H = numpy.zeros((self.space+1,self.space+1), dt.dtype)
+            self._H = numpy.zeros((self.space+1,self.space+1), es.dtype)
             self._H[0,1:] = self._H[1:,0] = 1
-        for i in range(nd):
-            tmp = 0
-            dti = self.get_err_vec(i)
-            for p0, p1 in misc.prange(0, dt.size, BLOCK_SIZE):
-                tmp += numpy.dot(dt[p0:p1].conj(), dti[p0:p1])
-            self._H[self._head,i+1] = tmp
-            self._H[i+1,self._head] = tmp.conjugate()
-        dt = None
+        elif self._H.dtype != es.dtype:
+            self._H = self._H.astype(numpy.result_type(self._H, es))
+        tmp = 0
+        for p0, p1 in misc.prange(0, dt.size, BLOCK_SIZE):
+            tmp += numpy.dot(es[:nd,p0:p1], dt[p0:p1].conj())
+        self._H[self._head,1:nd+1] = tmp
+        self._H[1:nd+1,self._head] = tmp.conjugate()
+        dt = es = None
 
         if self._xprev is None:
             xnew = self.extrapolate(nd)
         else:
-            self._xprev = None # release memory first
-            self._xprev = xnew = self.extrapolate(nd)
-
+            xnew = self.extrapolate(nd)
             self._store('xprev', xnew)
-            if 'xprev' not in self._buffer:  # not incore
-                self._xprev = self._diisfile['xprev']
         return xnew.reshape(x.shape)
 
     def extrapolate(self, nd=None):
@@ -264,13 +295,11 @@ class DIIS:
                 raise e
         logger.debug1(self, 'diis-c %s', c)
 
-        xnew = None
-        for i, ci in enumerate(c[1:]):
-            xi = self.get_vec(i)
-            if xnew is None:
-                xnew = numpy.zeros(xi.size, c.dtype)
-            for p0, p1 in misc.prange(0, xi.size, BLOCK_SIZE):
-                xnew[p0:p1] += xi[p0:p1] * ci
+        xs = self._xs
+        c = c[1:]
+        xnew = numpy.empty(xs.shape[1], numpy.result_type(c, xs))
+        for p0, p1 in misc.prange(0, xs.shape[1], BLOCK_SIZE):
+            xnew[p0:p1] = numpy.dot(c, xs[:nd,p0:p1])
         return xnew
 
     def restore(self, filename, inplace=True):
@@ -283,7 +312,7 @@ class DIIS:
             self._diisfile = fdiis
 
         diis_keys = fdiis.keys()
-        x_keys = [k for k in diis_keys if k[0] == 'x']
+        x_keys = [k for k in diis_keys if k[0] == 'x' and k != 'xprev']
         e_keys = [k for k in diis_keys if k[0] == 'e']
         # errvec may be incomplete if program is terminated when generating errvec.
         # The last vector or errvec should be excluded.
@@ -291,42 +320,26 @@ class DIIS:
         if nd == 0:
             return self
 
-        if inplace:
-            if fdiis[x_keys[0]].size < INCORE_SIZE or self.incore:
-                for key in diis_keys:
-                    self._buffer[key] = numpy.asarray(fdiis[key])
-
-            if 'xprev' in diis_keys:
-                self._xprev = fdiis['xprev']
-
-        else:
-            for key in diis_keys:
-                self._store(key, fdiis[key][()])
-
-            if 'xprev' in diis_keys:
-                self._store('xprev', numpy.asarray(fdiis['xprev']))
-                if 'xprev' in self._buffer:  # incore
-                    self._xprev = self._buffer['xprev']
-                else:
-                    self._xprev = self._diisfile['xprev']
-
         self._bookkeep = list(range(nd))
         self._head = nd
-        vecsize = 0
-
-        e_mat = []
+        self._xs = self._es = None
         for i in range(nd):
-            dti = numpy.asarray(self.get_err_vec(i))
-            vecsize = dti.size
-            for j in range(i+1):
-                dtj = self.get_err_vec(j)
-                assert (dtj.size == vecsize)
-                tmp = 0
-                for p0, p1 in misc.prange(0, vecsize, BLOCK_SIZE):
-                    tmp += numpy.dot(dti[p0:p1].conj(), dtj[p0:p1])
-                e_mat.append(tmp)
-            dti = dtj = None
-        e_mat = numpy_helper.unpack_tril(e_mat)
+            for key in ('x%d'%i, 'e%d'%i):
+                dat = fdiis[key]
+                buf = self._ring(key[0], dat.size, dat.dtype)
+                for p0, p1 in misc.prange(0, dat.size, BLOCK_SIZE):
+                    buf[i,p0:p1] = dat[p0:p1]
+                if not inplace:
+                    self._store(key, buf[i])
+
+        if 'xprev' in diis_keys:
+            self._store('xprev', numpy.asarray(fdiis['xprev']))
+
+        es = self._es
+        vecsize = es.shape[1]
+        e_mat = 0
+        for p0, p1 in misc.prange(0, vecsize, BLOCK_SIZE):
+            e_mat += numpy.dot(es[:nd,p0:p1].conj(), es[:nd,p0:p1].T)
 
         space = max(nd, self.space)
         self._H = numpy.zeros((space+1,space+1), e_mat.dtype)
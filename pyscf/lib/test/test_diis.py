@@ -75,6 +75,23 @@ class KnownValues(unittest.TestCase):
         self.assertAlmostEqual(abs(a.dot(x) - b).max(), 0, 6)
         self.assertAlmostEqual(abs(x - numpy.linalg.solve(a,b)).max(), 0, 6)
 
+    def test_memmap(self):
+        a, b, adiag, arest, x = make_ab(16)
+        ad = lib.diis.DIIS()
+        lib.diis.INCORE_SIZE, bak = 4, lib.diis.INCORE_SIZE
+        try:
+            for i in range(20):
+                e = b - a.dot(x)
+                x = (b - arest.dot(x)) / adiag
+                x = ad.update(x, xerr=e)
+        finally:
+            lib.diis.INCORE_SIZE = bak
+        self.assertTrue(isinstance(ad._xs, numpy.memmap))
+        self.assertEqual(ad._es.shape, (ad.space, 16))
+        self.assertAlmostEqual(abs(x - numpy.linalg.solve(a,b)).max(), 0, 6)
+        es = numpy.asarray(ad._es)
+        self.assertAlmostEqual(abs(ad._H[1:,1:] - es.conj().dot(es.T)).max(), 0, 12)
+
     def test_extrapolate(self):
         a, b, adiag, arest, x = make_ab(16)
         ad = lib.diis.DIIS()
@@ -16,10 +16,20 @@
 import sys
 import ctypes
 import _ctypes
+import hashlib
+from collections import OrderedDict
 import numpy
+import h5py
 from pyscf import lib
 from pyscf import gto
+from pyscf.lib import logger
 from pyscf.gto.moleintor import make_cintopt, make_loc, ascint3
+from pyscf import __config__
+
+Q_COND_CACHE_SIZE = getattr(__config__, 'scf_vhf_q_cond_cache_size', 4)
+# Shell pairs are recomputed individually if the fraction of the changed
+# pairs is smaller than this ratio. Otherwise the entire table is rebuilt.
+Q_COND_PARTIAL_UPDATE_RATIO = getattr(__config__, 'scf_vhf_q_cond_partial_update_ratio', .125)
 
 libcvhf = lib.load_library('libcvhf')
 def _fpointer(name):
@@ -150,7 +160,8 @@ class VHFOpt:
 # TODO: replace VHFOpt in future release
 class _VHFOpt:
     def __init__(self, mol, intor=None, prescreen='CVHFnoscreen',
-                 qcondname=None, dmcondname=None, direct_scf_tol=1e-14):
+                 qcondname=None, dmcondname=None, direct_scf_tol=1e-14,
+                 q_cond_cache=None):
         '''New version of VHFOpt (under development).
 
         If function "qcondname" is presented, the qcond (sqrt(integrals))
@@ -158,6 +169,9 @@ class _VHFOpt:
 
         prescreen, qcondname, dmcondname can be either function pointers or
         names of C functions defined in libcvhf module
+
+        q_cond_cache (an instance of :class:`QCondCache`) can be provided to
+        reuse the qcond computed for the same basis set.
         '''
         self.mol = mol
         self._this = cvhfopt = _CVHFOpt()
@@ -179,12 +193,19 @@ class _VHFOpt:
         self._dmcondname = dmcondname
         self._qcondname = qcondname
         if qcondname is not None and intor is not None:
-            self.init_cvhf_direct(mol, intor, qcondname)
+            self.init_cvhf_direct(mol, intor, qcondname, q_cond_cache)
 
-    def init_cvhf_direct(self, mol, intor, qcondname):
+    def init_cvhf_direct(self, mol, intor, qcondname, q_cond_cache=None):
         '''qcondname can be the function pointer or the name of a C function
         defined in libcvhf module
         '''
+        if q_cond_cache is not None and isinstance(qcondname, str):
+            self.q_cond = q_cond_cache.build(self, mol, intor, qcondname)
+        else:
+            self.q_cond = self._make_q_cond(mol, intor, qcondname)
+        self._qcondname = qcondname
+
+    def _make_q_cond(self, mol, intor, qcondname):
         intor = mol._add_suffix(intor)
         if intor == self._intor:
             cintopt = self._cintopt
@@ -201,9 +222,7 @@ class _VHFOpt:
             fqcond(getattr(libcvhf, intor), cintopt, q_cond.ctypes,
                    ao_loc.ctypes, mol._atm.ctypes, ctypes.c_int(mol.natm),
                    mol._bas.ctypes, ctypes.c_int(nbas), mol._env.ctypes)
-
-        self.q_cond = q_cond
-        self._qcondname = qcondname
+        return q_cond
 
     @property
     def direct_scf_tol(self):
@@ -263,6 +282,130 @@ class _VHFOpt:
         if dm_cond is not None:
             self._this.dm_cond = dm_cond.ctypes.data_as(ctypes.c_void_p)
 
+class QCondCache:
+    '''Cache of the Schwarz conditions (q_cond) of :class:`_VHFOpt`.
+
+    The q_cond tables are keyed by a fingerprint of the basis set (mol._atm,
+    mol._bas and mol._env excluding the atomic coordinates), the integral, the
+    q_cond function and the screening threshold. When the same basis set is
+    placed on a different geometry, the q_cond of a shell pair is reused if the
+    vector between the two atoms of the pair is unchanged (e.g. the pairs on
+    the same atom, or the pairs within a rigidly translated fragment). The
+    other shell pairs are recomputed.
+
+    Attributes:
+        chkfile : str
+            If given, the q_cond tables are saved in the HDF5 file under the
+            key "vhfopt_q_cond", and reloaded when the cache is initialized
+            with the same chkfile (e.g. in a restarted calculation).
+        max_size : int
+            The maximum number of tables held in memory.
+
+    Examples:
+
+    >>> mol = gto.M(atom='H 0 0 0; F 0 0 1.1', basis='ccpvdz')
+    >>> cache = QCondCache()
+    >>> opt = _VHFOpt(mol, 'int2e', 'CVHFnrs8_prescreen', 'CVHFnr_int2e_q_cond',
+    ...               'CVHFnr_dm_cond', 1e-13, q_cond_cache=cache)
+    '''
+    def __init__(self, chkfile=None, max_size=Q_COND_CACHE_SIZE):
+        self.chkfile = chkfile
+        self.max_size = max_size
+        self._tables = OrderedDict()
+
+    @staticmethod
+    def fingerprint(mol, intor, qcondname, direct_scf_tol):
+        '''A hash of the basis set and screening settings. Atomic coordinates
+        are not included.'''
+        env = mol._env.copy()
+        ptr = mol._atm[:,gto.PTR_COORD]
+        env[ptr[:,None] + numpy.arange(3)] = 0
+        h = hashlib.sha1()
+        h.update(mol._atm.tobytes())
+        h.update(mol._bas.tobytes())
+        h.update(env.tobytes())
+        h.update(('%s %s %.6e' % (intor, qcondname, direct_scf_tol)).encode())
+        return h.hexdigest()
+
+    def __len__(self):
+        return len(self._tables)
+
+    def clear(self):
+        self._tables.clear()
+        return self
+
+    def get(self, key):
+        '''Returns the atomic coordinates and the q_cond table of the given
+        key, or None if the key is not cached'''
+        if key in self._tables:
+            self._tables.move_to_end(key)
+            return self._tables[key]
+        if self.chkfile and h5py.is_hdf5(self.chkfile):
+            with h5py.File(self.chkfile, 'r') as f:
+                if 'vhfopt_q_cond/' + key in f:
+                    g = f['vhfopt_q_cond/' + key]
+                    return g['coords'][()], g['q_cond'][()]
+        return None
+
+    def discard(self, key):
+        '''Remove the table of the given key from the cache (and the chkfile)'''
+        self._tables.pop(key, None)
+        if self.chkfile and h5py.is_hdf5(self.chkfile):
+            with h5py.File(self.chkfile, 'a') as f:
+                if 'vhfopt_q_cond/' + key in f:
+                    del f['vhfopt_q_cond/' + key]
+
+    def put(self, key, coords, q_cond):
+        self._tables[key] = (coords, q_cond)
+        self._tables.move_to_end(key)
+        while len(self._tables) > self.max_size:
+            self._tables.popitem(last=False)
+        if self.chkfile:
+            lib.chkfile.dump(self.chkfile, 'vhfopt_q_cond/' + key,
+                             {'coords': coords, 'q_cond': q_cond})
+
+    def build(self, vhfopt, mol, intor, qcondname):
+        '''Generate the q_cond table for vhfopt, reusing the cached tables
+        whenever possible'''
+        intor = mol._add_suffix(intor)
+        tol = vhfopt.direct_scf_tol
+        key = self.fingerprint(mol, intor, qcondname, tol)
+        coords = mol.atom_coords()
+        cached = self.get(key)
+        if cached is None:
+            q_cond = vhfopt._make_q_cond(mol, intor, qcondname)
+            self.put(key, coords, q_cond)
+            return q_cond
+
+        coords_last, q_cond = cached
+        q_cond = q_cond.copy()
+        # The shell pairs whose inter-atomic vectors are changed
+        rab = coords[:,None] - coords
+        rab_last = coords_last[:,None] - coords_last
+        atm_moved = abs(rab - rab_last).max(axis=2) > 1e-12
+        bas_atom = mol._bas[:,gto.ATOM_OF]
+        pair_moved = atm_moved[bas_atom[:,None], bas_atom]
+        ish, jsh = numpy.where(numpy.tril(pair_moved))
+        npair = mol.nbas * (mol.nbas + 1) // 2
+        logger.debug1(mol, 'q_cond cache hit. %d out of %d shell pairs changed',
+                      ish.size, npair)
+        if ish.size == 0:
+            pass
+        elif (qcondname == 'CVHFnr_int2e_q_cond' and
+              ish.size < npair * Q_COND_PARTIAL_UPDATE_RATIO):
+            with mol.with_integral_screen(tol**2):
+                for i, j in zip(ish, jsh):
+                    eri = mol.intor_by_shell(intor, (i, j, i, j))
+                    di, dj = eri.shape[:2]
+                    diag = abs(eri.reshape(di*dj, di*dj).diagonal()).max()
+                    q_cond[i,j] = q_cond[j,i] = max(diag, 1e-200) ** .5
+        else:
+            q_cond = vhfopt._make_q_cond(mol, intor, qcondname)
+        if ish.size > 0:
+            self.put(key, coords, q_cond)
+        return q_cond
+
+
 class SGXOpt(_VHFOpt):
     def __init__(self, mol, intor=None, prescreen='CVHFnoscreen',
                  qcondname=None, dmcondname=None, direct_scf_tol=1e-14):
@@ -16,13 +16,78 @@
 # Author: Qiming Sun <osirpt.sun@gmail.com>
 #
 
+import os
+import hashlib
+import tempfile
 import numpy
 from pyscf import gto
 from pyscf.lib import logger
 from pyscf.lib import param
 from pyscf.data import elements
 from pyscf.scf import hf, rohf, addons
+from pyscf import __config__
 
+# Directory to keep the spherically averaged atomic HF results across
+# processes. Each entry is a small .npz file named by the hash of the atomic
+# basis, ECP and electronic configuration. If not specified, the results are
+# only cached in memory.
+CACHE_DIR = getattr(__config__, 'scf_atom_hf_cache_dir', None)
+
+_atm_cache = {}
+
+def _cache_key(atm, atomic_configuration):
+    '''Hash of the inputs which determine the atomic HF solution'''
+    env = atm._env
+    key = hashlib.sha1()
+    symb = atm.atom_symbol(0)
+    nuc = gto.charge(symb)
+    key.update(repr((gto.mole._std_symbol(symb), atm.nelectron,
+                     atomic_configuration[nuc], str(atm._pseudo))).encode())
+    key.update(numpy.asarray(atm._atm[0,[gto.CHARGE_OF, gto.NUC_MOD_OF]]).tobytes())
+    key.update(env[atm._atm[0,gto.PTR_ZETA]:atm._atm[0,gto.PTR_ZETA]+1].tobytes())
+    for b in atm._bas:
+        nprim, nctr = b[gto.NPRIM_OF], b[gto.NCTR_OF]
+        key.update(b[[gto.ANG_OF, gto.NPRIM_OF, gto.NCTR_OF, gto.KAPPA_OF]].tobytes())
+        key.update(env[b[gto.PTR_EXP]:b[gto.PTR_EXP]+nprim].tobytes())
+        key.update(env[b[gto.PTR_COEFF]:b[gto.PTR_COEFF]+nprim*nctr].tobytes())
+    for b in atm._ecpbas:
+        nprim = b[gto.NPRIM_OF]
+        key.update(b[1:5].tobytes())
+        key.update(env[b[gto.PTR_EXP]:b[gto.PTR_EXP]+nprim].tobytes())
+        key.update(env[b[gto.PTR_COEFF]:b[gto.PTR_COEFF]+nprim].tobytes())
+    return key.hexdigest()
+
+def _load_cache(key):
+    if key in _atm_cache:
+        return _atm_cache[key]
+    if CACHE_DIR:
+        path = os.path.join(CACHE_DIR, key + '.npz')
+        if os.path.isfile(path):
+            try:
+                with numpy.load(path) as f:
+                    result = (float(f['e_tot']), f['mo_energy'], f['mo_coeff'],
+                              f['mo_occ'])
+            except (OSError, KeyError, ValueError):
+                return None
+            _atm_cache[key] = result
+            return result
+    return None
+
+def _save_cache(key, result):
+    _atm_cache[key] = result
+    if CACHE_DIR:
+        e_tot, mo_energy, mo_coeff, mo_occ = result
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # Write to a temporary file then rename, so that concurrent jobs
+            # never read a partially written entry
+            with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix='.npz',
+                                             delete=False) as f:
+                numpy.savez(f, e_tot=e_tot, mo_energy=mo_energy,
+                            mo_coeff=mo_coeff, mo_occ=mo_occ)
+            os.replace(f.name, os.path.join(CACHE_DIR, key + '.npz'))
+        except OSError:
+            pass
 
 def get_atm_nrhf(mol, atomic_configuration=elements.NRSRHF_CONFIGURATION):
     elements = {a[0] for a in mol._atom}
@@ -59,7 +124,16 @@ def get_atm_nrhf(mol, atomic_configuration=elements.NRSRHF_CONFIGURATION):
             mo_occ = mo_energy = numpy.zeros(nao)
             mo_coeff = numpy.zeros((nao,nao))
             atm_scf_result[element] = (0, mo_energy, mo_coeff, mo_occ)
-        elif atm._pseudo:
+            continue
+
+        key = _cache_key(atm, atomic_configuration)
+        result = _load_cache(key)
+        if result is not None:
+            logger.debug(mol, 'Atomic HF for %s loaded from cache', element)
+            atm_scf_result[element] = result
+            continue
+
+        if atm._pseudo:
             from pyscf.scf import atom_hf_pp
             atm.a = None
             if atm.nelectron == 1:
@@ -70,8 +144,6 @@ def get_atm_nrhf(mol, atomic_configuration=elements.NRSRHF_CONFIGURATION):
 
             atm_hf.verbose = mol.verbose
             atm_hf.run()
-            atm_scf_result[element] = (atm_hf.e_tot, atm_hf.mo_energy,
-                                       atm_hf.mo_coeff, atm_hf.mo_occ)
         else:
             if atm.nelectron == 1:
                 atm_hf = AtomHF1e(atm)
@@ -81,8 +153,9 @@ def get_atm_nrhf(mol, atomic_configuration=elements.NRSRHF_CONFIGURATION):
 
             atm_hf.verbose = mol.verbose
             atm_hf.run()
-            atm_scf_result[element] = (atm_hf.e_tot, atm_hf.mo_energy,
-                                       atm_hf.mo_coeff, atm_hf.mo_occ)
+        atm_scf_result[element] = (atm_hf.e_tot, atm_hf.mo_energy,
+                                   atm_hf.mo_coeff, atm_hf.mo_occ)
+        _save_cache(key, atm_scf_result[element])
     return atm_scf_result
 
 
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# Copyright 2014-2025 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Batched SCF driver for many small closed-shell molecules
+
+The molecules are grouped by the number of AOs and orthogonal orbitals. The
+SCF iterations of the molecules in a group run in lockstep. The Fock
+matrices of a group are diagonalized by one batched eigh call. DIIS
+extrapolation is carried out for the whole group with stacked arrays. The
+potential matrices (J/K and XC) of the molecules are evaluated on a shared
+thread pool.
+
+Examples:
+
+>>> from pyscf import gto
+>>> from pyscf.scf import batch
+>>> mols = [gto.M(atom=f'H 0 0 0; F 0 0 {r}', basis='6-31g') for r in (0.9, 1.0, 1.1)]
+>>> mf = batch.BatchSCF(mols, xc='b3lyp').run()
+>>> print(mf.e_tot)
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+from pyscf import lib
+from pyscf.lib import logger
+from pyscf.scf import hf
+from pyscf import __config__
+
+LINDEP_THRESHOLD = getattr(__config__, 'scf_batch_lindep_threshold', 1e-8)
+
+
+def orth_basis(s1e, threshold=LINDEP_THRESHOLD):
+    '''Canonical orthogonalization of the AO basis'''
+    e, v = numpy.linalg.eigh(s1e)
+    mask = e > threshold
+    return v[:,mask] / numpy.sqrt(e[mask])
+
+def _batch_diis(fs, errs, bmat, fock, err, nvec, space):
+    '''CDIIS for a batch of molecules. fs, errs and bmat are the ring buffers
+    of the Fock matrices, error vectors and error overlaps of the batch.
+    The arrays are updated in place.
+    '''
+    nbatch = fock.shape[0]
+    head = nvec % space
+    fs[:,head] = fock
+    errs[:,head] = err
+    nd = min(nvec + 1, space)
+    row = numpy.einsum('bip,bp->bi', errs[:,:nd].conj(), err)
+    bmat[:,head,:nd] = row.conj()
+    bmat[:,:nd,head] = row
+
+    h = numpy.ones((nbatch, nd+1, nd+1))
+    h[:,0,0] = 0
+    h[:,1:,1:] = bmat[:,:nd,:nd]
+    g = numpy.zeros((nbatch, nd+1))
+    g[:,0] = 1
+    try:
+        c = numpy.linalg.solve(h, g[:,:,None])[:,:,0]
+    except numpy.linalg.LinAlgError:
+        c = numpy.array([numpy.linalg.lstsq(h[i], g[i], rcond=1e-14)[0]
+                         for i in range(nbatch)])
+    return numpy.einsum('bi,bipq->bpq', c[:,1:], fs[:,:nd])
+
+
+class BatchSCF(lib.StreamObject):
+    '''SCF iterations in lockstep for a list of closed-shell molecules which
+    share the same method (RHF or RKS with the same functional).
+
+    Attributes:
+        xc : str
+            The functional of RKS. If not specified, RHF is carried out.
+        conv_tol : float
+            Convergence threshold of the energy.
+        conv_tol_grad : float
+            Convergence threshold of the orbital gradients. By default, it is
+            sqrt(conv_tol).
+        max_cycle : int
+            Max number of SCF iterations.
+        diis_space : int
+            DIIS subspace size.
+        diis_start_cycle : int
+            The step to start DIIS.
+        max_workers : int
+            The number of threads to evaluate the potential matrices of
+            different molecules concurrently. Each worker thread uses
+            lib.num_threads()//max_workers OpenMP threads.
+
+    Saved results:
+        mfs : list
+            The SCF objects of the molecules, which hold the orbitals and the
+            energies in the same attributes as after SCF.kernel.
+        e_tot : ndarray
+        converged : ndarray of bool
+    '''
+    conv_tol = getattr(__config__, 'scf_batch_BatchSCF_conv_tol', 1e-9)
+    conv_tol_grad = getattr(__config__, 'scf_batch_BatchSCF_conv_tol_grad', None)
+    max_cycle = getattr(__config__, 'scf_batch_BatchSCF_max_cycle', 50)
+    diis_space = getattr(__config__, 'scf_batch_BatchSCF_diis_space', 8)
+    diis_start_cycle = getattr(__config__, 'scf_batch_BatchSCF_diis_start_cycle', 1)
+
+    _keys = {
+        'mols', 'xc', 'conv_tol', 'conv_tol_grad', 'max_cycle', 'diis_space',
+        'diis_start_cycle', 'max_workers', 'mfs', 'e_tot', 'converged',
+    }
+
+    def __init__(self, mols, xc=None, max_workers=None):
+        self.mols = mols
+        self.xc = xc
+        if max_workers is None:
+            max_workers = lib.num_threads()
+        self.max_workers = max_workers
+        self.verbose = mols[0].verbose
+        self.stdout = mols[0].stdout
+
+##################################################
+# don't modify the following attributes, they are not input options
+        self.mfs = None
+        self.e_tot = None
+        self.converged = None
+
+    def dump_flags(self, verbose=None):
+        log = logger.new_logger(self, verbose)
+        log.info('\n')
+        log.info('******** %s ********', self.__class__)
+        log.info('number of molecules = %d', len(self.mols))
+        log.info('method = %s', 'RKS %s' % self.xc if self.xc else 'RHF')
+        log.info('conv_tol = %g', self.conv_tol)
+        log.info('max_cycle = %d', self.max_cycle)
+        log.info('diis_space = %d', self.diis_space)
+        log.info('max_workers = %d', self.max_workers)
+        return self
+
+    def make_scf(self, mol):
+        '''The SCF object of a single molecule'''
+        if mol.spin != 0:
+            raise NotImplementedError('BatchSCF for open-shell systems')
+        if self.xc is None:
+            mf = hf.RHF(mol)
+        else:
+            from pyscf.dft import rks
+            mf = rks.RKS(mol, xc=self.xc)
+        mf.conv_tol = self.conv_tol
+        mf.conv_tol_grad = self.conv_tol_grad
+        mf.max_cycle = self.max_cycle
+        return mf
+
+    def build(self):
+        self.mfs = [self.make_scf(mol) for mol in self.mols]
+        return self
+
+    def kernel(self):
+        self.dump_flags()
+        if self.mfs is None:
+            self.build()
+        cput0 = (logger.process_clock(), logger.perf_counter())
+        mfs = self.mfs
+        nworkers = max(1, min(self.max_workers, len(mfs)))
+        omp_threads = max(1, lib.num_threads() // nworkers)
+
+        def run(fn, *args):
+            with lib.with_omp_threads(omp_threads):
+                return fn(*args)
+
+        with ThreadPoolExecutor(nworkers) as executor:
+            def pmap(fn, *args):
+                return list(executor.map(run, [fn]*len(args[0]), *args))
+
+            h1e, s1e, dm0, vhf = zip(*pmap(_initialize, mfs))
+            orth = [orth_basis(s) for s in s1e]
+
+            groups = {}
+            for i, x in enumerate(orth):
+                groups.setdefault(x.shape, []).append(i)
+            logger.debug(self, 'Molecules are divided into %d groups', len(groups))
+
+            for idx in groups.values():
+                _kernel_group(self, pmap, [mfs[i] for i in idx],
+                              [h1e[i] for i in idx], [s1e[i] for i in idx],
+                              [dm0[i] for i in idx], [vhf[i] for i in idx],
+                              [orth[i] for i in idx])
+
+        self.e_tot = numpy.array([mf.e_tot for mf in mfs])
+        self.converged = numpy.array([mf.converged for mf in mfs])
+        logger.timer(self, 'BatchSCF', *cput0)
+        logger.note(self, 'converged %d/%d', self.converged.sum(), len(mfs))
+        return self.e_tot
+
+def _initialize(mf):
+    mf.build(mf.mol)
+    mol = mf.mol
+    h1e = mf.get_hcore(mol)
+    s1e = mf.get_ovlp(mol)
+    dm = mf.get_init_guess(mol, mf.init_guess, s1e=s1e)
+    vhf = mf.get_veff(mol, dm)
+    return h1e, s1e, dm, vhf
+
+def _update_veff(mf, h1e, dm, dm_last, vhf_last):
+    vhf = mf.get_veff(mf.mol, dm, dm_last, vhf_last)
+    e_tot = mf.energy_tot(dm, h1e, vhf)
+    return vhf, e_tot
+
+def _kernel_group(bscf, pmap, mfs, h1e, s1e, dm, vhf, orth):
+    '''Lockstep SCF iterations for molecules of the same size'''
+    log = logger.new_logger(bscf)
+    nbatch = len(mfs)
+    nao, nmo = orth[0].shape
+    nocc = numpy.array([mf.mol.nelectron // 2 for mf in mfs])
+    mo_occ = numpy.zeros((nbatch, nmo))
+    for i, n in enumerate(nocc):
+        mo_occ[i,:n] = 2
+
+    conv_tol = bscf.conv_tol
+    conv_tol_grad = bscf.conv_tol_grad
+    if conv_tol_grad is None:
+        conv_tol_grad = numpy.sqrt(conv_tol)
+
+    h1e = numpy.asarray(h1e)
+    s1e = numpy.asarray(s1e)
+    orth = numpy.asarray(orth)
+    dm = list(dm)
+    vhf = list(vhf)
+    e_tot = numpy.array([mf.energy_tot(d, h, v) for mf, d, h, v in zip(mfs, dm, h1e, vhf)])
+
+    space = bscf.diis_space
+    fs = numpy.zeros((nbatch, space, nao, nao))
+    errs = numpy.zeros((nbatch, space, nmo*nmo))
+    bmat = numpy.zeros((nbatch, space, space))
+    ndiis = 0
+
+    converged = numpy.zeros(nbatch, dtype=bool)
+    cycles = numpy.zeros(nbatch, dtype=int)
+    mo_energy = numpy.zeros((nbatch, nmo))
+    mo_coeff = numpy.zeros((nbatch, nao, nmo))
+
+    def make_rdm1(c, occ):
+        return numpy.matmul(c * occ[:,None], c.transpose(0,2,1))
+
+    active = numpy.arange(nbatch)
+    for cycle in range(bscf.max_cycle):
+        if active.size == 0:
+            break
+        a = active
+        dm_a = numpy.asarray([dm[i] for i in a])
+        fock = h1e[a] + numpy.asarray([vhf[i] for i in a])
+        if cycle >= bscf.diis_start_cycle:
+            sdf = s1e[a] @ dm_a @ fock
+            orth_a = orth[a]
+            err = orth_a.transpose(0,2,1) @ (sdf.transpose(0,2,1) - sdf) @ orth_a
+            err = err.reshape(a.size, -1)
+            fs_a, errs_a, bmat_a = fs[a], errs[a], bmat[a]
+            fock = _batch_diis(fs_a, errs_a, bmat_a, fock, err, ndiis, space)
+            fs[a], errs[a], bmat[a] = fs_a, errs_a, bmat_a
+            ndiis += 1
+        e, c = eig(orth[a], fock)
+        mo_energy[a] = e
+        mo_coeff[a] = c
+        dm_new = make_rdm1(c, mo_occ[a])
+
+        results = pmap(_update_veff, [mfs[i] for i in a], list(h1e[a]), list(dm_new),
+                       list(dm_a), [vhf[i] for i in a])
+        last_e = e_tot[a]
+        for k, i in enumerate(a):
+            dm[i] = dm_new[k]
+            vhf[i], e_tot[i] = results[k]
+        cycles[a] = cycle + 1
+
+        fock = h1e[a] + numpy.asarray([vhf[i] for i in a])
+        norm_gorb = _norm_gorb(c, mo_occ[a], fock)
+        conv = (abs(e_tot[a] - last_e) < conv_tol) & (norm_gorb < conv_tol_grad)
+        log.info('cycle= %d  active= %d  max|delta_E|= %4.3g  max|g|= %4.3g',
+                 cycle+1, a.size, abs(e_tot[a] - last_e).max(), norm_gorb.max())
+        converged[a[conv]] = True
+        active = a[~conv]
+
+    # An extra diagonalization without DIIS as in hf.kernel
+    a = numpy.where(converged)[0]
+    if a.size > 0:
+        fock = h1e[a] + numpy.asarray([vhf[i] for i in a])
+        e, c = eig(orth[a], fock)
+        mo_energy[a] = e
+        mo_coeff[a] = c
+        dm_new = make_rdm1(c, mo_occ[a])
+        results = pmap(_update_veff, [mfs[i] for i in a], list(h1e[a]), list(dm_new),
+                       [dm[i] for i in a], [vhf[i] for i in a])
+        for k, i in enumerate(a):
+            dm[i] = dm_new[k]
+            vhf[i], e_tot[i] = results[k]
+
+    for i, mf in enumerate(mfs):
+        mf.converged = bool(converged[i])
+        mf.e_tot = float(e_tot[i])
+        mf.mo_energy = mo_energy[i]
+        mf.mo_coeff = mo_coeff[i]
+        mf.mo_occ = mo_occ[i]
+        mf.cycles = int(cycles[i])
+        mf._finalize()
+    return mfs
+
+def eig(orth, fock):
+    '''Batched generalized eigenvalue problem in the orthogonal basis'''
+    f = orth.transpose(0,2,1) @ fock @ orth
+    e, c = numpy.linalg.eigh(f)
+    return e, numpy.matmul(orth, c)
+
+def _norm_gorb(mo_coeff, mo_occ, fock):
+    '''Norm of RHF orbital gradients for each molecule'''
+    fock_mo = mo_coeff.transpose(0,2,1) @ fock @ mo_coeff
+    norm = []
+    for f, occ in zip(fock_mo, mo_occ):
+        occidx = occ > 0
+        g = f[~occidx][:,occidx] * 2
+        if hf.TIGHT_GRAD_CONV_TOL:
+            norm.append(numpy.linalg.norm(g))
+        else:
+            norm.append(numpy.linalg.norm(g) / numpy.sqrt(max(g.size, 1)))
+    return numpy.array(norm)
@@ -26,14 +26,19 @@ import scipy.linalg
 import scipy.optimize
 from pyscf import lib
 from pyscf.lib import logger
+from pyscf import __config__
 
 DEBUG = False
 
+# Lower bound of the orbital energy gaps in the preconditioner of KDIIS
+KDIIS_GAP_MIN = getattr(__config__, 'scf_diis_kdiis_gap_min', 0.2)
+
 # J. Mol. Struct. 114, 31-34 (1984); DOI:10.1016/S0022-2860(84)87198-7
 # PCCP, 4, 11 (2002); DOI:10.1039/B108658H
 # GEDIIS, JCTC, 2, 835 (2006); DOI:10.1021/ct050275a
 # C2DIIS, IJQC, 45, 31 (1993); DOI:10.1002/qua.560450106
 # SCF-EDIIS, JCP 116, 8255 (2002); DOI:10.1063/1.1470195
+# EDIIS+DIIS, JCP 137, 054110 (2012); DOI:10.1063/1.4740249
 
 # error vector = SDF-FDS
 # error vector = F_ai ~ (S-SDS)*S^{-1}FDS = FDS - SDFDS ~ FDS-SDF in converge
@@ -153,6 +158,11 @@ def ediis_minimize(es, ds, fs):
     ds = ds.reshape(nx,-1,nao,nao)
     fs = fs.reshape(nx,-1,nao,nao)
     df = numpy.einsum('inpq,jnqp->ij', ds, fs).real
+    return _ediis_minimize(es, df)
+
+def _ediis_minimize(es, df):
+    '''EDIIS minimization with df[i,j] = tr(D_i F_j)'''
+    nx = es.size
     diag = df.diagonal()
     df = diag[:,None] + diag - df - df.T
 
@@ -212,6 +222,11 @@ def adiis_minimize(ds, fs, idnewest):
     ds = ds.reshape(nx,-1,nao,nao)
     fs = fs.reshape(nx,-1,nao,nao)
     df = numpy.einsum('inpq,jnqp->ij', ds, fs).real
+    return _adiis_minimize(df, idnewest)
+
+def _adiis_minimize(df, idnewest):
+    '''ADIIS minimization with df[i,j] = tr(D_i F_j)'''
+    nx = df.shape[0]
     d_fn = df[:,idnewest]
     dn_f = df[idnewest]
     dn_fn = df[idnewest,idnewest]
@@ -245,3 +260,271 @@ def adiis_minimize(ds, fs, idnewest):
     res = scipy.optimize.minimize(costf, numpy.ones(nx), method='BFGS',
                                   jac=grad, tol=1e-9)
     return res.fun, (res.x**2)/(res.x**2).sum()
+
+
+class HybridDIIS(lib.diis.DIIS):
+    '''SCF convergence accelerator which combines the DIIS variants.
+
+    The Fock matrices, density matrices and error vectors of the subspace are
+    held in the ring buffers of lib.diis.DIIS (memory-mapped for large
+    vectors, and saved in the DIIS file if filename is given). The overlaps of
+    error vectors and the traces tr(D_i F_j) are updated incrementally for the
+    newest vector.
+
+    Attributes:
+        scheme : str
+            The mixers to use, joined by "+", e.g. "ediis+cdiis". The
+            extrapolation coefficients of the first (global) mixer are used
+            when the error is large. They are blended into the coefficients of
+            the second (local) mixer as the error decreases. Available mixers
+            are the keys of :data:`MIXERS`: cdiis, kdiis, ediis, adiis.
+        blend_start : float
+            When the max-norm of the commutator error is larger than
+            blend_start, only the global mixer is used.
+        blend_end : float
+            When the max-norm of the commutator error is smaller than
+            blend_end, only the local mixer is used.
+        restart_ratio : float
+            The subspace is restarted from the newest vector if the
+            commutator error exceeds restart_ratio times the smallest error in
+            the subspace. Setting it to 0 disables the restart.
+    '''
+    scheme = getattr(__config__, 'scf_diis_HybridDIIS_scheme', 'ediis+cdiis')
+    blend_start = getattr(__config__, 'scf_diis_HybridDIIS_blend_start', 1e-1)
+    blend_end = getattr(__config__, 'scf_diis_HybridDIIS_blend_end', 1e-4)
+    restart_ratio = getattr(__config__, 'scf_diis_HybridDIIS_restart_ratio', 1e2)
+
+    def __init__(self, mf=None, filename=None, Corth=None):
+        lib.diis.DIIS.__init__(self, mf, filename)
+        self.rollback = 0
+        self.space = 8
+        self.Corth = Corth
+        self.damp = 0
+        # Ring buffer of density matrices. The Fock matrices and error vectors
+        # are held in the ring buffers _xs and _es of lib.diis.DIIS
+        self._ds = None
+        self._shapes = None
+        self._etot = None
+        self._errnorm = None
+        self._df = None
+
+    def _mixers(self):
+        mixers = self.scheme.lower().split('+')
+        for key in mixers:
+            if key not in MIXERS:
+                raise KeyError(f'Unknown DIIS mixer {key}. '
+                               f'Available mixers are {list(MIXERS)}')
+        if len(mixers) > 2:
+            raise ValueError(f'At most two mixers can be combined. scheme = {self.scheme}')
+        return mixers
+
+    def _reset_subspace(self, shapes):
+        space = self.space
+        self._shapes = shapes
+        self._xs = self._ds = self._es = None
+        self._H = None
+        self._df = numpy.zeros((space, space))
+        self._etot = numpy.zeros(space)
+        self._errnorm = numpy.zeros(space)
+        self._bookkeep = []
+
+    def get_vec(self, idx):
+        return self._xs[idx].reshape(self._shapes[0])
+
+    def get_dm(self, idx):
+        return self._ds[idx].reshape(self._shapes[1])
+
+    def get_err_vec(self, idx):
+        return self._es[idx].reshape(self._shapes[2])
+
+    def push(self, f, d, errvec, etot=0):
+        '''Store the Fock matrix, density matrix and error vector in the ring
+        buffers. The oldest entry is overwritten when the subspace is full.
+        '''
+        shapes = (f.shape, d.shape, errvec.shape)
+        if self._shapes != shapes:
+            self._reset_subspace(shapes)
+        if len(self._bookkeep) >= self.space:
+            head = self._bookkeep.pop(0)
+        else:
+            head = min(set(range(self.space)).difference(self._bookkeep))
+        self._bookkeep.append(head)
+        self._insert(head, f, d, errvec, etot)
+        return head
+
+    def _insert(self, head, f, d, errvec, etot):
+        self._head = head
+        self._store('x%d' % head, f)
+        self._store('d%d' % head, d)
+        self._store('e%d' % head, errvec)
+        self._etot[head] = etot
+        self._errnorm[head] = abs(errvec).max()
+
+        xs, ds, es = self._xs, self._ds, self._es
+        if self._H is None:
+            self._H = numpy.zeros((self.space, self.space), es.dtype)
+        elif self._H.dtype != es.dtype:
+            self._H = self._H.astype(numpy.result_type(self._H, es))
+        for j in self._bookkeep:
+            self._H[head,j] = numpy.vdot(es[head], es[j])
+            self._H[j,head] = self._H[head,j].conj()
+            # tr(D_i F_j) for hermitian F_j
+            self._df[head,j] = numpy.vdot(xs[j], ds[head]).real
+            self._df[j,head] = numpy.vdot(xs[head], ds[j]).real
+        self._save_subspace()
+
+    def _save_subspace(self):
+        if isinstance(self.filename, str) and self._diisfile is not None:
+            # Bookkeeping data to restore the subspace from the DIIS file
+            fdiis = self._diisfile
+            fshape, dshape, eshape = self._shapes
+            for key, val in (('bookkeep', self._bookkeep), ('energy', self._etot),
+                             ('shape_x', fshape), ('shape_d', dshape),
+                             ('shape_e', eshape)):
+                if key in fdiis:
+                    del fdiis[key]
+                fdiis[key] = numpy.asarray(val)
+            fdiis.flush()
+
+    def restore(self, filename, inplace=True):
+        '''Read the subspace from a DIIS file saved by HybridDIIS'''
+        fdiis = lib.H5TmpFile(filename)
+        if inplace:
+            self.filename = filename
+            self._diisfile = fdiis
+        if 'bookkeep' not in fdiis:
+            return self
+
+        shapes = tuple(tuple(int(n) for n in fdiis['shape_'+key][()])
+                       for key in 'xde')
+        bookkeep = [int(i) for i in fdiis['bookkeep'][()]]
+        etot = fdiis['energy'][()]
+        self.space = max(self.space, len(etot))
+        self._reset_subspace(shapes)
+        for i in bookkeep:
+            f, d, errvec = [numpy.asarray(fdiis['%s%d' % (key, i)]).reshape(shape)
+                            for key, shape in zip('xde', shapes)]
+            self._bookkeep.append(i)
+            self._insert(i, f, d, errvec, etot[i])
+        return self
+
+    def restart(self):
+        '''Drop all vectors from the subspace except the newest one'''
+        self._bookkeep = self._bookkeep[-1:]
+        self._save_subspace()
+        return self
+
+    def update(self, s, d, f, mf=None, h1e=None, vhf=None, *args, **kwargs):
+        mixers = self._mixers()
+        errvec = get_err_vec(s, d, f, self.Corth)
+        logger.debug1(self, 'diis-norm(errvec)=%g', numpy.linalg.norm(errvec))
+        f_prev = kwargs.get('f_prev', None)
+        if abs(self.damp) >= 1e-6 and f_prev is not None:
+            f = f*(1-self.damp) + f_prev*self.damp
+        if 'ediis' in mixers:
+            etot = mf.energy_elec(d, h1e, vhf)[0]
+        else:
+            etot = 0
+        self.push(f, d, errvec, etot)
+
+        err = self._errnorm[self._head]
+        err_min = self._errnorm[self._bookkeep[:-1]].min(initial=numpy.inf)
+        if self.restart_ratio > 0 and err > self.restart_ratio * err_min:
+            logger.debug(self, 'DIIS subspace restarted. |err| = %g', err)
+            self.restart()
+
+        if len(mixers) == 1 or err > self.blend_start:
+            c = MIXERS[mixers[0]](self, s, d)
+        elif err < self.blend_end:
+            c = MIXERS[mixers[1]](self, s, d)
+        else:
+            w = err / self.blend_start
+            c = (MIXERS[mixers[0]](self, s, d) * w +
+                 MIXERS[mixers[1]](self, s, d) * (1 - w))
+        logger.debug1(self, 'diis-c %s', c)
+
+        fock = 0
+        for i, ci in zip(self._bookkeep, c):
+            fock += self.get_vec(i) * ci
+
+        if self.rollback > 0 and len(self._bookkeep) == self.space:
+            self._bookkeep = self._bookkeep[-self.rollback:]
+            self._save_subspace()
+        return fock
+
+def _solve_bordered(h):
+    '''DIIS coefficients for the overlap matrix of error vectors'''
+    nd = h.shape[0]
+    b = numpy.ones((nd+1, nd+1), dtype=h.dtype)
+    b[0,0] = 0
+    b[1:,1:] = h
+    g = numpy.zeros(nd+1, h.dtype)
+    g[0] = 1
+    w, v = scipy.linalg.eigh(b)
+    idx = abs(w) > 1e-14
+    c = numpy.dot(v[:,idx]*(1./w[idx]), numpy.dot(v[:,idx].T.conj(), g))
+    return c[1:]
+
+def cdiis_coeff(mixer, s, d):
+    '''Commutator DIIS'''
+    idx = mixer._bookkeep
+    return _solve_bordered(mixer._H[numpy.ix_(idx, idx)])
+
+def kdiis_coeff(mixer, s, d):
+    '''DIIS of approximate Newton steps. The commutator error vectors are
+    transformed to the eigenbasis of the newest Fock matrix and divided by
+    the orbital energy gaps. The rotations between nearly degenerate orbitals
+    are therefore weighted more than in CDIIS.
+    '''
+    idx = mixer._bookkeep
+    Corth = mixer.Corth
+    if Corth is None:
+        return cdiis_coeff(mixer, s, d)
+
+    Corth = numpy.asarray(Corth)
+    fock = mixer.get_vec(idx[-1])
+    nao, nmo = Corth.shape[-2:]
+    fock = fock.reshape(-1,nao,nao)
+    Corth = Corth.reshape(-1,nao,nmo)
+    nset = len(fock)
+    if len(Corth) != nset or mixer.get_err_vec(idx[-1]).size != nset*nmo**2:
+        return cdiis_coeff(mixer, s, d)
+
+    precond = []
+    for c, f in zip(Corth, fock):
+        e, u = scipy.linalg.eigh(reduce(lib.dot, (c.conj().T, f, c)))
+        gap = numpy.maximum(abs(e[:,None] - e), KDIIS_GAP_MIN)
+        precond.append((u, 1./gap))
+
+    errs = []
+    for i in idx:
+        errvec = mixer.get_err_vec(i).reshape(nset,nmo,nmo)
+        errs.append(numpy.hstack([
+            (reduce(lib.dot, (u.conj().T, err, u)) * gap_inv).ravel()
+            for err, (u, gap_inv) in zip(errvec, precond)]))
+    errs = numpy.array(errs)
+    return _solve_bordered(errs.conj().dot(errs.T))
+
+def ediis_coeff(mixer, s, d):
+    '''EDIIS'''
+    idx = mixer._bookkeep
+    # The quadratic model of the energy
+    # E(sum_i c_i D_i) = sum_i c_i E_i - 1/4 sum_ij c_i c_j tr((D_i-D_j)(F_i-F_j))
+    return _ediis_minimize(mixer._etot[idx], mixer._df[numpy.ix_(idx, idx)]*.25)[1]
+
+def adiis_coeff(mixer, s, d):
+    '''ADIIS'''
+    idx = mixer._bookkeep
+    return _adiis_minimize(mixer._df[numpy.ix_(idx, idx)], len(idx)-1)[1]
+
+# Functions to compute the extrapolation coefficients of the vectors
+# mixer._bookkeep in HybridDIIS. New mixers can be registered here.
+MIXERS = {
+    'cdiis': cdiis_coeff,
+    'kdiis': kdiis_coeff,
+    'ediis': ediis_coeff,
+    'adiis': adiis_coeff,
+}
+
+class KDIIS(HybridDIIS):
+    scheme = 'kdiis'
@@ -22,8 +22,9 @@ Hartree-Fock
 
 import sys
 import tempfile
+import contextlib
 
-from functools import reduce
+from functools import reduce, lru_cache
 import numpy
 import scipy.linalg
 import h5py
@@ -126,7 +127,11 @@ Keyword argument "init_dm" is replaced by "dm0"''')
         dm = dm0
 
     h1e = mf.get_hcore(mol)
-    vhf = mf.get_veff(mol, dm)
+    mf.cycles = 0
+    # Early iterations in reduced precision, see mf.mixed_precision
+    low_precision = bool(mf.mixed_precision)
+    with _precision_env(mf, low_precision):
+        vhf = mf.get_veff(mol, dm)
     e_tot = mf.energy_tot(dm, h1e, vhf)
     logger.info(mf, 'init E= %.15g', e_tot)
 
@@ -166,17 +171,21 @@ Keyword argument "init_dm" is replaced by "dm0"''')
     mf.pre_kernel(locals())
 
     fock_last = None
+    # Status of the incremental Fock build: the number of incremental updates
+    # and the loosest screening threshold since the last full build
+    incfock = (0, mf.direct_scf_tol)
     cput1 = logger.timer(mf, 'initialize scf', *cput0)
-    mf.cycles = 0
     for cycle in range(mf.max_cycle):
         dm_last = dm
         last_hf_e = e_tot
+        mf.cycles = cycle + 1
 
         fock = mf.get_fock(h1e, s1e, vhf, dm, cycle, mf_diis, fock_last=fock_last)
         mo_energy, mo_coeff = mf.eig(fock, s1e)
         mo_occ = mf.get_occ(mo_energy, mo_coeff)
         dm = mf.make_rdm1(mo_coeff, mo_occ)
-        vhf = mf.get_veff(mol, dm, dm_last, vhf)
+        with _precision_env(mf, low_precision):
+            vhf, incfock = get_veff_incremental(mf, mol, dm, dm_last, vhf, *incfock)
         e_tot = mf.energy_tot(dm, h1e, vhf)
 
         # Here Fock matrix is h1e + vhf, without DIIS.  Calling get_fock
@@ -187,11 +196,28 @@ Keyword argument "init_dm" is replaced by "dm0"''')
         norm_gorb = numpy.linalg.norm(mf.get_grad(mo_coeff, mo_occ, fock))
         if not TIGHT_GRAD_CONV_TOL:
             norm_gorb = norm_gorb / numpy.sqrt(norm_gorb.size)
+
+        if low_precision and norm_gorb < mf.mixed_precision_tol:
+            # Rebuild the potential in full precision. The errors of the
+            # reduced precision potential must not enter the converged result.
+            logger.info(mf, 'Switch to full precision at |g|= %4.3g', norm_gorb)
+            low_precision = False
+            _reset_vhfopt(mf)
+            vhf = mf.get_veff(mol, dm)
+            incfock = (0, mf.direct_scf_tol)
+            e_tot = mf.energy_tot(dm, h1e, vhf)
+            fock = mf.get_fock(h1e, s1e, vhf, dm)
+            norm_gorb = numpy.linalg.norm(mf.get_grad(mo_coeff, mo_occ, fock))
+            if not TIGHT_GRAD_CONV_TOL:
+                norm_gorb = norm_gorb / numpy.sqrt(norm_gorb.size)
+
         norm_ddm = numpy.linalg.norm(dm-dm_last)
         logger.info(mf, 'cycle= %d E= %.15g  delta_E= %4.3g  |g|= %4.3g  |ddm|= %4.3g',
                     cycle+1, e_tot, e_tot-last_hf_e, norm_gorb, norm_ddm)
 
-        if callable(mf.check_convergence):
+        if low_precision:
+            scf_conv = False
+        elif callable(mf.check_convergence):
             scf_conv = mf.check_convergence(locals())
         elif abs(e_tot-last_hf_e) < conv_tol and norm_gorb < conv_tol_grad:
             scf_conv = True
@@ -214,7 +240,7 @@ Keyword argument "init_dm" is replaced by "dm0"''')
         mo_energy, mo_coeff = mf.eig(fock, s1e)
         mo_occ = mf.get_occ(mo_energy, mo_coeff)
         dm, dm_last = mf.make_rdm1(mo_coeff, mo_occ), dm
-        vhf = mf.get_veff(mol, dm, dm_last, vhf)
+        vhf, incfock = get_veff_incremental(mf, mol, dm, dm_last, vhf, *incfock)
         e_tot, last_hf_e = mf.energy_tot(dm, h1e, vhf), e_tot
 
         fock = mf.get_fock(h1e, s1e, vhf, dm)
@@ -342,6 +368,12 @@ def get_ovlp(mol):
     return mol.intor_symmetric('int1e_ovlp')
 
 
+@lru_cache(maxsize=None)
+def _load_ano(symb):
+    '''ANO basis for MINAO guess. Parsing the ANO basis file dominates the cost
+    of the MINAO guess for small molecules. The result is shared, don't modify.'''
+    return gto.basis.load('ano', symb)
+
 def init_guess_by_minao(mol):
     '''Generate initial guess density matrix based on ANO basis, then project
     the density matrix to the basis set defined by ``mol``
@@ -367,7 +399,7 @@ def init_guess_by_minao(mol):
             return occ, basis_ano
 
         stdsymb = gto.mole._std_symbol(symb)
-        basis_add = gto.basis.load('ano', stdsymb)
+        basis_add = _load_ano(stdsymb)
 # coreshl defines the core shells to be removed in the initial guess
         coreshl = gto.ecp.core_configuration(nelec_ecp, atom_symbol=stdsymb)
         # coreshl = (0,0,0,0)  # it keeps all core electrons in the initial guess
@@ -1072,6 +1104,111 @@ def get_veff(mol, dm, dm_last=None, vhf_last=None, hermi=1, vhfopt=None):
         vj, vk = get_jk(mol, ddm, hermi, vhfopt)
         return vj - vk * .5 + numpy.asarray(vhf_last)
 
+def get_veff_incremental(mf, mol, dm, dm_last, vhf_last, nincr=0, tol_max=None):
+    r'''Incremental Fock build for direct SCF iterations.
+
+    The potential is updated with the density difference dm - dm_last. The
+    integral screening is carried out on the density difference, and the
+    screening threshold is adapted to the size of the density difference
+
+    .. math::
+
+        \tau = \max(\tau_0, \min(\tau_\mathrm{max}, f |D - D_\mathrm{last}|_\infty))
+
+    where :math:`\tau_0` is :attr:`mf.direct_scf_tol`, :math:`f` is
+    :attr:`mf.incfock_tol_factor` and :math:`\tau_\mathrm{max}` is
+    :attr:`mf.incfock_tol_max`. The threshold is thus tightened to
+    :attr:`mf.direct_scf_tol` as the SCF iterations converge. The potential is
+    rebuilt from the full density matrix every :attr:`mf.rebuild_nsteps`
+    incremental updates, or once the threshold is tightened to
+    :attr:`mf.direct_scf_tol`, to remove the errors accumulated in the
+    incremental updates.
+
+    Args:
+        mf : an instance of SCF class
+
+        dm : ndarray or a list of ndarrays
+            The density matrix.
+        dm_last : ndarray or a list of ndarrays
+            The density matrix of the previous iteration.
+        vhf_last : ndarray or a list of ndarrays
+            The potential associated to dm_last.
+
+    Kwargs:
+        nincr : int
+            The number of incremental updates since the last full build.
+        tol_max : float
+            The loosest screening threshold applied since the last full build.
+
+    Returns:
+        The potential and a tuple (nincr, tol_max) for the next call.
+    '''
+    if tol_max is None:
+        tol_max = mf.direct_scf_tol
+    if not mf.direct_scf or getattr(mf, '_eri', None) is not None:
+        return mf.get_veff(mol, dm, dm_last, vhf_last), (0, tol_max)
+
+    direct_scf_tol = mf.direct_scf_tol
+    ddm = numpy.asarray(dm) - numpy.asarray(dm_last)
+    tol = direct_scf_tol
+    if mf.incfock_tol_factor > 0 and ddm.size > 0:
+        tol = min(mf.incfock_tol_max, abs(ddm).max() * mf.incfock_tol_factor)
+        tol = max(tol, direct_scf_tol)
+
+    rebuild_nsteps = mf.rebuild_nsteps
+    if ((rebuild_nsteps > 0 and nincr >= rebuild_nsteps) or
+        tol <= direct_scf_tol < tol_max):
+        logger.debug(mf, 'Rebuild HF potential after %d incremental updates', nincr)
+        vhf = mf.get_veff(mol, dm)
+        return vhf, (0, direct_scf_tol)
+
+    logger.debug1(mf, 'Incremental Fock build with direct_scf_tol %g', tol)
+    with lib.temporary_env(mf, direct_scf_tol=tol):
+        vhf = mf.get_veff(mol, dm, dm_last, vhf_last)
+    return vhf, (nincr + 1, max(tol, tol_max))
+
+@contextlib.contextmanager
+def _precision_env(mf, low_precision=True):
+    '''Temporarily loosen the integral screening threshold and switch the
+    numerical integration to single precision AO values. See the attributes
+    mixed_precision, mixed_precision_direct_scf_tol of SCF class.
+    '''
+    if not low_precision:
+        yield mf
+        return
+    direct_scf_tol = max(mf.direct_scf_tol, mf.mixed_precision_direct_scf_tol)
+    ni = getattr(mf, '_numint', None)
+    with lib.temporary_env(mf, direct_scf_tol=direct_scf_tol):
+        if ni is None or not hasattr(ni, 'ao_dtype'):
+            yield mf
+        else:
+            with lib.temporary_env(ni, ao_dtype=numpy.float32):
+                yield mf
+
+def _reset_vhfopt(mf):
+    '''Discard the direct SCF optimizers (and their cached Schwarz conditions)
+    which were built with a screening threshold other than mf.direct_scf_tol,
+    e.g. in the reduced precision iterations.
+    '''
+    opts = getattr(mf, '_opt', None)
+    if not isinstance(opts, dict):
+        return mf
+    mol = mf.mol
+    cache = getattr(mf, 'q_cond_cache', None)
+    for omega, opt in list(opts.items()):
+        if opt is None or opt.direct_scf_tol == mf.direct_scf_tol:
+            continue
+        if cache is not None and isinstance(opt._qcondname, str):
+            with mol.with_range_coulomb(omega):
+                key = cache.fingerprint(mol, opt._intor, opt._qcondname,
+                                        opt.direct_scf_tol)
+            cache.discard(key)
+        if omega is None:
+            opts[None] = None
+        else:
+            del opts[omega]
+    return mf
+
 def get_fock(mf, h1e=None, s1e=None, vhf=None, dm=None, cycle=-1, diis=None,
              diis_start_cycle=None, level_shift_factor=None, damp_factor=None,
              fock_last=None):
@@ -1556,6 +1693,11 @@ class SCF_Scanner(lib.SinglePointScanner):
     def __init__(self, mf_obj):
         self.__dict__.update(mf_obj.__dict__)
         self._last_mol_fp = mf_obj.mol.ao_loc
+        if getattr(mf_obj, 'q_cond_cache', None) is None:
+            # Schwarz conditions are reused if the basis set is not changed
+            self.q_cond_cache = _vhf.QCondCache()
+        # Converged densities or orbitals of the previous geometries
+        self._guess_history = []
 
     def __call__(self, mol_or_geom, **kwargs):
         if isinstance(mol_or_geom, gto.MoleBase):
@@ -1566,6 +1708,10 @@ class SCF_Scanner(lib.SinglePointScanner):
         # Cleanup intermediates associated to the previous mol object
         self.reset(mol)
 
+        same_basis = numpy.array_equal(self._last_mol_fp, mol.ao_loc)
+        if not same_basis:
+            self._guess_history = []
+
         if 'dm0' in kwargs:
             dm0 = kwargs.pop('dm0')
         elif self.mo_coeff is None:
@@ -1579,15 +1725,112 @@ class SCF_Scanner(lib.SinglePointScanner):
             # TODO: A robust check should include more comparison on
             # various attributes between current `mol` and the `mol` in
             # last calculation.
-            if numpy.array_equal(self._last_mol_fp, mol.ao_loc):
-                dm0 = self.make_rdm1()
+            if same_basis:
+                if self.dm_extrapolation and len(self._guess_history) > 1:
+                    dm0 = extrapolate_guess(self, mol, self._guess_history)
+                else:
+                    dm0 = self.make_rdm1()
             elif self.chkfile and h5py.is_hdf5(self.chkfile):
                 dm0 = self.from_chk(self.chkfile)
         self.mo_coeff = None  # To avoid last mo_coeff being used by SOSCF
         e_tot = self.kernel(dm0=dm0, **kwargs)
         self._last_mol_fp = mol.ao_loc
+
+        if self.dm_extrapolation and self.dm_extrapolation_nhist > 1:
+            self._guess_history.append(
+                _guess_history_entry(self, self.dm_extrapolation))
+            self._guess_history = self._guess_history[-self.dm_extrapolation_nhist:]
         return e_tot
 
+def aspc_coefficients(n):
+    '''Coefficients of the always stable predictor (ASPC) for the n previous
+    steps, the latest first.
+
+    Ref: J. Kolafa, J. Comput. Chem. 25, 335 (2004); DOI:10.1002/jcc.10385
+    '''
+    from math import comb
+    if n <= 1:
+        return numpy.ones(1)
+    k = n - 2
+    j = numpy.arange(1, k+3)
+    return numpy.array([(-1)**(i+1) * i * comb(2*k+4, k+2-i) / comb(2*k+2, k+1)
+                        for i in j])
+
+def _lowdin(s):
+    e, v = scipy.linalg.eigh(s)
+    s_half = (v * numpy.sqrt(e)).dot(v.conj().T)
+    s_inv_half = (v / numpy.sqrt(e)).dot(v.conj().T)
+    return s_half, s_inv_half
+
+def _occupied_orbitals(mo_coeff, mo_occ):
+    '''Occupied orbitals grouped by the spin channel and the occupation
+    number. The orbitals of the same group can be rotated freely without
+    changing the density matrix.'''
+    mo_coeff = numpy.asarray(mo_coeff)
+    mo_occ = numpy.asarray(mo_occ)
+    if mo_coeff.ndim == 2:
+        mo_coeff = mo_coeff[None]
+        mo_occ = mo_occ[None]
+    groups = []
+    for ispin, occ in enumerate(mo_occ):
+        for n in numpy.unique(occ[occ > 0]):
+            mask = occ == n
+            groups.append((ispin, mask, mo_coeff[ispin][:,mask]))
+    return groups
+
+def _guess_history_entry(mf, method):
+    if method == 'aspc':
+        return numpy.asarray(mf.make_rdm1())
+    elif method == 'mo':
+        s_half = _lowdin(mf.get_ovlp())[0]
+        return [s_half.dot(c) for ispin, mask, c in
+                _occupied_orbitals(mf.mo_coeff, mf.mo_occ)]
+    else:
+        raise ValueError(f'Unknown dm_extrapolation method {method}')
+
+def extrapolate_guess(mf, mol, history):
+    '''Initial guess of density matrix for the new geometry, extrapolated
+    from the converged results of the previous geometries (the latest last).
+
+    With mf.dm_extrapolation = "aspc", density matrices are extrapolated
+    with the ASPC coefficients. With mf.dm_extrapolation = "mo", the occupied
+    orbitals in the Löwdin orthogonalized AO basis are extrapolated, after
+    aligning them to the latest orbitals with the orthogonal Procrustes
+    rotation. The extrapolated orbitals are orthonormalized and transformed
+    back with the overlap matrix of the new geometry.
+    '''
+    coef = aspc_coefficients(len(history))
+    history = history[::-1]
+    if mf.dm_extrapolation == 'aspc':
+        logger.debug(mf, 'ASPC density extrapolation with %d steps', len(history))
+        return sum(c * dm for c, dm in zip(coef, history))
+
+    groups = _occupied_orbitals(mf.mo_coeff, mf.mo_occ)
+    if any(len(orbs) != len(groups) or
+           any(o.shape != g[2].shape for o, g in zip(orbs, groups))
+           for orbs in history):
+        logger.debug(mf, 'Occupation pattern changed. Skip MO extrapolation')
+        return mf.make_rdm1()
+
+    s_inv_half = _lowdin(mf.get_ovlp(mol))[1]
+    mo_coeff = numpy.zeros_like(mf.mo_coeff)
+    mo_occ = numpy.asarray(mf.mo_occ)
+    if mo_coeff.ndim == 2:
+        mo_coeff_spin = mo_coeff[None]
+    else:
+        mo_coeff_spin = mo_coeff
+    for k, (ispin, mask, _) in enumerate(groups):
+        c_ref = history[0][k]
+        c_pred = 0
+        for c, orbs in zip(coef, history):
+            u, _, vh = scipy.linalg.svd(orbs[k].conj().T.dot(c_ref))
+            c_pred = c_pred + c * orbs[k].dot(u.dot(vh))
+        e, v = scipy.linalg.eigh(c_pred.conj().T.dot(c_pred))
+        c_pred = c_pred.dot((v / numpy.sqrt(e)).dot(v.conj().T))
+        mo_coeff_spin[ispin][:,mask] = s_inv_half.dot(c_pred)
+    logger.debug(mf, 'MO extrapolation with %d steps', len(history))
+    return mf.make_rdm1(mo_coeff, mo_occ)
+
 
 class SCF(lib.StreamObject):
     '''SCF base class.   non-relativistic RHF.
@@ -1616,7 +1859,7 @@ class SCF(lib.StreamObject):
             internal format dictionary.
         DIIS : DIIS class
             The class to generate diis object.  It can be one of
-            diis.SCF_DIIS, diis.ADIIS, diis.EDIIS.
+            diis.SCF_DIIS, diis.ADIIS, diis.EDIIS, diis.HybridDIIS, diis.KDIIS.
         diis : boolean or object of DIIS class defined in :mod:`scf.diis`.
             Default is the object associated to the attribute :attr:`self.DIIS`.
             Set it to None/False to turn off DIIS.
@@ -1639,6 +1882,54 @@ class SCF(lib.StreamObject):
             Direct SCF is used by default.
         direct_scf_tol : float
             Direct SCF cutoff threshold.  Default is 1e-13.
+        rebuild_nsteps : int
+            In direct SCF, the HF potential is updated incrementally with the
+            density difference between two iterations. It is rebuilt from the
+            full density matrix every rebuild_nsteps iterations. Setting it to
+            0 disables the periodic rebuild.  Default is 10.
+        incfock_tol_factor : float
+            The screening threshold of the incremental Fock build is
+            max(direct_scf_tol, min(incfock_tol_max, incfock_tol_factor*|ddm|)),
+            where |ddm| is the max-norm of the density difference. Setting it
+            to 0 keeps direct_scf_tol throughout the iterations.
+            Default is 1e-9.
+        incfock_tol_max : float
+            Upper bound of the screening threshold of the incremental Fock
+            build.  Default is 1e-9.
+        q_cond_cache : :class:`_vhf.QCondCache`
+            If given, the Schwarz conditions of direct SCF are reused for the
+            same basis set and updated only for the shell pairs affected by
+            the change of geometry. The scanner of SCF (see
+            :func:`as_scanner`) creates a cache by default.  Default is None.
+        mixed_precision : bool
+            Whether to start the SCF iterations in reduced precision. In this
+            mode, the J/K integrals are screened with
+            mixed_precision_direct_scf_tol and the XC potential is integrated
+            with single precision AO values. The potential is rebuilt in full
+            precision once the orbital gradients (the DIIS error) drop below
+            mixed_precision_tol. The converged results are not affected.
+            Default is False.
+        mixed_precision_tol : float
+            The threshold of the orbital gradients to switch to full
+            precision.  Default is 1e-3.
+        mixed_precision_direct_scf_tol : float
+            Direct SCF cutoff threshold in the reduced precision iterations.
+            Default is 1e-8.
+        dm_extrapolation : str
+            The initial guess of the SCF scanner (see :func:`as_scanner`) for
+            a new geometry. If not specified, the density matrix of the last
+            geometry is used. "aspc" extrapolates the density matrices of the
+            previous geometries with the always stable predictor. "mo"
+            extrapolates the occupied orbitals in the Löwdin orthogonalized
+            AO basis.  Default is None.
+        dm_extrapolation_nhist : int
+            The number of previous geometries used in dm_extrapolation.
+            Default is 4.
+        jk_nproc : int
+            If larger than 1, the J/K matrices of direct SCF are evaluated on
+            a pool of jk_nproc worker processes (see :mod:`scf.jk_mproc`).
+            The OpenMP threads are evenly divided among the workers.
+            Default is 0.
         callback : function(envs_dict) => None
             callback function takes one dict as the argument which is
             generated by the builtin function :func:`locals`, so that the
@@ -1696,6 +1987,17 @@ class SCF(lib.StreamObject):
     level_shift = getattr(__config__, 'scf_hf_SCF_level_shift', 0)
     direct_scf = getattr(__config__, 'scf_hf_SCF_direct_scf', True)
     direct_scf_tol = getattr(__config__, 'scf_hf_SCF_direct_scf_tol', 1e-13)
+    rebuild_nsteps = getattr(__config__, 'scf_hf_SCF_rebuild_nsteps', 10)
+    incfock_tol_factor = getattr(__config__, 'scf_hf_SCF_incfock_tol_factor', 1e-9)
+    incfock_tol_max = getattr(__config__, 'scf_hf_SCF_incfock_tol_max', 1e-9)
+    q_cond_cache = None
+    mixed_precision = getattr(__config__, 'scf_hf_SCF_mixed_precision', False)
+    mixed_precision_tol = getattr(__config__, 'scf_hf_SCF_mixed_precision_tol', 1e-3)
+    mixed_precision_direct_scf_tol = getattr(
+        __config__, 'scf_hf_SCF_mixed_precision_direct_scf_tol', 1e-8)
+    dm_extrapolation = getattr(__config__, 'scf_hf_SCF_dm_extrapolation', None)
+    dm_extrapolation_nhist = getattr(__config__, 'scf_hf_SCF_dm_extrapolation_nhist', 4)
+    jk_nproc = getattr(__config__, 'scf_hf_SCF_jk_nproc', 0)
     conv_check = getattr(__config__, 'scf_hf_SCF_conv_check', True)
 
     callback = None
@@ -1704,7 +2006,10 @@ class SCF(lib.StreamObject):
         'conv_tol', 'conv_tol_grad', 'conv_tol_cpscf', 'max_cycle', 'init_guess',
         'sap_basis', 'DIIS', 'diis', 'diis_space', 'diis_damp', 'diis_start_cycle',
         'diis_file', 'diis_space_rollback', 'damp', 'level_shift',
-        'direct_scf', 'direct_scf_tol', 'conv_check', 'callback',
+        'direct_scf', 'direct_scf_tol', 'rebuild_nsteps', 'incfock_tol_factor',
+        'incfock_tol_max', 'q_cond_cache', 'jk_nproc', 'mixed_precision',
+        'mixed_precision_tol', 'mixed_precision_direct_scf_tol', 'dm_extrapolation',
+        'dm_extrapolation_nhist', 'conv_check', 'callback',
         'mol', 'chkfile', 'mo_energy', 'mo_coeff', 'mo_occ',
         'e_tot', 'converged', 'cycles', 'scf_summary', 'opt',
         'disp', 'disp_with_3body',
@@ -1743,7 +2048,8 @@ class SCF(lib.StreamObject):
         self._eri = None # Note: self._eri requires large amount of memory
 
     __getstate__, __setstate__ = lib.generate_pickle_methods(
-            excludes=('chkfile', '_chkfile', '_opt', '_eri', 'callback'))
+            excludes=('chkfile', '_chkfile', '_opt', '_eri', '_jk_pool',
+                      '_jk_engine', 'callback'))
 
     def __getattr__(self, key):
         '''Accessing methods post-HF methods or mean-field properties'''
@@ -1803,6 +2109,18 @@ class SCF(lib.StreamObject):
         log.info('direct_scf = %s', self.direct_scf)
         if self.direct_scf:
             log.info('direct_scf_tol = %g', self.direct_scf_tol)
+            log.info('rebuild_nsteps = %d', self.rebuild_nsteps)
+            if self.incfock_tol_factor > 0:
+                log.info('incfock_tol_factor = %g', self.incfock_tol_factor)
+                log.info('incfock_tol_max = %g', self.incfock_tol_max)
+            if self.jk_nproc > 1:
+                log.info('jk_nproc = %d', self.jk_nproc)
+        if self.mixed_precision:
+            log.info('mixed_precision = %s  until |g| < %g',
+                     self.mixed_precision, self.mixed_precision_tol)
+        if self.dm_extrapolation:
+            log.info('dm_extrapolation = %s  with %d steps',
+                     self.dm_extrapolation, self.dm_extrapolation_nhist)
         if self.chkfile:
             log.info('chkfile to save SCF result = %s', self.chkfile)
         log.info('max_memory %d MB (current use %d MB)',
@@ -2045,7 +2363,7 @@ This is the Gaussian fit version as described in doi:10.1063/5.0004046.''')
         cpu0 = (logger.process_clock(), logger.perf_counter())
         opt = _vhf._VHFOpt(mol, 'int2e', 'CVHFnrs8_prescreen',
                           'CVHFnr_int2e_q_cond', 'CVHFnr_dm_cond',
-                           self.direct_scf_tol)
+                           self.direct_scf_tol, q_cond_cache=self.q_cond_cache)
         logger.timer(self, 'init_direct_scf', *cpu0)
         return opt
 
@@ -2062,19 +2380,36 @@ This is the Gaussian fit version as described in doi:10.1063/5.0004046.''')
                 self._opt[omega] = self.init_direct_scf(mol)
         vhfopt = self._opt.get(omega)
 
-        if with_j and with_k:
+        if vhfopt is None:
             vj, vk = get_jk(mol, dm, hermi, vhfopt, with_j, with_k, omega)
+        elif self.jk_nproc > 1:
+            from pyscf.scf import jk_mproc
+            vj, vk = jk_mproc.get_jk(self, mol, dm, hermi, with_j, with_k, omega)
         else:
-            if with_j:
+            # direct_scf_tol may be adjusted in the incremental Fock build
+            if with_j and with_k:
+                prescreen = vhfopt.prescreen
+            elif with_j:
                 prescreen = 'CVHFnrs8_vj_prescreen'
             else:
                 prescreen = 'CVHFnrs8_vk_prescreen'
-            with lib.temporary_env(vhfopt, prescreen=prescreen):
+            with lib.temporary_env(vhfopt, prescreen=prescreen,
+                                   direct_scf_tol=self.direct_scf_tol):
                 vj, vk = get_jk(mol, dm, hermi, vhfopt, with_j, with_k, omega)
 
         logger.timer(self, 'vj and vk', *cpu0)
         return vj, vk
 
+    @property
+    def jk_engine(self):
+        '''A :class:`jk.JKEngine` to batch the J/K builds of the density
+        matrices requested by different consumers'''
+        engine = self.__dict__.get('_jk_engine')
+        if engine is None or engine.mf is not self:
+            from pyscf.scf.jk import JKEngine
+            engine = self._jk_engine = JKEngine(self)
+        return engine
+
     def get_j(self, mol=None, dm=None, hermi=1, omega=None):
         '''Compute J matrices for all input density matrices
         '''
@@ -2206,6 +2541,10 @@ This is the Gaussian fit version as described in doi:10.1063/5.0004046.''')
             self.mol = mol
         self._opt = {None: None}
         self._eri = None
+        self._jk_engine = None
+        pool = self.__dict__.pop('_jk_pool', None)
+        if pool is not None:
+            pool.close()
         self.scf_summary = {}
         return self
 
@@ -191,6 +191,150 @@ def get_jk(mols, dms, scripts=['ijkl,ji->kl'], intor='int2e_sph',
 jk_build = get_jk
 
 
+class JKRequest:
+    '''Handle of the J/K matrices requested through :class:`JKEngine`.'''
+    def __init__(self, engine, dms, hermi=1, with_j=True, with_k=True, omega=None):
+        self.engine = engine
+        self.dms = dms
+        self.hermi = hermi
+        self.with_j = with_j
+        self.with_k = with_k
+        self.omega = omega
+        self._result = None
+
+    def done(self):
+        return self._result is not None
+
+    def result(self):
+        '''The J and K matrices of the requested density matrices. All pending
+        requests of the engine are evaluated if the result is not ready.'''
+        if self._result is None:
+            self.engine.flush()
+        return self._result
+
+
+class JKEngine(lib.StreamObject):
+    '''Batched J/K builds for density matrices from different consumers.
+
+    Density matrices are queued by :meth:`submit`. When :meth:`flush` is
+    called, or when the result of any pending request is accessed, the queued
+    density matrices which share the same Coulomb operator (omega) and the
+    same J/K requirements are stacked and passed to :meth:`mf.get_jk` in one
+    call. The two-electron integrals are thus evaluated once for all density
+    matrices in the batch. Results are returned per request. Complex density
+    matrices are batched as their real and imaginary parts.
+
+    Attributes:
+        max_memory : float or int
+            Allowed memory in MB for the J/K matrices of one batch. The
+            density matrices are split into several batches if the memory
+            is not enough.
+
+    Examples:
+
+    >>> mf = scf.RHF(mol).run()
+    >>> engine = mf.jk_engine
+    >>> req1 = engine.submit(dms1, hermi=0)
+    >>> req2 = engine.submit(dms2)
+    >>> vj1, vk1 = req1.result()  # J/K of dms1 and dms2 in one integral pass
+    >>> vj2, vk2 = req2.result()
+    '''
+    def __init__(self, mf):
+        self.mf = mf
+        self.verbose = mf.verbose
+        self.stdout = mf.stdout
+        self.max_memory = mf.max_memory
+        self._pending = []
+        # Statistics: the number of mf.get_jk calls and the number of density
+        # matrices evaluated by the engine
+        self.npasses = 0
+        self.ndms = 0
+
+    def submit(self, dms, hermi=1, with_j=True, with_k=True, omega=None):
+        '''Queue the density matrices. Returns a :class:`JKRequest`.'''
+        req = JKRequest(self, numpy.asarray(dms), hermi, with_j, with_k, omega)
+        self._pending.append(req)
+        return req
+
+    def get_jk(self, dms, hermi=1, with_j=True, with_k=True, omega=None):
+        '''J/K matrices of dms, evaluated together with all pending requests'''
+        return self.submit(dms, hermi, with_j, with_k, omega).result()
+
+    def flush(self):
+        '''Evaluate all pending requests'''
+        pending, self._pending = self._pending, []
+        groups = {}
+        for req in pending:
+            key = (req.omega, req.with_j, req.with_k)
+            groups.setdefault(key, []).append(req)
+
+        mf = self.mf
+        mol = mf.mol
+        for (omega, with_j, with_k), reqs in groups.items():
+            if len(reqs) == 1:
+                # Keep the attributes (e.g. mo_coeff) tagged to dms
+                req = reqs[0]
+                req._result = mf.get_jk(mol, req.dms, req.hermi, with_j, with_k, omega)
+                self.npasses += 1
+                self.ndms += req.dms.size // req.dms.shape[-1]**2
+                continue
+
+            nao = reqs[0].dms.shape[-1]
+            dms = []
+            hermis = set()
+            for req in reqs:
+                dm = req.dms.reshape(-1,nao,nao)
+                if numpy.iscomplexobj(dm):
+                    # The real and imaginary parts of a Hermitian DM are
+                    # symmetric and anti-symmetric
+                    dms.extend((dm.real, dm.imag))
+                    hermis.add(0)
+                else:
+                    dms.append(dm)
+                    hermis.add(req.hermi)
+            dms = numpy.vstack(dms)
+            hermi = hermis.pop() if len(hermis) == 1 else 0
+            ndm = len(dms)
+            max_memory = self.max_memory - lib.current_memory()[0]
+            blksize = int(max_memory*1e6/8/(nao**2*(with_j+with_k+1)))
+            blksize = max(1, min(ndm, blksize))
+            logger.debug(self, 'JKEngine: %d requests, %d density matrices, '
+                         'omega = %s, blksize = %d', len(reqs), ndm, omega, blksize)
+            vjs = []
+            vks = []
+            for p0, p1 in lib.prange(0, ndm, blksize):
+                vj, vk = mf.get_jk(mol, dms[p0:p1], hermi, with_j, with_k, omega)
+                vjs.append(vj)
+                vks.append(vk)
+                self.npasses += 1
+            self.ndms += ndm
+            if with_j:
+                vjs = numpy.vstack(vjs)
+            if with_k:
+                vks = numpy.vstack(vks)
+
+            p1 = 0
+            for req in reqs:
+                shape = req.dms.shape
+                n = req.dms.size // nao**2
+                p0, p1 = p1, p1 + n
+                if numpy.iscomplexobj(req.dms):
+                    p1 += n
+                vj = vk = None
+                if with_j:
+                    vj = vjs[p0:p1]
+                    if numpy.iscomplexobj(req.dms):
+                        vj = vj[:n] + vj[n:] * 1j
+                    vj = vj.reshape(shape)
+                if with_k:
+                    vk = vks[p0:p1]
+                    if numpy.iscomplexobj(req.dms):
+                        vk = vk[:n] + vk[n:] * 1j
+                    vk = vk.reshape(shape)
+                req._result = (vj, vk)
+        return self
+
+
 if __name__ == '__main__':
     mol = gto.M(atom='H 0 -.5 0; H 0 .5 0', basis='cc-pvdz')
 
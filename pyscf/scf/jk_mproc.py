@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# Copyright 2014-2025 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+'''
+Multiprocess J/K builder for direct SCF
+
+The shells are divided into groups. The shell-group quartets (IJ|KL) with
+I >= J, K >= L, IJ >= KL are distributed over a pool of worker processes. Each
+worker evaluates the integrals of its quartets and contracts them with the
+density matrices for all permutation images of the quartet. Density matrices
+and the J/K matrices of each worker are held in shared memory. The parent
+process accumulates the J/K matrices of the workers directly from the shared
+buffers as the workers finish.
+
+The backend is enabled for an SCF object by setting :attr:`SCF.jk_nproc`.
+'''
+
+import weakref
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy
+from pyscf import lib
+from pyscf import gto
+from pyscf.lib import logger
+from pyscf.scf import _vhf
+from pyscf import __config__
+
+# Number of shell groups per worker process. More groups lead to better load
+# balance and more Python overhead.
+GROUPS_PER_PROC = getattr(__config__, 'scf_jk_mproc_groups_per_proc', 4)
+
+# Scripts to contract the integrals (ij|kl) of a shell-group quartet for its
+# 8 permutation images. Bit 0, 1, 2 of the image index indicate the swap of
+# ij, the swap of kl and the swap of bra and ket, respectively.
+#   (ij|kl), (ji|kl), (ij|lk), (ji|lk), (kl|ij), (kl|ji), (lk|ij), (lk|ji)
+_J_SCRIPTS = ('lk->s1ij', 'lk->s1ji', 'kl->s1ij', 'kl->s1ji',
+              'ji->s1kl', 'ij->s1kl', 'ji->s1lk', 'ij->s1lk')
+_K_SCRIPTS = ('jk->s1il', 'ik->s1jl', 'jl->s1ik', 'il->s1jk',
+              'li->s1kj', 'lj->s1ki', 'ki->s1lj', 'kj->s1li')
+
+def _images(ij_equal, kl_equal, braket_equal):
+    '''Indices of the distinct permutation images of a quartet'''
+    idx = []
+    for n in range(8):
+        swap_ij = n & 1
+        swap_kl = n & 2
+        swap_braket = n & 4
+        if ((swap_ij and ij_equal) or (swap_kl and kl_equal) or
+            (swap_braket and braket_equal)):
+            continue
+        idx.append(n)
+    return idx
+
+def shell_groups(mol, ngroups):
+    '''Divide shells into groups with approximately the same number of AOs'''
+    ao_loc = mol.ao_loc
+    nao = ao_loc[-1]
+    ngroups = max(1, min(ngroups, mol.nbas))
+    bounds = numpy.searchsorted(ao_loc, numpy.arange(ngroups+1) * nao / ngroups)
+    bounds[0] = 0
+    bounds[-1] = mol.nbas
+    return numpy.unique(bounds)
+
+def quartet_tasks(mol, groups, ntasks):
+    '''Distribute the shell-group quartets into ntasks with balanced costs'''
+    ao_loc = mol.ao_loc
+    ngroups = len(groups) - 1
+    dims = ao_loc[groups[1:]] - ao_loc[groups[:-1]]
+    quartets = []
+    costs = []
+    for i in range(ngroups):
+        for j in range(i+1):
+            for k in range(i+1):
+                for l in range(k+1):
+                    if k == i and l > j:
+                        continue
+                    nimg = len(_images(i == j, k == l, (i, j) == (k, l)))
+                    quartets.append((i, j, k, l))
+                    # s1 integrals of the quartet plus the contractions
+                    costs.append(dims[i]*dims[j]*dims[k]*dims[l] * (1 + nimg*.25))
+    tasks = [[] for i in range(ntasks)]
+    loads = numpy.zeros(ntasks)
+    for q in numpy.argsort(costs)[::-1]:
+        t = loads.argmin()
+        tasks[t].append(quartets[q])
+        loads[t] += costs[q]
+    return tasks
+
+def contract_quartets(mol, vhfopt, dms, vj, vk, groups, quartets, hermi=1):
+    '''Add the J/K contributions of the shell-group quartets to vj and vk.
+
+    dms is a 3D array. vj and vk are 3D arrays for the output (or None).
+    '''
+    ao_loc = mol.ao_loc
+    atm, bas, env = mol._atm, mol._bas, mol._env
+    intor = mol._add_suffix('int2e')
+    if vhfopt is None:
+        cvhfopt = cintopt = None
+    else:
+        cvhfopt = vhfopt._this
+        cintopt = vhfopt._cintopt
+    n_dm = len(dms)
+    with_j = vj is not None
+    with_k = vk is not None
+
+    for i, j, k, l in quartets:
+        shls_slice = (groups[i], groups[i+1], groups[j], groups[j+1],
+                      groups[k], groups[k+1], groups[l], groups[l+1])
+        i0, i1 = ao_loc[groups[i]], ao_loc[groups[i+1]]
+        if i == j == k == l:
+            # All 4 indices in the same group. Use the 8-fold symmetry as in
+            # _vhf.direct
+            scripts = []
+            if with_j:
+                scripts.extend(['ji->s2kl'] * n_dm)
+            if with_k:
+                if hermi == 1:
+                    scripts.extend(['li->s2kj'] * n_dm)
+                else:
+                    scripts.extend(['li->s1kj'] * n_dm)
+            sub_dms = [dm[i0:i1,i0:i1] for dm in dms] * (with_j + with_k)
+            out = _vhf.nr_direct_drv(intor, 's8', scripts, sub_dms, 1,
+                                     atm, bas, env, cvhfopt, cintopt,
+                                     shls_slice=shls_slice, optimize_sr=False)
+            out = [v[0] for v in out]
+            if with_j:
+                for n in range(n_dm):
+                    vj[n,i0:i1,i0:i1] += lib.hermi_triu(out[n], 1)
+                out = out[n_dm:]
+            if with_k:
+                for n in range(n_dm):
+                    if hermi != 0:
+                        lib.hermi_triu(out[n], hermi, inplace=True)
+                    vk[n,i0:i1,i0:i1] += out[n]
+            continue
+
+        loc = {'i': (ao_loc[groups[i]], ao_loc[groups[i+1]]),
+               'j': (ao_loc[groups[j]], ao_loc[groups[j+1]]),
+               'k': (ao_loc[groups[k]], ao_loc[groups[k+1]]),
+               'l': (ao_loc[groups[l]], ao_loc[groups[l+1]])}
+        def slices(idx):
+            (p0, p1), (q0, q1) = loc[idx[0]], loc[idx[1]]
+            return slice(p0, p1), slice(q0, q1)
+
+        images = _images(i == j, k == l, (i, j) == (k, l))
+        scripts = []
+        if with_j:
+            scripts.extend(_J_SCRIPTS[n] for n in images)
+        if with_k:
+            scripts.extend(_K_SCRIPTS[n] for n in images)
+        jkscripts = []
+        sub_dms = []
+        for script in scripts:
+            dm_idx = script[:2]
+            jkscripts.extend([script] * n_dm)
+            sub_dms.extend([dm[slices(dm_idx)] for dm in dms])
+        out = _vhf.nr_direct_drv(intor, 's1', jkscripts, sub_dms, 1,
+                                 atm, bas, env, cvhfopt, cintopt,
+                                 shls_slice=shls_slice, optimize_sr=False)
+        for m, script in enumerate(scripts):
+            v_idx = script[-2:]
+            if m < len(images) and with_j:
+                v = vj
+            else:
+                v = vk
+            for n in range(n_dm):
+                v[(n,) + slices(v_idx)] += out[m*n_dm+n][0]
+    return vj, vk
+
+
+# Data held by each worker process
+_worker_data = {}
+
+def _worker_init(atm, bas, env, cart, threads):
+    if threads is not None:
+        lib.num_threads(threads)
+    mol = gto.Mole()
+    mol._atm = atm
+    mol._bas = bas
+    mol._env = env
+    mol.cart = cart
+    mol._built = True
+    _worker_data.clear()
+    _worker_data['mol'] = mol
+    # {omega: (vhfopt, the threshold used to build its q_cond)}
+    _worker_data['vhfopt'] = {}
+
+def _worker_run(shm_names, dms_shape, n_out, slot, groups, quartets,
+                hermi, with_j, with_k, omega, direct_scf_tol, prescreen, opt_tol):
+    mol = _worker_data['mol']
+    shm_dm = shared_memory.SharedMemory(name=shm_names[0])
+    shm_out = shared_memory.SharedMemory(name=shm_names[1])
+    try:
+        dms = numpy.ndarray(dms_shape, buffer=shm_dm.buf)
+        out = numpy.ndarray((n_out,) + dms_shape, buffer=shm_out.buf)
+        vjk = out[slot*(with_j+with_k):(slot+1)*(with_j+with_k)]
+        vjk[:] = 0
+        vj = vk = None
+        if with_j:
+            vj = vjk[0]
+        if with_k:
+            vk = vjk[int(with_j)]
+        with mol.with_range_coulomb(omega):
+            vhfopt, tol0 = _worker_data['vhfopt'].get(omega, (None, None))
+            # The Schwarz conditions are built once with opt_tol, the
+            # tightest threshold of the SCF. The looser thresholds of the
+            # incremental Fock build are applied with temporary_env below.
+            if vhfopt is None or tol0 != opt_tol:
+                vhfopt = _vhf._VHFOpt(mol, 'int2e', 'CVHFnrs8_prescreen',
+                                      'CVHFnr_int2e_q_cond', 'CVHFnr_dm_cond',
+                                      opt_tol)
+                _worker_data['vhfopt'][omega] = (vhfopt, opt_tol)
+            vhfopt.set_dm(dms, mol._atm, mol._bas, mol._env)
+            with lib.temporary_env(vhfopt, prescreen=prescreen,
+                                   direct_scf_tol=direct_scf_tol):
+                contract_quartets(mol, vhfopt, dms, vj, vk, groups, quartets, hermi)
+        del dms, out, vjk, vj, vk
+    finally:
+        shm_dm.close()
+        shm_out.close()
+    return slot
+
+
+class ProcessPoolJK:
+    '''J/K builder on a pool of worker processes.
+
+    Args:
+        mol : Mole object
+        nproc : int
+            Number of worker processes.
+
+    Kwargs:
+        threads : int
+            Number of OpenMP threads in each worker. By default,
+            lib.num_threads() is evenly divided among the workers.
+    '''
+    def __init__(self, mol, nproc, threads=None):
+        self.mol = mol
+        self.nproc = nproc
+        if threads is None:
+            threads = max(1, lib.num_threads() // nproc)
+        self.threads = threads
+        self.groups = shell_groups(mol, nproc * GROUPS_PER_PROC)
+        self.tasks = [t for t in quartet_tasks(mol, self.groups, nproc) if t]
+        # Workers are started with spawn. Forking a process after OpenMP
+        # threads were created is not supported by GNU OpenMP.
+        ctx = multiprocessing.get_context('spawn')
+        self._executor = ProcessPoolExecutor(
+            nproc, mp_context=ctx, initializer=_worker_init,
+            initargs=(mol._atm, mol._bas, mol._env, mol.cart, threads))
+        self._finalizer = weakref.finalize(self, self._executor.shutdown, False)
+
+    def close(self):
+        self._finalizer()
+
+    def get_jk(self, dms, hermi=1, with_j=True, with_k=True, omega=None,
+               direct_scf_tol=1e-13, prescreen='CVHFnrs8_prescreen', opt_tol=None):
+        '''J/K matrices for real density matrices
+
+        Kwargs:
+            direct_scf_tol : float
+                Integral screening threshold of this call.
+            opt_tol : float
+                The threshold to build the Schwarz conditions in the workers.
+                It is kept by the workers until a different opt_tol is given.
+                Default is direct_scf_tol.
+        '''
+        if opt_tol is None:
+            opt_tol = direct_scf_tol
+        direct_scf_tol = max(direct_scf_tol, opt_tol)
+        dms = numpy.asarray(dms, dtype=numpy.double)
+        dms_shape = dms.shape
+        nao = dms_shape[-1]
+        dms = dms.reshape(-1,nao,nao)
+        n_jk = with_j + with_k
+        if n_jk == 0:
+            return None, None
+
+        ntasks = len(self.tasks)
+        n_out = ntasks * n_jk
+        shm_dm = shared_memory.SharedMemory(create=True, size=dms.nbytes)
+        shm_out = shared_memory.SharedMemory(create=True, size=n_out*dms.nbytes)
+        try:
+            buf = numpy.ndarray(dms.shape, buffer=shm_dm.buf)
+            buf[:] = dms
+            shm_names = (shm_dm.name, shm_out.name)
+            if omega is None:
+                omega = 0.
+            futures = [self._executor.submit(
+                _worker_run, shm_names, dms.shape, n_out, slot, self.groups,
+                quartets, hermi, with_j, with_k, omega, direct_scf_tol, prescreen,
+                opt_tol)
+                for slot, quartets in enumerate(self.tasks)]
+
+            out = numpy.ndarray((ntasks, n_jk) + dms.shape, buffer=shm_out.buf)
+            # Accumulate the results of the finished workers while the others
+            # are running. The shared buffers are added to vjk in place.
+            vjk = None
+            for f in as_completed(futures):
+                slot = f.result()
+                if vjk is None:
+                    vjk = out[slot].copy()
+                else:
+                    vjk += out[slot]
+            del buf, out
+        finally:
+            shm_dm.close()
+            shm_dm.unlink()
+            shm_out.close()
+            shm_out.unlink()
+
+        vj = vk = None
+        if with_j:
+            vj = vjk[0].reshape(dms_shape)
+        if with_k:
+            vk = vjk[int(with_j)].reshape(dms_shape)
+        return vj, vk
+
+
+def get_jk(mf, mol, dm, hermi=1, with_j=True, with_k=True, omega=None):
+    '''J/K matrices of the SCF object evaluated on the worker processes of
+    mf.jk_nproc'''
+    pool = mf.__dict__.get('_jk_pool')
+    if pool is None or pool.mol is not mol or pool.nproc != mf.jk_nproc:
+        if pool is not None:
+            pool.close()
+        logger.debug(mf, 'Start %d processes for J/K build', mf.jk_nproc)
+        pool = mf._jk_pool = ProcessPoolJK(mol, mf.jk_nproc)
+    if with_j and with_k:
+        prescreen = 'CVHFnrs8_prescreen'
+    elif with_j:
+        prescreen = 'CVHFnrs8_vj_prescreen'
+    else:
+        prescreen = 'CVHFnrs8_vk_prescreen'
+
+    # The workers keep the Schwarz conditions of the threshold of mf._opt.
+    # mf.direct_scf_tol is loosened by the incremental Fock build.
+    opt_tol = getattr(mf._opt.get(omega), 'direct_scf_tol', mf.direct_scf_tol)
+    dm = numpy.asarray(dm)
+    if numpy.iscomplexobj(dm):
+        dms = numpy.stack((dm.real, dm.imag))
+        vj, vk = pool.get_jk(dms, 0, with_j, with_k, omega, mf.direct_scf_tol,
+                             prescreen, opt_tol)
+        if with_j:
+            vj = vj[0] + vj[1] * 1j
+        if with_k:
+            vk = vk[0] + vk[1] * 1j
+        return vj, vk
+    return pool.get_jk(dm, hermi, with_j, with_k, omega, mf.direct_scf_tol,
+                       prescreen, opt_tol)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# Copyright 2014-2025 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import numpy
+from pyscf import gto
+from pyscf import scf
+from pyscf.scf import batch
+
+def setUpModule():
+    global mols
+    mols = [gto.M(atom=f'H 0 0 0; F 0 0 {r}', basis='6-31g', verbose=5,
+                  output='/dev/null') for r in (0.9, 1.1)]
+    mols += [gto.M(atom=f'O 0 0 0; H 0 {r} .587; H 0 -.757 .587', basis='6-31g',
+                   verbose=5, output='/dev/null') for r in (.7, .8)]
+
+def tearDownModule():
+    global mols
+    for mol in mols:
+        mol.stdout.close()
+    del mols
+
+class KnownValues(unittest.TestCase):
+    def test_batch_rhf(self):
+        mf = batch.BatchSCF(mols)
+        e_tot = mf.kernel()
+        self.assertTrue(mf.converged.all())
+        for mol, e in zip(mols, e_tot):
+            ref = scf.RHF(mol).set(conv_tol=1e-9).kernel()
+            self.assertAlmostEqual(e, ref, 8)
+        self.assertEqual(mf.mfs[0].mo_coeff.shape, (11, 11))
+        self.assertAlmostEqual(abs(mf.mfs[0].make_rdm1() - mf.mfs[0].make_rdm1().T).max(), 0, 12)
+
+    def test_batch_rks(self):
+        mf = batch.BatchSCF(mols, xc='pbe', max_workers=2)
+        e_tot = mf.kernel()
+        self.assertTrue(mf.converged.all())
+        for mol, e in zip(mols, e_tot):
+            ref = mol.RKS(xc='pbe').set(conv_tol=1e-9).kernel()
+            self.assertAlmostEqual(e, ref, 8)
+
+
+if __name__ == "__main__":
+    print("Full Tests for batch SCF")
+    unittest.main()
@@ -94,6 +94,71 @@ class KnownValues(unittest.TestCase):
         e = mf.kernel()
         self.assertAlmostEqual(e, eref, 9)
 
+    def test_hybrid_diis(self):
+        mol = gto.M(
+            verbose = 7,
+            output = '/dev/null',
+            atom = '''
+        O     0    0        0
+        H     0    -1.757   1.587
+        H     0    1.757    1.587''',
+            basis = '631g',
+        )
+        for scheme in ('ediis+cdiis', 'adiis+cdiis', 'kdiis', 'cdiis'):
+            mf = scf.RHF(mol)
+            mf.diis = diis.HybridDIIS(mf)
+            mf.diis.scheme = scheme
+            mf.diis.Corth = mf.eig(mf.get_hcore(), mf.get_ovlp())[1]
+            e = mf.kernel()
+            self.assertTrue(mf.converged)
+            self.assertAlmostEqual(e, -75.44606939063496, 9)
+
+        mf = scf.UHF(mol)
+        mf.DIIS = diis.KDIIS
+        mf.kernel()
+        self.assertAlmostEqual(mf.e_tot, -75.44606939063496, 9)
+        mol.stdout.close()
+
+    def test_hybrid_diis_ring_buffer(self):
+        numpy.random.seed(2)
+        nao = 4
+        mixer = diis.HybridDIIS()
+        mixer.space = 3
+        mixer.restart_ratio = 0
+        fs = numpy.random.random((5,nao,nao))
+        ds = numpy.random.random((5,nao,nao))
+        es = numpy.random.random((5,nao*nao))
+        for i in range(5):
+            mixer.push(fs[i], ds[i], es[i])
+        self.assertEqual(mixer._xs.shape, (3, nao*nao))
+        idx = mixer._bookkeep
+        self.assertEqual(len(idx), 3)
+        self.assertAlmostEqual(abs(mixer.get_vec(idx[0]) - fs[2]).max(), 0, 12)
+        self.assertAlmostEqual(abs(mixer.get_dm(idx[2]) - ds[4]).max(), 0, 12)
+        h = mixer._H[numpy.ix_(idx, idx)]
+        self.assertAlmostEqual(abs(h - es[2:].dot(es[2:].T)).max(), 0, 12)
+        df = mixer._df[numpy.ix_(idx, idx)]
+        ref = numpy.einsum('ipq,jqp->ij', ds[2:], fs[2:].transpose(0,2,1))
+        self.assertAlmostEqual(abs(df - ref).max(), 0, 12)
+
+    def test_hybrid_diis_restore(self):
+        mol = gto.M(atom='O 0 0 0; H 0 -1.757 1.587; H 0 1.757 1.587',
+                    basis='631g', verbose=0)
+        ftmp = tempfile.NamedTemporaryFile()
+        mf = scf.RHF(mol)
+        mf.diis = ref = diis.HybridDIIS(mf, ftmp.name)
+        mf.max_cycle = 4
+        mf.kernel()
+
+        mixer = diis.HybridDIIS().restore(ftmp.name)
+        self.assertEqual(mixer._bookkeep, ref._bookkeep)
+        idx = ref._bookkeep
+        self.assertAlmostEqual(abs(mixer._H[numpy.ix_(idx, idx)] -
+                                   ref._H[numpy.ix_(idx, idx)]).max(), 0, 12)
+        self.assertAlmostEqual(abs(mixer._df - ref._df).max(), 0, 12)
+        self.assertAlmostEqual(abs(mixer._etot - ref._etot).max(), 0, 12)
+        self.assertAlmostEqual(abs(mixer.get_dm(idx[-1]) - ref.get_dm(idx[-1])).max(), 0, 12)
+
     # issue 1524
     def test_diis_for_symmetry_adapted_scf(self):
         mol = gto.M(atom='O', spin=2, basis='ccpvdz', symmetry=True)
@@ -109,6 +109,56 @@ class KnownValues(unittest.TestCase):
         self.assertAlmostEqual(abs(vj1-vj0).max(), 0, 9)
         self.assertAlmostEqual(lib.fp(vj0), 28.36214139459754, 6)
 
+    def test_jk_engine(self):
+        numpy.random.seed(1)
+        nao = mol.nao
+        dm1 = numpy.random.random((2,nao,nao))
+        dm2 = numpy.random.random((nao,nao))
+        dm2 = dm2 + dm2.T
+        dm3 = numpy.random.random((3,nao,nao)) + 1j*numpy.random.random((3,nao,nao))
+        dm3 = dm3 + dm3.conj().transpose(0,2,1)
+        engine = mf.jk_engine
+        self.assertTrue(engine is mf.jk_engine)
+        r1 = engine.submit(dm1, hermi=0)
+        r2 = engine.submit(dm2, hermi=1)
+        r3 = engine.submit(dm3, hermi=1)
+        r4 = engine.submit(dm2, with_k=False)
+        self.assertFalse(r1.done())
+        vj, vk = r2.result()
+        self.assertTrue(r1.done() and r3.done() and r4.done())
+        self.assertEqual(engine.npasses, 2)
+        self.assertEqual(engine.ndms, 10)
+
+        ref = mf.get_jk(mol, dm2)
+        self.assertAlmostEqual(abs(vj - ref[0]).max(), 0, 12)
+        self.assertAlmostEqual(abs(vk - ref[1]).max(), 0, 12)
+        vj, vk = r1.result()
+        ref = mf.get_jk(mol, dm1, hermi=0)
+        self.assertEqual(vj.shape, dm1.shape)
+        self.assertFalse(numpy.iscomplexobj(vj))
+        self.assertAlmostEqual(abs(vj - ref[0]).max(), 0, 12)
+        self.assertAlmostEqual(abs(vk - ref[1]).max(), 0, 12)
+        vj, vk = r3.result()
+        ref = mf.get_jk(mol, dm3, hermi=0)
+        self.assertEqual(vk.shape, dm3.shape)
+        self.assertAlmostEqual(abs(vj - ref[0]).max(), 0, 12)
+        self.assertAlmostEqual(abs(vk - ref[1]).max(), 0, 12)
+        vj, vk = r4.result()
+        self.assertTrue(vk is None)
+        self.assertAlmostEqual(abs(vj - mf.get_j(mol, dm2)).max(), 0, 12)
+
+        # Batches are split by max_memory
+        mf1 = scf.RHF(mol)
+        mf1.max_memory = 0
+        engine = mf1.jk_engine
+        r1 = engine.submit(dm1, hermi=0, with_j=False)
+        r2 = engine.submit(dm2, with_j=False)
+        self.assertAlmostEqual(abs(r2.result()[1] - mf1.get_k(mol, dm2)).max(), 0, 12)
+        self.assertAlmostEqual(abs(r1.result()[1] - mf1.get_k(mol, dm1, hermi=0)).max(), 0, 12)
+        self.assertEqual(engine.npasses, 3)
+        mf1.reset()
+        self.assertTrue(mf1.jk_engine is not engine)
+
     def test_vk_s8(self):
         mol = gto.M(atom='H 0 -.5 0; H 0 .5 0; H 1.1 0.2 0.2; H 0.6 0.5 0.4',
                     basis='cc-pvdz')
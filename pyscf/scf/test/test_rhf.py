@@ -16,6 +16,7 @@
 # Author: Qiming Sun <osirpt.sun@gmail.com>
 #
 
+import os
 import numpy
 import unittest
 import tempfile
@@ -23,6 +24,7 @@ from pyscf import lib
 from pyscf import gto
 from pyscf import scf
 from pyscf.scf import atom_hf
+from pyscf.scf import _vhf
 
 import sys
 try:
@@ -228,6 +230,24 @@ class KnownValues(unittest.TestCase):
         self.assertAlmostEqual(scf_result['Ba'][0], -25.07089468572715, 9)
         self.assertAlmostEqual(scf_result['Cu'][0], -194.92388639203045, 9)
 
+    def test_atom_hf_cache(self):
+        dm_ref = scf.hf.init_guess_by_atom(mol)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            atom_hf.CACHE_DIR, bak = cache_dir, atom_hf.CACHE_DIR
+            atom_hf._atm_cache.clear()
+            try:
+                dm = scf.hf.init_guess_by_atom(mol)
+                self.assertEqual(len(os.listdir(cache_dir)), 2)
+                atom_hf._atm_cache.clear()
+                scf_result = atom_hf.get_atm_nrhf(mol)
+                self.assertEqual(len(atom_hf._atm_cache), 2)
+                dm1 = scf.hf.init_guess_by_atom(mol)
+            finally:
+                atom_hf.CACHE_DIR = bak
+        self.assertAlmostEqual(abs(dm - dm_ref).max(), 0, 12)
+        self.assertAlmostEqual(abs(dm1 - dm_ref).max(), 0, 12)
+        self.assertAlmostEqual(scf_result['O'][0], -74.26918712563436, 9)
+
     def test_init_guess_chk(self):
         dm = mol.HF(chkfile=tempfile.NamedTemporaryFile().name).get_init_guess(mol, key='chkfile')
         self.assertAlmostEqual(lib.fp(dm), 2.5912875957299684, 5)
@@ -773,6 +793,21 @@ H     0    0.757    0.587'''
         e = mfs(mol1)
         self.assertAlmostEqual(e, -1.1163913004438035, 9)
 
+    def test_scanner_dm_extrapolation(self):
+        self.assertAlmostEqual(abs(scf.hf.aspc_coefficients(3) - [2.5, -2, .5]).max(), 0, 12)
+        mol1 = gto.M(atom='O 0 0 0; H 0 -0.757 0.587; H 0 0.757 0.587',
+                     basis='631g', verbose=0)
+        geoms = [f'O 0 0 {0.02*i}; H 0 -0.757 0.587; H 0 0.757 0.587'
+                 for i in range(5)]
+        ref = [mol1.RHF(conv_tol=1e-10).as_scanner()(g) for g in geoms]
+        for method in ('aspc', 'mo'):
+            for cls in (scf.RHF, scf.UHF):
+                mf_scanner = cls(mol1).set(conv_tol=1e-10, dm_extrapolation=method)
+                mf_scanner = mf_scanner.as_scanner()
+                for g, e_ref in zip(geoms, ref):
+                    self.assertAlmostEqual(mf_scanner(g), e_ref, 8)
+                self.assertEqual(len(mf_scanner._guess_history), 4)
+
     def test_natm_eq_0(self):
         mol = gto.M()
         mol.nelectron = 2
@@ -927,6 +962,73 @@ H     0    0.757    0.587'''
         self.assertAlmostEqual(abs(vk1 - vk2).max(), 0, 12)
         self.assertAlmostEqual(lib.fp(vk1), -12.365527167710301, 12)
 
+    def test_incremental_fock(self):
+        mf1 = scf.RHF(mol)
+        mf1.max_memory = 0
+        mf1.conv_tol = 1e-10
+        mf1.rebuild_nsteps = 3
+        e1 = mf1.kernel()
+        self.assertAlmostEqual(e1, mf.e_tot, 9)
+
+        dm0 = mf.get_init_guess()
+        dm1 = mf.make_rdm1()
+        vhf0 = mf1.get_veff(mol, dm0)
+        mf1.incfock_tol_factor = 1e-9
+        vhf1, (nincr, tol) = scf.hf.get_veff_incremental(mf1, mol, dm1, dm0, vhf0)
+        self.assertEqual(nincr, 1)
+        self.assertTrue(mf1.direct_scf_tol < tol <= mf1.incfock_tol_max)
+        self.assertAlmostEqual(abs(vhf1 - mf1.get_veff(mol, dm1)).max(), 0, 6)
+
+        # rebuild once direct_scf_tol is recovered
+        vhf2, (nincr, tol) = scf.hf.get_veff_incremental(
+            mf1, mol, dm1, dm1, vhf1, nincr, tol)
+        self.assertEqual(nincr, 0)
+        self.assertEqual(tol, mf1.direct_scf_tol)
+        self.assertAlmostEqual(abs(vhf2 - mf1.get_veff(mol, dm1)).max(), 0, 12)
+
+    def test_mixed_precision_vhfopt(self):
+        mf1 = scf.RHF(mol)
+        mf1.max_memory = 0
+        mf1.q_cond_cache = _vhf.QCondCache()
+        mf1.mixed_precision = True
+        e1 = mf1.kernel()
+        self.assertAlmostEqual(e1, mf.e_tot, 9)
+        # The optimizer of the reduced precision iterations is discarded
+        self.assertEqual(mf1._opt[None].direct_scf_tol, mf1.direct_scf_tol)
+        self.assertEqual(len(mf1.q_cond_cache), 1)
+
+    def test_jk_nproc(self):
+        numpy.random.seed(1)
+        nao = mol.nao
+        dm = numpy.random.random((2,nao,nao))
+        dm1 = dm + dm.transpose(0,2,1)
+        mf1 = scf.RHF(mol)
+        mf1.max_memory = 0
+        vj0, vk0 = mf1.get_jk(mol, dm1)
+        vj1, vk1 = mf1.get_jk(mol, dm, hermi=0)
+        vk2 = mf1.get_k(mol, dm1, omega=.5)
+
+        mf1.jk_nproc = 2
+        try:
+            vj, vk = mf1.get_jk(mol, dm1)
+            self.assertAlmostEqual(abs(vj - vj0).max(), 0, 9)
+            self.assertAlmostEqual(abs(vk - vk0).max(), 0, 9)
+            vj, vk = mf1.get_jk(mol, dm, hermi=0)
+            self.assertAlmostEqual(abs(vj - vj1).max(), 0, 9)
+            self.assertAlmostEqual(abs(vk - vk1).max(), 0, 9)
+            vk = mf1.get_k(mol, dm1, omega=.5)
+            self.assertAlmostEqual(abs(vk - vk2).max(), 0, 9)
+
+            # Workers follow the threshold of the incremental Fock build
+            mf1.reset()
+            with lib.temporary_env(mf1, direct_scf_tol=1e-3):
+                mf1.get_jk(mol, dm1)
+            vj, vk = mf1.get_jk(mol, dm1)
+            self.assertAlmostEqual(abs(vj - vj0).max(), 0, 9)
+            self.assertAlmostEqual(abs(vk - vk0).max(), 0, 9)
+        finally:
+            mf1.reset()
+
     def test_get_vj_lr(self):
         numpy.random.seed(1)
         nao = mol.nao
@@ -17,6 +17,7 @@
 #
 
 import ctypes
+import tempfile
 import numpy
 import unittest
 from pyscf import gto
@@ -197,9 +198,61 @@ class KnownValues(unittest.TestCase):
         self.assertAlmostEqual(abs(ref - vjk).max(), 0, 12)
         self.assertAlmostEqual(lib.fp(vjk), 25.317344717490613, 12)
 
+    def test_q_cond_cache(self):
+        mol = gto.M(atom="""
+            O     0    0        0
+            H     0    -0.757   0.587
+            H     0    0.757    0.587
+            He    3.   0.       0.""", basis='631g')
+        cache = _vhf.QCondCache(chkfile=tempfile.NamedTemporaryFile().name)
+        def make_opt(mol, cache=None):
+            return _vhf._VHFOpt(mol, 'int2e', 'CVHFnrs8_prescreen',
+                                'CVHFnr_int2e_q_cond', 'CVHFnr_dm_cond', 1e-13,
+                                q_cond_cache=cache)
+        q0 = make_opt(mol, cache).q_cond
+        self.assertEqual(len(cache), 1)
+        self.assertAlmostEqual(abs(q0 - make_opt(mol).q_cond).max(), 0, 14)
+        self.assertAlmostEqual(abs(q0 - make_opt(mol, cache).q_cond).max(), 0, 14)
+
+        # Only the pairs between He and the rest are affected
+        mol1 = mol.set_geom_("""
+            O     0    0        0
+            H     0    -0.757   0.587
+            H     0    0.757    0.587
+            He    3.5  0.       0.""", inplace=False)
+        q1 = make_opt(mol1, cache).q_cond
+        self.assertAlmostEqual(abs(q1 - make_opt(mol1).q_cond).max(), 0, 14)
+        self.assertEqual(len(cache), 1)
+
+        mol2 = mol.set_geom_("""
+            O     0    0.1      0
+            H     0    -0.757   0.587
+            H     0    0.757    0.687
+            He    3.5  0.       0.""", inplace=False)
+        q2 = make_opt(mol2, cache).q_cond
+        self.assertAlmostEqual(abs(q2 - make_opt(mol2).q_cond).max(), 0, 14)
+
+        # Reload from chkfile
+        cache1 = _vhf.QCondCache(chkfile=cache.chkfile)
+        key = cache.fingerprint(mol2, 'int2e_sph', 'CVHFnr_int2e_q_cond', 1e-13)
+        coords, q3 = cache1.get(key)
+        self.assertAlmostEqual(abs(coords - mol2.atom_coords()).max(), 0, 14)
+        self.assertAlmostEqual(abs(q3 - q2).max(), 0, 14)
+
+    def test_scanner_q_cond_cache(self):
+        mf_scanner = scf.RHF(mol).set(verbose=0).as_scanner()
+        self.assertTrue(isinstance(mf_scanner.q_cond_cache, _vhf.QCondCache))
+        mf_scanner.max_memory = 0
+        e1 = mf_scanner(mol.set_geom_('O 0 0 0; H 0 -.757 .587; H 0 .757 .6',
+                                      inplace=False))
+        e2 = scf.RHF(mf_scanner.mol).set(verbose=0).kernel()
+        self.assertAlmostEqual(e1, e2, 9)
+        self.assertEqual(len(mf_scanner.q_cond_cache), 1)
+
 MIN_CUTOFF = 1e-44
 libcvhf = _vhf.libcvhf
 
+
 class _VHFOpt(_vhf._VHFOpt):
     def __init__(self, mol, intor=None, prescreen='CVHFnoscreen',
                  qcondname=None, dmcondname=None, direct_scf_tol=1e-14,
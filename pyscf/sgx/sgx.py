@@ -31,7 +31,12 @@ from pyscf.sgx import sgx_jk
 from pyscf.df import df_jk
 from pyscf import __config__
 
-def sgx_fit(mf, auxbasis=None, with_df=None, pjs=False):
+# sgx_fit does not modify SCF objects of the systems which have less AOs than
+# this threshold. Setting it in the config file makes sgx_fit replace the
+# exact exchange for large systems only.
+SGX_FIT_NAO_THRESHOLD = getattr(__config__, 'sgx_sgx_fit_nao_threshold', 0)
+
+def sgx_fit(mf, auxbasis=None, with_df=None, pjs=False, nao_threshold=None):
     '''For the given SCF object, update the J, K matrix constructor with
     corresponding SGX or density fitting integrals.
 
@@ -50,6 +55,11 @@ def sgx_fit(mf, auxbasis=None, with_df=None, pjs=False):
             by the density matrix). Default False. If True, dfj is set to True
             automatically at the beginning of the calculation, as this screening
             is only for K-matrix elements.
+        nao_threshold : int
+            If the system has less AOs than nao_threshold, the SCF object is
+            returned unchanged. It allows sgx_fit to be applied to systems of
+            any size while the exact J, K builder is kept for small systems.
+            Default is SGX_FIT_NAO_THRESHOLD.
 
     Returns:
         An SCF object with a modified J, K matrix constructor which uses density
@@ -71,6 +81,13 @@ def sgx_fit(mf, auxbasis=None, with_df=None, pjs=False):
     from pyscf.df.addons import predefined_auxbasis
     assert (isinstance(mf, scf.hf.SCF))
 
+    if nao_threshold is None:
+        nao_threshold = SGX_FIT_NAO_THRESHOLD
+    if mf.mol.nao < nao_threshold and not isinstance(mf, _SGXHF):
+        logger.info(mf, 'nao = %d < %d. Exact J and K are used.',
+                    mf.mol.nao, nao_threshold)
+        return mf
+
     if with_df is None:
         mol = mf.mol
         if auxbasis is None:
@@ -53,6 +53,7 @@ from pyscf.df.incore import aux_e2
 from pyscf.gto import moleintor
 from pyscf.scf import _vhf
 from pyscf.dft import gen_grid
+from pyscf.dft import numint
 
 
 def get_jk_favork(sgx, dm, hermi=1, with_j=True, with_k=True,
@@ -87,11 +88,11 @@ def get_jk_favork(sgx, dm, hermi=1, with_j=True, with_k=True,
     for i0, i1 in lib.prange(0, ngrids, blksize):
         coords = grids.coords[i0:i1]
         weights = grids.weights[i0:i1,None]
-        ao = mol.eval_gto('GTOval', coords)
+        ao, idx = _eval_ao_screened(mol, coords)
         wao = ao * grids.weights[i0:i1,None]
-        sn += lib.dot(ao.T, wao)
+        sn[idx[:,None],idx] += lib.dot(ao.T, wao)
 
-        fg = lib.einsum('gi,xij->xgj', wao, dms)
+        fg = lib.einsum('gi,xij->xgj', wao, dms[:,idx])
         mask = numpy.zeros(i1-i0, dtype=bool)
         for i in range(nset):
             mask |= numpy.any(fg[i]>gthrd, axis=1)
@@ -120,10 +121,10 @@ def get_jk_favork(sgx, dm, hermi=1, with_j=True, with_k=True,
         if with_j:
             xj = lib.einsum('gv,xg->xgv', ao, jg)
             for i in range(nset):
-                vj[i] += lib.einsum('gu,gv->uv', wao, xj[i])
+                vj[i][idx[:,None],idx] += lib.einsum('gu,gv->uv', wao, xj[i])
         if with_k:
             for i in range(nset):
-                vk[i] += lib.einsum('gu,gv->uv', ao, gv[i])
+                vk[i][idx] += lib.einsum('gu,gv->uv', ao, gv[i])
         jg = gv = None
 
     t2 = logger.timer_debug1(mol, "sgX J/K builder", *t1)
@@ -172,9 +173,9 @@ def get_jk_favorj(sgx, dm, hermi=1, with_j=True, with_k=True,
     blksize = min(ngrids, max(4, int(min(sblk, max_memory*1e6/8/nao**2))))
     for i0, i1 in lib.prange(0, ngrids, blksize):
         coords = grids.coords[i0:i1]
-        ao = mol.eval_gto('GTOval', coords)
+        ao, idx = _eval_ao_screened(mol, coords)
         wao = ao * grids.weights[i0:i1,None]
-        sn += lib.dot(ao.T, wao)
+        sn[idx[:,None],idx] += lib.dot(ao.T, wao)
 
     ovlp = mol.intor_symmetric('int1e_ovlp')
     proj = scipy.linalg.solve(sn, ovlp)
@@ -187,10 +188,10 @@ def get_jk_favorj(sgx, dm, hermi=1, with_j=True, with_k=True,
     for i0, i1 in lib.prange(0, ngrids, blksize):
         coords = grids.coords[i0:i1]
         weights = grids.weights[i0:i1,None]
-        ao = mol.eval_gto('GTOval', coords)
+        ao, idx = _eval_ao_screened(mol, coords)
         wao = ao * grids.weights[i0:i1,None]
 
-        fg = lib.einsum('gi,xij->xgj', wao, proj_dm)
+        fg = lib.einsum('gi,xij->xgj', wao, proj_dm[:,idx])
         mask = numpy.zeros(i1-i0, dtype=bool)
         for i in range(nset):
             mask |= numpy.any(fg[i]>gthrd, axis=1)
@@ -202,7 +203,7 @@ def get_jk_favorj(sgx, dm, hermi=1, with_j=True, with_k=True,
             weights = weights[mask]
 
         if with_j:
-            rhog = numpy.einsum('xgu,gu->xg', fg, ao)
+            rhog = numpy.einsum('xgu,gu->xg', fg[:,:,idx], ao)
         else:
             rhog = None
 
@@ -225,7 +226,7 @@ def get_jk_favorj(sgx, dm, hermi=1, with_j=True, with_k=True,
             vj += jpart
         if with_k:
             for i in range(nset):
-                vk[i] += lib.einsum('gu,gv->uv', ao, gv[i])
+                vk[i][idx] += lib.einsum('gu,gv->uv', ao, gv[i])
         jpart = gv = None
 
     t2 = logger.timer_debug1(mol, "sgX J/K builder", *t1)
@@ -241,6 +242,15 @@ def get_jk_favorj(sgx, dm, hermi=1, with_j=True, with_k=True,
     logger.timer(mol, "vj and vk", *t0)
     return vj.reshape(dm_shape), vk.reshape(dm_shape)
 
+def _eval_ao_screened(mol, coords):
+    '''AO values on the grids and the indices of the AOs which are not
+    negligible on the grids. In large systems, only a small number of AOs are
+    significant in a grid block, and the AO evaluation and the contractions
+    with the density matrices can be restricted to these AOs.
+    '''
+    ao = numint.eval_ao_sparse(mol, coords)
+    return ao.ao, ao.ao_idx
+
 def _gen_batch_nuc(mol):
     '''Coulomb integrals of the given points and orbital pairs'''
     cintopt = gto.moleintor.make_cintopt(mol._atm, mol._bas, mol._env, 'int3c2e')
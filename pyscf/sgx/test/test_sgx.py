@@ -70,6 +70,13 @@ class KnownValues(unittest.TestCase):
         energy = mf.kernel()
         self.assertAlmostEqual(energy, -76.0267979, 6)
 
+    def test_sgx_fit_nao_threshold(self):
+        mol = gto.M(atom='H 0 0 0; F 0 0 1', basis='ccpvdz', verbose=0)
+        mf = scf.RHF(mol)
+        self.assertTrue(sgx.sgx_fit(mf, nao_threshold=mol.nao+1) is mf)
+        mf1 = sgx.sgx_fit(mf, nao_threshold=mol.nao)
+        self.assertTrue(isinstance(mf1, sgx._SGXHF))
+
 if __name__ == "__main__":
     print("Full Tests for SGX")
     unittest.main()